@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Works out which images a set of changed paths affects:
+    1) Indexes every '<tool>/<version>/Dockerfile' in the repository by its build context directory, along with the files its
+       COPY and ADD instructions take from that context
+    2) Looks up each changed path by its directory prefixes: a change to an image's Dockerfile, .dockerignore or a file it copies
+       means the image has to be rebuilt, a change to its unittest.yml only means it has to be retested, and any other file in
+       the context does not reach the image
+    3) Adds every descendant of a rebuilt image that has a Dockerfile in the repository, following both the FROM lines and the
+       relations.yaml graph, since they build on top of it
+    4) Returns separate rebuild and retest sets, every rebuilt image being retested as well
+"""
+
+import os
+import sys
+import json
+import glob
+import fnmatch
+import argparse
+import build_planner
+import dockerfile
+import relations_graph
+
+BUILD_FILES = ["Dockerfile", ".dockerignore"]
+UNITTEST_FILENAME = "unittest.yml"
+
+
+def normalize_path(path):
+    """
+    Returns a changed path relative to the repository root, with forward slashes and without a leading './'
+    :param path: str: the path
+    """
+    path = path.replace('\\', '/')
+    while path.startswith('./'):
+        path = path[2:]
+    return path
+
+
+def copy_sources(parsed):
+    """
+    Returns the context paths and patterns a Dockerfile copies from, relative to its build context
+    :param parsed: dockerfile.Dockerfile: the parsed Dockerfile
+    """
+    sources = []
+    for instruction in parsed.instructions:
+        if instruction.keyword not in ['COPY', 'ADD'] or 'from' in dict(instruction.flags):
+            continue
+        args = instruction.args
+        if args.startswith('['):
+            try:
+                words = json.loads(args)
+            except ValueError:
+                words = args.split()
+        else:
+            words = args.split()
+        for source in words[:-1]:
+            if '://' in source or source.startswith('<<'):
+                continue
+            sources.append(normalize_path(source).strip('/') or '.')
+    return sources
+
+
+def source_matches(relative_path, source):
+    """
+    Checks whether a path inside a build context is taken by a COPY or ADD source
+    :param relative_path: str: path relative to the build context
+    :param source: str: the source as returned by copy_sources
+    """
+    if source in ['.', '*']:
+        return True
+    if relative_path == source or relative_path.startswith(source + '/'):
+        return True
+    # As in Docker, wildcards do not cross a '/', and a pattern matching a directory takes everything in it
+    parts = relative_path.split('/')
+    patterns = source.split('/')
+    return len(parts) >= len(patterns) and all(fnmatch.fnmatchcase(part, pattern) for part, pattern in zip(parts, patterns))
+
+
+class AffectedIndex:
+    """
+    Path prefix index of the images in a repository, with the graph of which images build on which
+    """
+
+    def __init__(self, root=".", relations=None):
+        """
+        :param root: str: path to the repository root
+        :param relations: dict: loaded relations.yaml data, or None to follow the FROM lines only
+        """
+        self.root = root
+        self.contexts = {}
+        self.dockerfile_paths = {}
+        self.sources = {}
+        self.children = {}
+        for dockerfile_path in sorted(glob.glob(os.path.join(root, "*", "*", "Dockerfile"))):
+            context = normalize_path(os.path.relpath(os.path.dirname(dockerfile_path), root))
+            image = build_planner.image_from_path(context + "/Dockerfile")
+            parsed = dockerfile.load(dockerfile_path)
+            self.contexts[context] = image
+            self.dockerfile_paths[image] = context + "/Dockerfile"
+            self.sources[image] = copy_sources(parsed)
+            for parent in parsed.parents():
+                self.children.setdefault(parent, set()).add(image)
+        if relations:
+            graph = relations_graph.RelationsGraph(relations)
+            for parent in graph.children:
+                for child in graph.children[parent]:
+                    self.children.setdefault(relations_graph.join_image(parent), set()).add(relations_graph.join_image(child))
+
+    def image_context(self, path):
+        """
+        Finds the image whose build context holds a path, by looking up each of its directory prefixes
+        :param path: str: path relative to the repository root
+        :return: (str, str): the image and the path relative to its context, or (None, None)
+        """
+        parts = path.split('/')
+        for end in range(len(parts) - 1, 0, -1):
+            image = self.contexts.get('/'.join(parts[:end]))
+            if image:
+                return image, '/'.join(parts[end:])
+        return None, None
+
+    def classify(self, path):
+        """
+        Returns the image a changed path affects and how
+        :param path: str: path relative to the repository root
+        :return: (str, str): the image and 'rebuild' or 'retest', or (None, None) if the path does not affect any image
+        """
+        path = normalize_path(path)
+        image, relative_path = self.image_context(path)
+        if image is None:
+            # A Dockerfile that is not on disk, such as one in the changed paths of another checkout, is still a rebuild
+            if dockerfile.is_image_dockerfile(path):
+                return build_planner.image_from_path(path), 'rebuild'
+            return None, None
+        if relative_path in BUILD_FILES:
+            return image, 'rebuild'
+        if relative_path == UNITTEST_FILENAME:
+            return image, 'retest'
+        if any(source_matches(relative_path, source) for source in self.sources.get(image, [])):
+            return image, 'rebuild'
+        return None, None
+
+    def descendants(self, images):
+        """
+        Returns every image in the repository that builds on one of the given images, directly or through other images
+        :param images: [str]: images in 'tool:version' format
+        """
+        found = set()
+        pending = list(images)
+        while pending:
+            for child in self.children.get(pending.pop(), ()):
+                if child not in found and child in self.dockerfile_paths:
+                    found.add(child)
+                    pending.append(child)
+        return found - set(images)
+
+    def resolve(self, changed_paths):
+        """
+        Works out the images to rebuild and to retest for a set of changed paths
+        :param changed_paths: [str]: paths relative to the repository root
+        :return: ([str], [str], {str: [str]}): the images to rebuild and to retest in 'tool:version' format, and the reasons
+                 each image is affected
+        """
+        rebuild = set()
+        retest = set()
+        reasons = {}
+        for path in changed_paths:
+            image, action = self.classify(path)
+            if image is None:
+                continue
+            (rebuild if action == 'rebuild' else retest).add(image)
+            reasons.setdefault(image, []).append("{} changed".format(normalize_path(path)))
+        for parent in sorted(rebuild):
+            for child in self.descendants([parent]):
+                if child not in rebuild:
+                    reasons.setdefault(child, []).append("builds on {}".format(parent))
+        rebuild.update(self.descendants(rebuild))
+        retest.update(rebuild)
+        return sorted(rebuild), sorted(retest), reasons
+
+    def dockerfile_path(self, image):
+        """
+        Returns the '<tool>/<version>/Dockerfile' path of an image
+        :param image: str: image in 'tool:version' format
+        """
+        return self.dockerfile_paths.get(image, "{}/Dockerfile".format(image.replace(':', '/', 1)))
+
+
+def resolve(changed_paths, root=".", relations=None):
+    """
+    Works out the images to rebuild and to retest for a set of changed paths
+    :param changed_paths: [str]: paths relative to the repository root, or the 'No changed paths found.' message
+    :param root: str: path to the repository root
+    :param relations: dict: loaded relations.yaml data, or None to follow the FROM lines only
+    :return: ([str], [str], {str: [str]}): the Dockerfile paths of the images to rebuild and to retest, and the reasons each
+             image is affected
+    """
+    if changed_paths == "No changed paths found.":
+        return [], [], {}
+    index = AffectedIndex(root, relations)
+    rebuild, retest, reasons = index.resolve(changed_paths)
+    return [index.dockerfile_path(image) for image in rebuild], [index.dockerfile_path(image) for image in retest], reasons
+
+
+def changed_dockerfiles(changed_paths):
+    """
+    Returns the '<tool>/<version>/Dockerfile' paths among the changed paths, the images whose Dockerfile was edited rather than
+    reached through a copied file or a parent, for the checks that only apply to new or edited images
+    :param changed_paths: [str]: paths relative to the repository root, or the 'No changed paths found.' message
+    """
+    if changed_paths == "No changed paths found.":
+        return []
+    return sorted(set(normalize_path(path) for path in changed_paths if dockerfile.is_image_dockerfile(normalize_path(path))))
+
+
+def changed_images(changed_paths, root="."):
+    """
+    Returns the Dockerfile paths of the images the changed paths rebuild themselves, through their Dockerfile or a file they
+    copy, leaving out their descendants
+    :param changed_paths: [str]: paths relative to the repository root, or the 'No changed paths found.' message
+    :param root: str: path to the repository root
+    """
+    if changed_paths == "No changed paths found.":
+        return []
+    index = AffectedIndex(root)
+    images = set(image for image, action in (index.classify(path) for path in changed_paths) if action == 'rebuild')
+    return [index.dockerfile_path(image) for image in sorted(images)]
+
+
+def main():
+    """
+    Main method
+    """
+    parser = argparse.ArgumentParser(
+        description="Lists the images to rebuild and retest for a set of changed paths")
+    parser.add_argument("changed_paths", nargs="*",
+                        help="Changed paths, defaults to the paths changed in the compare range of the current build")
+    parser.add_argument("--relations", default=build_planner.RELATION_FILENAME,
+                        help="relations.yaml file to follow descendants in (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+    changed_paths = args.changed_paths
+    if not changed_paths:
+        import functions
+        changed_paths = functions.changed_paths_in_range(functions.get_compare_range())
+    rebuild, retest, reasons = resolve(changed_paths, relations=build_planner.load_relations(args.relations))
+    if args.json:
+        print(json.dumps({'rebuild': rebuild, 'retest': retest, 'reasons': reasons}, indent=2))
+        return
+    print("Rebuild: {}".format(" ".join(rebuild) or "none"))
+    print("Retest: {}".format(" ".join(retest) or "none"))
+    for image in sorted(reasons):
+        print("  {}: {}".format(image, ", ".join(reasons[image])), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the relations.yaml operations against synthetic catalogs, without Docker or network access:
+    1) 'generate' writes a synthetic relations.yaml and matching <tool>/<version>/Dockerfile tree of a given size, where images
+       form trees of the given fan-out and depth and every version of a child is built FROM the same version of its parent
+    2) 'run' times YAML loading and dumping and each relations operation at one or more catalog sizes, writing the results
+       as a JSON baseline
+    3) 'compare' compares two baselines, such as those from two commits, and exits non-zero if any operation got slower
+       than the threshold
+"""
+
+import io
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import relations_io
+import relations_graph
+import versions
+import rebuild_planner
+import build_planner
+import issue_sync
+import validate_version
+
+# update_relations reads these when it is imported, the benchmark passes its own issue queue and never contacts GitHub
+os.environ.setdefault('GITHUB_TOKEN', "")
+os.environ.setdefault('GITHUB_REPOSITORY', "")
+import update_relations
+
+DEFAULT_SIZES = "100,1000,10000"
+DEFAULT_FANOUT = 4
+DEFAULT_DEPTH = 4
+DEFAULT_VERSIONS = 3
+DEFAULT_REPEAT = 3
+DEFAULT_CHANGED = 20
+DEFAULT_THRESHOLD = 1.2
+BASE_IMAGE = "ubuntu:18.04"
+OWNER = "benchmark"
+
+
+def tool_name(index):
+    """
+    Returns the name of the synthetic tool at an index
+    :param index: int: position of the tool in the catalog
+    """
+    return "tool{:05d}".format(index)
+
+
+def version_name(index):
+    """
+    Returns the synthetic version at an index, each one a minor update of the last
+    :param index: int: position of the version within its tool
+    """
+    return "1.{}.0".format(index)
+
+
+def generate_relations(size, fanout=DEFAULT_FANOUT, depth=DEFAULT_DEPTH, version_count=DEFAULT_VERSIONS):
+    """
+    Generates the data of a synthetic relations.yaml.  Tools form complete trees of the given fan-out and depth, one tree after
+    the other, the roots of each tree are built on ubuntu:18.04, and each tool has version_count versions until size is reached.
+    :param size: int: number of image versions in the catalog, not counting ubuntu:18.04
+    :param fanout: int: number of child tools of each tool
+    :param depth: int: number of levels in each tree of tools
+    :param version_count: int: number of versions of each tool
+    :return: dict: the relations.yaml data
+    """
+    if size < 1 or fanout < 1 or depth < 1 or version_count < 1:
+        raise ValueError("size, fanout, depth and versions must all be at least 1")
+    tree_size = sum(fanout ** level for level in range(depth))
+    tool_count = -(-size // version_count)
+    images = {'ubuntu': {'18.04': {'parents': [], 'children': []}}}
+    data = {'images': images, 'latest': {}, 'terminated': {}}
+    for index in range(tool_count):
+        tool = tool_name(index)
+        position = index % tree_size
+        parent_tool = None
+        if position:
+            parent_tool = tool_name(index - position + (position - 1) // fanout)
+        images[tool] = {}
+        for version_index in range(min(version_count, size - index * version_count)):
+            version = version_name(version_index)
+            if parent_tool is None:
+                parent = BASE_IMAGE
+            else:
+                parent_versions = list(images[parent_tool])
+                parent = "{}:{}".format(parent_tool, parent_versions[min(version_index, len(parent_versions) - 1)])
+            images[tool][version] = {'parents': [parent], 'children': []}
+            parent_name, parent_version = relations_graph.split_image(parent)
+            images[parent_name][parent_version]['children'].append("{}:{}".format(tool, version))
+            data['latest'][tool] = version
+    data['latest']['ubuntu'] = '18.04'
+    for tool in images:
+        for entry in images[tool].values():
+            entry['children'] = sorted(entry['children']) or [None]
+    return data
+
+
+def write_catalog(root, data, owner=OWNER):
+    """
+    Writes relations.yaml and a <tool>/<version>/Dockerfile for every image in the data, except ubuntu
+    :param root: str: directory to write the catalog into
+    :param data: dict: relations.yaml data, as returned by generate_relations
+    :param owner: str: organization prefixed to the parents in the FROM lines
+    :return: (str, [str]): the path of relations.yaml and the Dockerfile paths, relative to root
+    """
+    dockerfile_paths = []
+    for tool in sorted(data['images']):
+        if tool == 'ubuntu':
+            continue
+        for version, entry in data['images'][tool].items():
+            dockerfile_path = os.path.join(tool, version, "Dockerfile")
+            os.makedirs(os.path.join(root, tool, version), exist_ok=True)
+            parent = entry['parents'][0]
+            with open(os.path.join(root, dockerfile_path), 'w') as dockerfile:
+                dockerfile.write("FROM {}\n".format(
+                    parent if parent == BASE_IMAGE else "{}/{}".format(owner, parent)))
+                dockerfile.write('LABEL author="benchmark"\n\n')
+                dockerfile.write("RUN echo {}:{} > /version.txt\n".format(tool, version))
+            dockerfile_paths.append(dockerfile_path)
+    relations_path = os.path.join(root, "relations.yaml")
+    relations_io.write_yaml(data, relations_path)
+    return relations_path, dockerfile_paths
+
+
+def measure(operation, repeat, setup=None):
+    """
+    Times an operation, running setup before each run outside of the timing
+    :param operation: callable: the operation, called with the result of setup if one is given
+    :param repeat: int: number of timed runs
+    :param setup: callable: optional function preparing the state for one run
+    :return: [float]: the duration of each run in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        started = time.perf_counter()
+        if setup:
+            operation(state)
+        else:
+            operation()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def fresh_graph(data):
+    """
+    Returns a graph over a copy of the data, for operations that modify the graph
+    :param data: dict: relations.yaml data
+    """
+    return relations_graph.RelationsGraph(copy.deepcopy(data))
+
+
+def clear_parsed():
+    relations_io.PARSED.clear()
+
+
+def update_root(data, tool, new_version):
+    """
+    Runs update_relations for a new version of a root tool, as CI does when that Dockerfile is added
+    :param data: dict: relations.yaml data, modified in place
+    :param tool: str: the root tool
+    :param new_version: str: the new version of the tool
+    """
+    update_relations.ORIDATA = data
+    graph = relations_graph.RelationsGraph(data)
+    issues = issue_sync.IssueSync(issue_sync.InMemoryBackend())
+    update_relations.update_graph(graph, tool, new_version, [BASE_IMAGE], issues)
+    issues.flush()
+    return graph.to_data()
+
+
+def clean_lists(data):
+    """
+    Runs update_relations.list_cleaner over every parent and child list
+    :param data: dict: relations.yaml data
+    """
+    for tool in data['images']:
+        for entry in data['images'][tool].values():
+            update_relations.list_cleaner(entry['parents'])
+            update_relations.list_cleaner(entry['children'])
+
+
+def index_versions(data):
+    """
+    Builds a version index and looks up the latest and previous version of every tool
+    :param data: dict: relations.yaml data
+    """
+    version_index = versions.VersionIndex(data['images'])
+    for tool in data['images']:
+        latest = version_index.latest(tool)
+        version_index.predecessor(tool, latest)
+
+
+def benchmark_catalog(size, fanout=DEFAULT_FANOUT, depth=DEFAULT_DEPTH, version_count=DEFAULT_VERSIONS,
+                      repeat=DEFAULT_REPEAT, changed=DEFAULT_CHANGED):
+    """
+    Generates a catalog in a temporary directory and times every operation against it
+    :param size: int: number of image versions in the catalog
+    :param fanout: int: number of child tools of each tool
+    :param depth: int: number of levels in each tree of tools
+    :param version_count: int: number of versions of each tool
+    :param repeat: int: number of timed runs of each operation
+    :param changed: int: number of changed Dockerfiles passed to build_planner.plan_builds
+    :return: [dict]: one result per operation
+    """
+    data = generate_relations(size, fanout, depth, version_count)
+    root = tempfile.mkdtemp(prefix="autodocker-benchmark-")
+    previous_cache_dir = os.environ.get('AUTODOCKER_CACHE_DIR')
+    os.environ['AUTODOCKER_CACHE_DIR'] = os.path.join(root, ".cache")
+    previous_cwd = os.getcwd()
+    try:
+        relations_path, dockerfile_paths = write_catalog(root, data)
+        os.chdir(root)
+        tool = tool_name(0)
+        latest = data['latest'][tool]
+        new_version = rebuild_planner.bump_version(latest, 'minor')
+        graph = relations_graph.RelationsGraph(copy.deepcopy(data))
+        operations = [
+            ("yaml.dump", lambda: relations_io.dump_yaml(data), None),
+            ("yaml.load", lambda state: relations_io.load_yaml(relations_path, sidecar=False), clear_parsed),
+            ("yaml.load.sidecar", lambda state: relations_io.load_yaml(relations_path), clear_parsed),
+            ("yaml.load.cached", lambda: relations_io.load_yaml(relations_path), None),
+            ("graph.build", relations_graph.RelationsGraph, lambda: copy.deepcopy(data)),
+            ("graph.dump", lambda graph: graph.dump(), lambda: fresh_graph(data)),
+            ("versions.index", lambda: index_versions(data), None),
+            ("validate.check_exists", lambda: validate_version.check_exists(data, tool, new_version), None),
+            ("relations.list_cleaner", lambda: clean_lists(data), None),
+            ("relations.update", lambda state: update_root(state, tool, new_version), lambda: copy.deepcopy(data)),
+            ("rebuild.plan", lambda: rebuild_planner.plan_rebuilds(graph, tool, latest, new_version, 'minor'), None),
+            ("build.plan", lambda: build_planner.plan_builds(dockerfile_paths[:changed], data), None),
+        ]
+        # Writes the sidecar, so that yaml.load.sidecar times reading it rather than creating it
+        relations_io.load_yaml(relations_path)
+        results = []
+        for name, operation, setup in operations:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                durations = measure(operation, repeat, setup)
+            results.append({'size': size, 'fanout': fanout, 'depth': depth, 'versions': version_count,
+                            'operation': name, 'repeat': repeat, 'min': round(min(durations), 6),
+                            'median': round(statistics.median(durations), 6),
+                            'mean': round(statistics.mean(durations), 6)})
+        return results
+    finally:
+        os.chdir(previous_cwd)
+        relations_io.PARSED.clear()
+        if previous_cache_dir is None:
+            del os.environ['AUTODOCKER_CACHE_DIR']
+        else:
+            os.environ['AUTODOCKER_CACHE_DIR'] = previous_cache_dir
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def get_metadata():
+    """
+    Returns what the results depend on besides the catalog: the commit, Python version, platform and YAML backend
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {'commit': commit or None, 'python': platform.python_version(), 'platform': platform.platform(),
+            'libyaml': relations_io.Loader.__name__.startswith("C"), 'created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+
+def key(result):
+    return (result['size'], result['fanout'], result['depth'], result['versions'], result['operation'])
+
+
+def compare(old_results, new_results, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the fastest run of each operation between two baselines
+    :param old_results: [dict]: results of the earlier baseline
+    :param new_results: [dict]: results of the later baseline
+    :param threshold: float: ratio of new to old time above which an operation counts as a regression
+    :return: [dict]: one row per operation in the later baseline, with the old and new time, their ratio and whether it regressed
+    """
+    old = {key(result): result for result in old_results}
+    rows = []
+    for result in new_results:
+        previous = old.get(key(result))
+        row = {'size': result['size'], 'operation': result['operation'], 'new': result['min'],
+               'old': previous['min'] if previous else None, 'ratio': None, 'regression': False}
+        if previous and previous['min'] > 0:
+            row['ratio'] = result['min'] / previous['min']
+            row['regression'] = row['ratio'] > threshold
+        rows.append(row)
+    return rows
+
+
+def print_results(results, outfile=None):
+    """
+    Prints a table of benchmark results
+    :param results: [dict]: results as returned by benchmark_catalog
+    :param outfile: file: where to print, defaults to stdout
+    """
+    outfile = outfile or sys.stdout
+    print("{:>7}  {:<24} {:>10} {:>10} {:>10}".format("size", "operation", "min s", "median s", "mean s"), file=outfile)
+    for result in results:
+        print("{:>7}  {:<24} {:>10.4f} {:>10.4f} {:>10.4f}".format(result['size'], result['operation'], result['min'],
+                                                                   result['median'], result['mean']), file=outfile)
+
+
+def print_comparison(rows, outfile=None):
+    """
+    Prints a table comparing two baselines
+    :param rows: [dict]: rows as returned by compare
+    :param outfile: file: where to print, defaults to stdout
+    """
+    outfile = outfile or sys.stdout
+    print("{:>7}  {:<24} {:>10} {:>10} {:>8}".format("size", "operation", "old s", "new s", "ratio"), file=outfile)
+    for row in rows:
+        print("{:>7}  {:<24} {:>10} {:>10.4f} {:>8}{}".format(
+            row['size'], row['operation'], "-" if row['old'] is None else "{:.4f}".format(row['old']), row['new'],
+            "-" if row['ratio'] is None else "{:.2f}".format(row['ratio']), "  REGRESSION" if row['regression'] else ""),
+            file=outfile)
+
+
+def load_baseline(baseline_path):
+    """
+    Reads the results from a baseline file written by 'run'
+    :param baseline_path: str: path to the JSON baseline
+    """
+    with open(baseline_path) as baseline_file:
+        return json.load(baseline_file)['results']
+
+
+def main():
+    """
+    Main method
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the relations.yaml operations against synthetic catalogs")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    for command in ["generate", "run"]:
+        subparser = subparsers.add_parser(command)
+        if command == "generate":
+            subparser.add_argument("directory", help="Directory to write relations.yaml and the Dockerfiles into")
+            subparser.add_argument("--size", type=int, default=1000, help="Number of image versions")
+        else:
+            subparser.add_argument("--sizes", default=DEFAULT_SIZES,
+                                   help="Comma separated numbers of image versions to benchmark")
+            subparser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                                   help="Number of timed runs of each operation")
+            subparser.add_argument("--changed", type=int, default=DEFAULT_CHANGED,
+                                   help="Number of changed Dockerfiles passed to the build planner")
+            subparser.add_argument("--output", help="Path to write the JSON baseline to")
+        subparser.add_argument("--fanout", type=int, default=DEFAULT_FANOUT, help="Number of child tools of each tool")
+        subparser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="Number of levels in each tree of tools")
+        subparser.add_argument("--versions", type=int, default=DEFAULT_VERSIONS, help="Number of versions of each tool")
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("old", help="Earlier JSON baseline")
+    compare_parser.add_argument("new", help="Later JSON baseline")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="Ratio of new to old time above which an operation counts as a regression")
+    args = parser.parse_args()
+    if args.command == "generate":
+        relations_path, dockerfile_paths = write_catalog(
+            args.directory, generate_relations(args.size, args.fanout, args.depth, args.versions))
+        print("Wrote {} and {} Dockerfiles".format(relations_path, len(dockerfile_paths)))
+    elif args.command == "run":
+        results = []
+        for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+            results.extend(benchmark_catalog(size, args.fanout, args.depth, args.versions, args.repeat, args.changed))
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                json.dump({'metadata': get_metadata(), 'results': results}, output_file, indent=2)
+                output_file.write("\n")
+    else:
+        rows = compare(load_baseline(args.old), load_baseline(args.new), args.threshold)
+        print_comparison(rows)
+        if any(row['regression'] for row in rows):
+            print("ERROR: {} operations are more than {:.2f} times slower than the earlier baseline".format(
+                sum(row['regression'] for row in rows), args.threshold), file=sys.stderr)
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Statically checks Dockerfiles for patterns that make builds slow:
+    1) Walks the instructions of each build stage from dockerfile.py and reports patterns known to defeat the layer cache, grow
+       the layers or lengthen the build, such as an apt-get update in a different RUN from the install it serves, package lists
+       left in the image, the whole build context copied before the dependencies are installed and repeated upgrades
+    2) Gives every finding a rough cost in seconds added to each build, so the worst Dockerfiles stand out
+    3) Only reports by default; with a gate (--gate or DOCKERFILE_COST_GATE, in seconds) a Dockerfile whose total estimated cost
+       is over the gate fails the check, so CI can opt in to enforcing it
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import collections
+import dockerfile
+import tracing
+
+GATE_ENV = "DOCKERFILE_COST_GATE"
+
+# Rough seconds each pattern adds to a build, and what it costs
+RULES = {
+    'apt_update_split': (30, "apt-get install runs in a separate RUN from the apt-get update on line {}, so a cached update "
+                             "layer leaves stale package lists and the install can fail or pull outdated packages"),
+    'apt_lists_kept': (10, "apt-get install does not remove /var/lib/apt/lists, leaving the package lists in the layer"),
+    'apt_recommends': (20, "apt-get install without --no-install-recommends also installs recommended packages"),
+    'repeated_update': (15, "apt-get update runs {} times in this stage"),
+    'repeated_upgrade': (60, "apt-get upgrade/dist-upgrade runs {} times in this stage"),
+    'context_before_install': (120, "the whole build context is copied on line {} before dependencies are installed, so any "
+                                    "change to the context re-runs the install"),
+    'pip_cache_kept': (5, "pip install without --no-cache-dir keeps its download cache in the layer"),
+    'remote_add': (15, "ADD of a URL is downloaded again on every build and cannot be cached by content"),
+    'unbounded_loop': (30, "a while loop waits on a command with no timeout, which can hang the build"),
+    'consecutive_run': (2, "RUN directly follows the RUN on line {}, adding a layer that could be merged into it"),
+}
+
+COMMAND_SEPARATOR = re.compile(r"&&|\|\||;|\n")
+APT = r"^(?:sudo\s+)?apt(?:-get)?\s+(?:-\S+\s+)*"
+APT_UPDATE = re.compile(APT + r"update\b")
+APT_UPGRADE = re.compile(APT + r"(?:dist-)?upgrade\b")
+APT_INSTALL = re.compile(APT + r"install\b")
+PIP_INSTALL = re.compile(r"^(?:sudo\s+)?(?:python3?\s+-m\s+)?pip3?\s+install\b")
+DEPENDENCY_INSTALL = re.compile(APT + r"install\b|^(?:sudo\s+)?(?:python3?\s+-m\s+)?pip3?\s+install\b|^(?:npm|yarn)\s+(?:ci|install)\b|"
+                                r"^(?:conda|mamba|gem|bundle|apk\s+add|yum|dnf)\b|^go\s+mod\s+download\b")
+WHILE_LOOP = re.compile(r"\bwhile\b.*\bdo\b", re.DOTALL)
+
+Finding = collections.namedtuple('Finding', ['rule', 'line', 'message', 'cost'])
+
+
+def finding(rule, line, *args):
+    """
+    Creates a finding for a rule
+    :param rule: str: name of the rule from RULES
+    :param line: int: line of the instruction
+    :param args: values for the placeholders of the rule's message
+    """
+    cost, message = RULES[rule]
+    return Finding(rule, line, message.format(*args), cost)
+
+
+def shell_commands(args):
+    """
+    Splits the arguments of a RUN instruction into its individual shell commands
+    :param args: str: the arguments, in shell or exec form
+    """
+    if args.startswith('['):
+        try:
+            args = " ".join(json.loads(args))
+        except ValueError:
+            pass
+    return [command.strip() for command in COMMAND_SEPARATOR.split(args) if command.strip()]
+
+
+def copies_context(instruction):
+    """
+    Checks whether a COPY or ADD instruction copies the whole build context
+    :param instruction: dockerfile.Instruction: the instruction
+    """
+    if dict(instruction.flags).get('from'):
+        return False
+    sources = instruction.args.split()[:-1]
+    return any(source.rstrip('/') in ['.', '*'] for source in sources)
+
+
+def analyze(parsed):
+    """
+    Reports the costly patterns in a parsed Dockerfile
+    :param parsed: dockerfile.Dockerfile: the parsed Dockerfile
+    :return: [Finding]: the findings in line order
+    """
+    findings = []
+    for stage in split_stages(parsed.instructions):
+        findings.extend(analyze_stage(stage))
+    return sorted(findings, key=lambda found: (found.line, found.rule))
+
+
+def split_stages(instructions):
+    """
+    Groups instructions by build stage, dropping the ARG instructions before the first FROM
+    :param instructions: [dockerfile.Instruction]: the instructions
+    """
+    stages = []
+    for instruction in instructions:
+        if instruction.keyword == 'FROM':
+            stages.append([])
+        elif stages:
+            stages[-1].append(instruction)
+    return stages
+
+
+def analyze_stage(instructions):
+    """
+    Reports the costly patterns in the instructions of one build stage
+    :param instructions: [dockerfile.Instruction]: the instructions after the stage's FROM
+    """
+    findings = []
+    updates = []
+    upgrades = []
+    update_only_line = None
+    context_line = None
+    previous_run = None
+    for instruction in instructions:
+        if instruction.keyword in ['COPY', 'ADD']:
+            if context_line is None and copies_context(instruction):
+                context_line = instruction.line
+            if instruction.keyword == 'ADD' and re.match(r"https?://", instruction.args):
+                findings.append(finding('remote_add', instruction.line))
+        if instruction.keyword != 'RUN':
+            previous_run = None
+            continue
+        if previous_run is not None:
+            findings.append(finding('consecutive_run', instruction.line, previous_run))
+        previous_run = instruction.line
+        commands = shell_commands(instruction.args)
+        updated = any(APT_UPDATE.match(command) for command in commands)
+        installs = [command for command in commands if APT_INSTALL.match(command)]
+        updates.extend(instruction.line for command in commands if APT_UPDATE.match(command))
+        upgrades.extend(instruction.line for command in commands if APT_UPGRADE.match(command))
+        if installs:
+            if not updated and update_only_line is not None:
+                findings.append(finding('apt_update_split', instruction.line, update_only_line))
+            # A cache mount keeps the package lists out of the layer already
+            if '/var/lib/apt/lists' not in instruction.args and 'mount' not in dict(instruction.flags):
+                findings.append(finding('apt_lists_kept', instruction.line))
+            if any('--no-install-recommends' not in command for command in installs):
+                findings.append(finding('apt_recommends', instruction.line))
+        elif updated:
+            update_only_line = instruction.line
+        if any(PIP_INSTALL.match(command) and '--no-cache-dir' not in command for command in commands):
+            findings.append(finding('pip_cache_kept', instruction.line))
+        if context_line is not None and any(DEPENDENCY_INSTALL.match(command) for command in commands):
+            findings.append(finding('context_before_install', instruction.line, context_line))
+        if WHILE_LOOP.search(instruction.args) and 'timeout' not in instruction.args:
+            findings.append(finding('unbounded_loop', instruction.line))
+    for rule, lines in [('repeated_update', updates), ('repeated_upgrade', upgrades)]:
+        if len(lines) > 1:
+            # Every run after the first is wasted
+            repeated = finding(rule, lines[1], len(lines))
+            findings.append(repeated._replace(cost=repeated.cost * (len(lines) - 1)))
+    return findings
+
+
+def analyze_file(dockerfile_path):
+    """
+    Reports the costly patterns in a Dockerfile
+    :param dockerfile_path: str: path to the Dockerfile
+    :return: [Finding]: the findings in line order
+    """
+    return analyze(dockerfile.load(dockerfile_path))
+
+
+def total_cost(findings):
+    """
+    Returns the estimated seconds the findings add to each build
+    :param findings: [Finding]: the findings
+    """
+    return sum(found.cost for found in findings)
+
+
+def get_gate(gate=None):
+    """
+    Returns the highest total estimated cost allowed per Dockerfile, taken from DOCKERFILE_COST_GATE if not given, or None when
+    the gate is off
+    :param gate: str or float: optional gate requested by the caller
+    """
+    if gate is None:
+        gate = os.environ.get(GATE_ENV)
+    if gate is None or gate == "":
+        return None
+    try:
+        seconds = float(gate)
+    except ValueError:
+        seconds = -1
+    if seconds < 0:
+        print("ERROR: Cost gate \'{}\' is not a number of seconds.".format(
+            gate), file=sys.stderr)
+        exit(1)
+    return seconds
+
+
+def print_report(dockerfile_path, findings, outfile=None):
+    """
+    Prints the findings for a Dockerfile
+    :param dockerfile_path: str: path to the Dockerfile
+    :param findings: [Finding]: its findings
+    :param outfile: file: where to print, defaults to stdout
+    """
+    outfile = outfile or sys.stdout
+    if not findings:
+        print("{}: no costly patterns found".format(dockerfile_path), file=outfile)
+        return
+    print("{}: {} findings, about {}s added to each build".format(
+        dockerfile_path, len(findings), total_cost(findings)), file=outfile)
+    for found in findings:
+        print("  line {}: {} (~{}s): {}".format(found.line, found.rule, found.cost, found.message), file=outfile)
+
+
+def analyze_files(dockerfile_paths):
+    """
+    Analyzes several Dockerfiles, timing each one as an 'analyze' span
+    :param dockerfile_paths: [str]: paths to the Dockerfiles
+    :return: {str: [Finding]}: the findings of each Dockerfile
+    """
+    results = {}
+    for dockerfile_path in dockerfile_paths:
+        with tracing.span("analyze", dockerfile=dockerfile_path) as analyze_span:
+            results[dockerfile_path] = analyze_file(dockerfile_path)
+            analyze_span.set('findings', len(results[dockerfile_path]))
+            analyze_span.set('cost', total_cost(results[dockerfile_path]))
+    return results
+
+
+def over_gate(results, gate):
+    """
+    Prints an error for each Dockerfile whose total estimated cost is over the gate
+    :param results: {str: [Finding]}: the findings of each Dockerfile
+    :param gate: float: highest total estimated cost allowed per Dockerfile, or None to only report
+    :return: [str]: the Dockerfiles over the gate
+    """
+    failed = []
+    for dockerfile_path, findings in results.items():
+        if gate is not None and total_cost(findings) > gate:
+            print("ERROR: {} has an estimated build cost of {}s, over the gate of {}s.".format(
+                dockerfile_path, total_cost(findings), gate))
+            failed.append(dockerfile_path)
+    return failed
+
+
+def check(dockerfile_paths, gate=None):
+    """
+    Analyzes Dockerfiles, printing their findings and failing any over the cost gate
+    :param dockerfile_paths: [str]: paths to the Dockerfiles
+    :param gate: float: highest total estimated cost allowed per Dockerfile, or None to only report
+    :return: bool: True if every Dockerfile is within the gate
+    """
+    results = analyze_files(dockerfile_paths)
+    for dockerfile_path, findings in results.items():
+        print_report(dockerfile_path, findings)
+    return not over_gate(results, gate)
+
+
+def main():
+    """
+    Main method
+    """
+    parser = argparse.ArgumentParser(
+        description="Reports Dockerfile patterns that slow down builds, with an estimated cost in seconds for each")
+    parser.add_argument("dockerfiles", nargs="+", help="Dockerfile paths")
+    parser.add_argument("--gate", help="Fail when a Dockerfile's total estimated cost is over this many seconds "
+                                       "(default: {}, or only report)".format(GATE_ENV))
+    parser.add_argument("--json", action="store_true", help="Print the findings as JSON")
+    args = parser.parse_args()
+    gate = get_gate(args.gate)
+    with tracing.entry_point("build_cost"):
+        results = analyze_files(args.dockerfiles)
+        if args.json:
+            print(json.dumps({path: [found._asdict() for found in findings]
+                              for path, findings in results.items()}, indent=2))
+        else:
+            for dockerfile_path, findings in results.items():
+                print_report(dockerfile_path, findings)
+        if over_gate(results, gate):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
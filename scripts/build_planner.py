@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Plans and runs the builds for every changed Dockerfile in a push:
+    1) Finds the parents of each changed image from its FROM lines and the relations.yaml 'images' graph
+    2) Orders the changed images so that parents are always built before their children
+    3) Runs independent images concurrently in a bounded worker pool, starting children as soon as their parents finish
+"""
+
+import os
+import sys
+import concurrent.futures
+import dockerfile
+import relations_io
+
+RELATION_FILENAME = "relations.yaml"
+DEFAULT_WORKERS = 2
+
+
+def get_workers(max_workers=None):
+    """
+    Returns the number of images to process at once, taken from BUILD_WORKERS if not given
+    :param max_workers: int: optional number of workers requested by the caller
+    """
+    if max_workers is None:
+        max_workers = os.environ.get('BUILD_WORKERS', DEFAULT_WORKERS)
+    try:
+        max_workers = int(max_workers)
+    except ValueError:
+        print("ERROR: Worker count \'{}\' is not a number.".format(
+            max_workers), file=sys.stderr)
+        exit(1)
+    return max(1, max_workers)
+
+
+def image_from_path(dockerfile_path):
+    """
+    Given a '<tool>/<version>/Dockerfile' path, returns the 'tool:version' image name
+    :param dockerfile_path: str: relative path to the Dockerfile
+    """
+    tool, version = dockerfile_path.replace('\\', '/').split('/')[-3:-1]
+    return "{}:{}".format(tool, version)
+
+
+def dockerfile_parents(dockerfile_path):
+    """
+    Gets the parent images a Dockerfile builds or copies from, without their repository prefix
+    :param dockerfile_path: str: path to the Dockerfile to read
+    """
+    return dockerfile.parents(dockerfile_path)
+
+
+def dockerfile_base_images(dockerfile_path):
+    """
+    Gets the images a Dockerfile builds or copies from as written, including their repository prefix, with build arguments
+    substituted and leaving out scratch and earlier build stages
+    :param dockerfile_path: str: path to the Dockerfile to read
+    """
+    return dockerfile.base_images(dockerfile_path)
+
+
+def relations_parents(relations, image):
+    """
+    Gets the parents recorded for an image in the 'images' graph of relations.yaml, as well as any image listing it as a child
+    :param relations: dict: loaded relations.yaml data, or None
+    :param image: str: image in 'tool:version' format
+    """
+    parents = set()
+    if not relations or not relations.get('images'):
+        return parents
+    tool, version = image.split(':', 1)
+    entry = relations['images'].get(tool, {}).get(version)
+    if entry:
+        parents.update(parent for parent in (
+            entry.get('parents') or []) if isinstance(parent, str))
+    for parent_tool in relations['images']:
+        for parent_version, parent_entry in relations['images'][parent_tool].items():
+            if image in (parent_entry.get('children') or []):
+                parents.add("{}:{}".format(parent_tool, parent_version))
+    return parents
+
+
+def load_relations(relations_path=RELATION_FILENAME):
+    """
+    Loads relations.yaml if it is present, returning None otherwise
+    :param relations_path: str: path to the relations.yaml file
+    """
+    if not os.path.exists(relations_path):
+        return None
+    return relations_io.load_yaml(relations_path)
+
+
+def plan_builds(dockerfile_paths, relations=None):
+    """
+    Builds the dependency plan for a list of changed Dockerfiles
+    :param dockerfile_paths: [str]: list of '<tool>/<version>/Dockerfile' paths
+    :param relations: dict: loaded relations.yaml data, or None to skip the relations graph
+    :return: {image: {'path': str, 'depends': set}}: each changed image with the changed images it depends on, in build order
+    """
+    plan = {}
+    for dockerfile_path in dockerfile_paths:
+        plan[image_from_path(dockerfile_path)] = {
+            'path': dockerfile_path, 'depends': set()}
+    for image in plan:
+        parents = set(dockerfile_parents(plan[image]['path']))
+        parents.update(relations_parents(relations, image))
+        plan[image]['depends'] = set(
+            parent for parent in parents if parent in plan and parent != image)
+    return {image: plan[image] for image in topological_order(plan)}
+
+
+def topological_order(plan):
+    """
+    Orders the images in a plan so that every image comes after the images it depends on
+    :param plan: {image: {'path': str, 'depends': set}}: the plan to order
+    """
+    order = []
+    remaining = {image: set(plan[image]['depends']) for image in plan}
+    while remaining:
+        ready = sorted(image for image in remaining if not remaining[image])
+        if not ready:
+            print("ERROR: Circular FROM dependency found between images: {}".format(
+                ", ".join(sorted(remaining))), file=sys.stderr)
+            exit(1)
+        for image in ready:
+            order.append(image)
+            del remaining[image]
+        for image in remaining:
+            remaining[image].difference_update(ready)
+    return order
+
+
+def critical_paths(plan, durations):
+    """
+    Returns, for every image in a plan, the estimated seconds of the longest chain of work from its start to the end of its
+    last descendant
+    :param plan: {image: {'path': str, 'depends': set}}: the plan, in build order as returned by plan_builds
+    :param durations: {image: float}: estimated seconds of each image, missing images counting as 0
+    """
+    lengths = {}
+    for image in reversed(list(plan)):
+        children = [child for child in plan if image in plan[child]['depends']]
+        lengths[image] = durations.get(image, 0) + max([lengths[child] for child in children], default=0)
+    return lengths
+
+
+def run_plan(plan, task, max_workers=None, priority=None):
+    """
+    Runs a task for every image in a plan, starting each image as soon as all of the images it depends on have succeeded
+    :param plan: {image: {'path': str, 'depends': set}}: the plan to run, as returned by plan_builds
+    :param task: function: called with the Dockerfile path of an image, returns True on success
+    :param max_workers: int: maximum number of images to process at once
+    :param priority: {image: float}: optional priority of each image, such as its critical path, the highest starting first
+        when more images are ready than there are workers
+    :return: {image: bool or None}: True on success, False on failure and None if skipped because a parent failed
+    """
+    results = {image: None for image in plan}
+    waiting = {image: set(plan[image]['depends']) for image in plan}
+    running = {}
+    workers = get_workers(max_workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while waiting or running:
+            # Only fill the free workers, so an image that becomes ready later can still start before lower priority ones
+            ready = sorted((image for image in waiting if not waiting[image]), key=lambda image: -(priority or {}).get(image, 0))
+            for image in ready[:workers - len(running)]:
+                del waiting[image]
+                running[executor.submit(task, plan[image]['path'])] = image
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                image = running.pop(future)
+                try:
+                    results[image] = bool(future.result())
+                except Exception as exc:
+                    print("ERROR: {} failed: {}".format(
+                        image, exc), file=sys.stderr)
+                    results[image] = False
+                if results[image]:
+                    for child in waiting:
+                        waiting[child].discard(image)
+                else:
+                    skip_descendants(plan, waiting, image)
+    return {image: results[image] for image in plan}
+
+
+def skip_descendants(plan, waiting, image):
+    """
+    Removes every image that depends on a failed image from the waiting list
+    :param plan: {image: {'path': str, 'depends': set}}: the plan being run
+    :param waiting: {image: set}: images not yet started and their outstanding parents
+    :param image: str: the image that failed
+    """
+    for child in [child for child in waiting if image in plan[child]['depends']]:
+        if child in waiting:
+            print("Skipping {} as its parent {} failed.".format(
+                child, image), file=sys.stderr)
+            del waiting[child]
+            skip_descendants(plan, waiting, child)
+
+
+def print_results(action, results):
+    """
+    Prints the per-image results of a plan run
+    :param action: str: what was done to each image (e.g. 'Build')
+    :param results: {image: bool or None}: results as returned by run_plan
+    """
+    print("{} results:".format(action), file=sys.stderr)
+    for image in results:
+        if results[image]:
+            status = "succeeded"
+        elif results[image] is None:
+            status = "skipped"
+        else:
+            status = "failed"
+        print("    {}: {}".format(image, status), file=sys.stderr)
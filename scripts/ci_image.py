@@ -4,18 +4,39 @@
 #   1) runs tests specified in unittest.yml inside the docker image (assumes images have already been built)
 #      a) with default docker settings
 #      a) with WORKDIR and USER settings to check for singularity compatibility
+#      Each group of settings starts one container and runs every test inside it with 'docker exec', both groups at once
+#      Each command is killed after its timeout (TEST_TIMEOUT, or 'timeout' on the test in unittest.yml), and its output is
+#      read only until the expected text has matched or TEST_OUTPUT_LIMIT bytes have been read
 # If both unittest.yml and Dockerfile are changed it only tests the image once
 
 import os
 import sys
+import time
+import uuid
+import signal
+import selectors
 import subprocess
-import yaml
+import concurrent.futures
 import re
+import shlex
 import difflib
 import functions
+import docker_api
+import result_cache
+import test_specs
+import timings
+import tracing
 
 UNITTEST_FILENAME = "unittest.yml"
 TEST_WORKDIR = "/data"
+HOST_SHELL_CHARS = re.compile(r"[|&;<>()$`\\*?~{}\[\]#!]")
+DEFAULT_TEST_TIMEOUT = 600
+DEFAULT_OUTPUT_LIMIT = 1024 * 1024
+READ_SIZE = 65536
+# Matching more output can change the result of a pattern ending in one of these, so its output is always read to the end
+UNSTABLE_PATTERN = re.compile(r"\$|\\[ZbB]|\(\?[=!<(]")
+# Below this size the pattern is checked after every chunk, above it only each time the output doubles
+EAGER_MATCH_SIZE = 65536
 
 
 def run_bash_cmd(command, ignore_non_zero_exit_status=False):
@@ -35,63 +56,386 @@ def run_bash_cmd(command, ignore_non_zero_exit_status=False):
             raise
 
 
+def positive_number(value, name):
+    """
+    Converts a setting to a positive number, exiting if it is not one
+    :param value: the value of the setting
+    :param name: str: where the setting came from, for the error message
+    """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = 0
+    if number <= 0:
+        print("ERROR: {} \'{}\' is not a positive number.".format(
+            name, value), file=sys.stderr)
+        exit(1)
+    return number
+
+
+def get_default_timeout():
+    """
+    Returns the number of seconds a test command may run for, taken from TEST_TIMEOUT
+    """
+    return positive_number(os.environ.get('TEST_TIMEOUT') or DEFAULT_TEST_TIMEOUT, "TEST_TIMEOUT")
+
+
+def get_output_limit():
+    """
+    Returns the number of bytes of output kept for each test command, taken from TEST_OUTPUT_LIMIT
+    """
+    return int(positive_number(os.environ.get('TEST_OUTPUT_LIMIT') or DEFAULT_OUTPUT_LIMIT, "TEST_OUTPUT_LIMIT"))
+
+
+def test_spec(cmd, expect_text=None, timeout=None):
+    """
+    Returns the settings of one test command
+    :param cmd: str: commmand to run inside the image
+    :param expect_text: str: optional regex the output has to match
+    :param timeout: float: optional number of seconds the command may run for, defaults to get_default_timeout
+    :return: {'cmd', 'expect_text', 'timeout'}
+    """
+    return {'cmd': cmd, 'expect_text': expect_text, 'timeout': timeout or get_default_timeout()}
+
+
+def get_test_specs(filename):
+    """
+    Read YAML test configuration from a file, including the optional per test 'timeout' in seconds
+    :param filename: str: path to YAML file with test settings for a single docker file
+    :return: [{'cmd', 'expect_text', 'timeout'}]: the settings of each test
+    """
+    return [test_spec(spec['cmd'], spec['expect_text'], spec['timeout']) for spec in test_specs.load_specs(filename)]
+
+
 def get_test_list(filename):
     """
     Read YAML test configuration from a file
     :param filename: str: path to YAML file with test settings for a single docker file
     :return: [(command, expected_text)]: array of command and expected output pairs
     """
-    with open(filename) as infile:
-        testinfo_list = []
-        unittest_config = yaml.safe_load(infile)
-        for testinfo in unittest_config['commands']:
-            cmd = testinfo['cmd']
-            expect_text = testinfo['expect_text']
-            testinfo_list.append((cmd, expect_text))
-        return testinfo_list
+    return [(spec['cmd'], spec['expect_text']) for spec in get_test_specs(filename)]
+
+
+class CommandOutput:
+    """
+    Output of one test command, kept up to a size limit and no longer read once the expected pattern has matched
+    """
+
+    def __init__(self, expect_text=None, limit=None):
+        """
+        :param expect_text: str: optional regex the output has to match
+        :param limit: int: number of bytes to keep, defaults to get_output_limit
+        """
+        self.pattern = None
+        if expect_text is not None and not UNSTABLE_PATTERN.search(expect_text):
+            self.pattern = test_specs.compile_pattern(expect_text)
+        self.limit = limit or get_output_limit()
+        self.data = bytearray()
+        self.next_match = 0
+        self.truncated = False
+        self.matched = False
+        self.timed_out = False
+
+    def write(self, chunk):
+        """
+        Adds a chunk of output
+        :param chunk: bytes: the output
+        :return: bool: false once no more output needs to be read
+        """
+        room = self.limit - len(self.data)
+        self.data += chunk[:room]
+        if len(chunk) > room:
+            self.truncated = True
+            return False
+        if self.pattern and len(self.data) >= self.next_match:
+            # re.match only needs a prefix of the output, so once it matches more output cannot change the result
+            self.matched = self.pattern.match(self.text) is not None
+            if len(self.data) >= EAGER_MATCH_SIZE:
+                self.next_match = 2 * len(self.data)
+        return not self.matched
+
+    @property
+    def text(self):
+        return self.data.decode('utf-8', 'replace')
+
+
+def stream_bash_cmd(command, timeout=None):
+    """
+    Run bash command and yield its output as it is written, killing it and everything it started if the caller stops
+    reading early
+    :param command: str bash command to run
+    :param timeout: float: optional number of seconds after which the command is killed and TimeoutError raised
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    process = subprocess.Popen(["bash", "-c", command], stdout=subprocess.PIPE, start_new_session=True)
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ)
+            while True:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("Command did not finish in {} seconds".format(timeout))
+                if not selector.select(remaining):
+                    continue
+                chunk = os.read(process.stdout.fileno(), READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        try:
+            process.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            raise TimeoutError("Command did not finish in {} seconds".format(timeout))
+    finally:
+        if process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+        process.stdout.close()
+
+
+def collect_output(chunks, output):
+    """
+    Writes chunks of command output to output until it has all it needs, then closes the stream
+    :param chunks: generator: the command's output, from stream_bash_cmd or the Docker Engine API
+    :param output: CommandOutput: where to write the output
+    :return: bool: true if the output was read to the end
+    """
+    try:
+        for chunk in chunks:
+            if not output.write(chunk):
+                return False
+        return True
+    except (TimeoutError, docker_api.DockerTimeout):
+        output.timed_out = True
+        return False
+    finally:
+        chunks.close()
+
+
+def api_command(cmd):
+    """
+    Splits a test command into arguments for the Docker Engine API
+    :param cmd: str: commmand to run inside the image
+    :return: [str]: the arguments, or None if the command relies on the host shell (e.g. a pipe into 'head') and must run through the CLI
+    """
+    if HOST_SHELL_CHARS.search(cmd):
+        return None
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return None
 
 
-def run_docker_get_output(image_name, cmd, workdir=None, user=None):
+def run_docker_get_output(image_name, cmd, workdir=None, user=None, timeout=None, output=None):
     """
     Launch docker process with run command passing the cmd.
     :param image_name: str: name of the image to run
     :param cmd: str: commmand to run inside the image
     :param workdir: str: optional flag to run in a particular directory
     :param user: str: optional flag to run as a particular user
+    :param timeout: float: optional number of seconds after which the container is removed
+    :param output: CommandOutput: optional output to read into, which also records a timeout
     :return: str: output of the docker process
     """
+    output = output or CommandOutput()
+    container_name = "autodocker-test-{}".format(uuid.uuid4().hex[:12])
     options = ""
     if workdir:
         options += "--workdir {} ".format(workdir)
     if user:
         options += "--user {} ".format(user)
-    options += "-i --rm "
+    options += "-i --rm --name {} ".format(container_name)
     print("Testing image {} with: docker run {} {} {}".format(
         image_name, options, image_name, cmd))
+    client = docker_api.get_client()
+    if client and api_command(cmd):
+        try:
+            container_id = client.create_container(
+                image_name, api_command(cmd), workdir=workdir, user=user)
+            try:
+                client.start_container(container_id)
+                collect_output(client.container_logs(
+                    container_id, timeout=timeout), output)
+            finally:
+                client.remove_container(container_id)
+        except docker_api.DockerError as exc:
+            print(exc.message, file=sys.stderr)
+        return output.text
     docker_cmd = "docker run {} {} {}".format(options, image_name, cmd)
-    return run_bash_cmd(docker_cmd, ignore_non_zero_exit_status=True)
+    if not collect_output(stream_bash_cmd(docker_cmd, timeout), output):
+        # Killing the docker client leaves the container running
+        run_bash_cmd("docker rm -f {}".format(container_name),
+                     ignore_non_zero_exit_status=True)
+    return output.text
+
+
+def image_has_entrypoint(image_name):
+    """
+    Checks whether an image defines an ENTRYPOINT, which 'docker exec' would bypass
+    :param image_name: str: name of the image to inspect
+    :return: bool: true if the image has an entrypoint or could not be inspected
+    """
+    client = docker_api.get_client()
+    if client:
+        image_info = client.inspect_image(image_name)
+        return image_info is None or bool((image_info.get('Config') or {}).get('Entrypoint'))
+    try:
+        entrypoint = run_bash_cmd(
+            "docker image inspect -f '{{{{json .Config.Entrypoint}}}}' {}".format(image_name))
+    except subprocess.CalledProcessError:
+        return True
+    return entrypoint.strip() not in ["null", "[]", ""]
+
+
+def start_test_container(image_name, workdir=None, user=None):
+    """
+    Launch a long-lived container for an image that test commands can be executed in.
+    :param image_name: str: name of the image to run
+    :param workdir: str: optional flag to run in a particular directory
+    :param user: str: optional flag to run as a particular user
+    :return: str: the container ID, or None if the container could not be started
+    """
+    options = ""
+    if workdir:
+        options += "--workdir {} ".format(workdir)
+    if user:
+        options += "--user {} ".format(user)
+    options += "-d -i --rm --entrypoint sh "
+    print("Starting test container for image {} with: docker run {} {}".format(
+        image_name, options, image_name))
+    client = docker_api.get_client()
+    if client:
+        try:
+            container_id = client.create_container(image_name, entrypoint=["sh"], workdir=workdir, user=user,
+                                                   open_stdin=True, auto_remove=True)
+            client.start_container(container_id)
+            return container_id
+        except docker_api.DockerError as exc:
+            print(exc.message, file=sys.stderr)
+            return None
+    docker_cmd = "docker run {} {}".format(options, image_name)
+    try:
+        return run_bash_cmd(docker_cmd).strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def exec_docker_get_output(container_id, cmd, timeout=None, output=None):
+    """
+    Run cmd inside an already running test container.  A command that is stopped early keeps running until the
+    container is removed.
+    :param container_id: str: ID of the container started by start_test_container
+    :param cmd: str: commmand to run inside the container
+    :param timeout: float: optional number of seconds after which the command is no longer waited for
+    :param output: CommandOutput: optional output to read into, which also records a timeout
+    :return: str: output of the docker process
+    """
+    output = output or CommandOutput()
+    print("Testing container {} with: docker exec -i {} {}".format(
+        container_id[:12], container_id[:12], cmd))
+    client = docker_api.get_client()
+    if client and api_command(cmd):
+        try:
+            exec_id = client.exec_create(container_id, api_command(cmd))
+            collect_output(client.exec_output(exec_id, timeout), output)
+        except docker_api.DockerError as exc:
+            print(exc.message, file=sys.stderr)
+        return output.text
+    docker_cmd = "docker exec -i {} {}".format(container_id, cmd)
+    collect_output(stream_bash_cmd(docker_cmd, timeout), output)
+    return output.text
+
+
+def stop_test_container(container_id):
+    """
+    Remove a test container started by start_test_container.
+    :param container_id: str: ID of the container to remove
+    """
+    client = docker_api.get_client()
+    if client:
+        client.remove_container(container_id)
+        return
+    run_bash_cmd("docker rm -f {}".format(container_id),
+                 ignore_non_zero_exit_status=True)
+
+
+def run_batched_tests(image_name, specs, workdir=None, user=None):
+    """
+    Run every test inside one container of image_name, falling back to one container per test when the image
+    has an ENTRYPOINT or a long-lived container cannot be started.
+    :param image_name: str: name of the image to run
+    :param specs: [dict]: settings of each test, as returned by get_test_specs
+    :param workdir: str: optional flag to run in a particular directory
+    :param user: str: optional flag to run as a particular user
+    :return: [CommandOutput]: output of each test, in the same order as specs
+    """
+    with tracing.span("test.container", image=image_name, workdir=workdir or "", commands=len(specs)) as container_span:
+        outputs = [CommandOutput(spec['expect_text']) for spec in specs]
+        container_id = None
+        if not image_has_entrypoint(image_name):
+            container_id = start_test_container(image_name, workdir, user)
+        if not container_id:
+            print("Running each test for image {} in its own container.".format(image_name))
+            container_span.set('batched', False)
+            for spec, output in zip(specs, outputs):
+                run_docker_get_output(image_name, spec['cmd'], workdir, user, spec['timeout'], output)
+            return outputs
+        try:
+            for spec, output in zip(specs, outputs):
+                exec_docker_get_output(container_id, spec['cmd'], spec['timeout'], output)
+            return outputs
+        finally:
+            container_span.set('timeouts', sum(output.timed_out for output in outputs))
+            stop_test_container(container_id)
+
+
+def run_batched_commands(image_name, cmds, workdir=None, user=None):
+    """
+    Run every cmd inside one container of image_name, falling back to one container per cmd when the image
+    has an ENTRYPOINT or a long-lived container cannot be started.
+    :param image_name: str: name of the image to run
+    :param cmds: [str]: commmands to run inside the image
+    :param workdir: str: optional flag to run in a particular directory
+    :param user: str: optional flag to run as a particular user
+    :return: [str]: output of each command, in the same order as cmds
+    """
+    return [output.text for output in run_batched_tests(image_name, [test_spec(cmd) for cmd in cmds], workdir, user)]
 
 
 def run_tests(image_name, unittest_filepath):
     """
-    Run all tests contained in a unittest_filename against image_name
+    Run all tests contained in a unittest_filename against image_name, using one container for the default
+    settings and one container for the workdir settings, both at once
     :param image_name: str: name of the image to test
     :param unittest_filepath: str path to unittest.yml file
     :return: bool: true if we had an error
     """
-    had_error = False
-    for cmd, expect_text in get_test_list(unittest_filepath):
-        expect_pattern = re.compile(expect_text, re.DOTALL)
-        docker_output = run_docker_get_output(image_name, cmd)
-        if not re.match(expect_pattern, docker_output):
-            print_test_error(cmd, expect_text, docker_output)
-            had_error = True
-        docker_output_with_options = run_docker_get_output(
-            image_name, cmd, workdir=TEST_WORKDIR)
-        if not re.match(expect_pattern, docker_output_with_options):
-            print_test_error(cmd + " (with workdir and user options)",
-                             expect_text, docker_output_with_options)
-            had_error = True
+    with tracing.span("test", image=image_name, unittest=unittest_filepath) as test_span:
+        had_error = False
+        specs = get_test_specs(unittest_filepath)
+        variants = [(None, ""), (TEST_WORKDIR, " (with workdir and user options)")]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(variants)) as executor:
+            futures = [executor.submit(run_batched_tests, image_name, specs, workdir)
+                       for workdir, suffix in variants]
+            variant_outputs = [future.result() for future in futures]
+        for (workdir, suffix), outputs in zip(variants, variant_outputs):
+            for spec, output in zip(specs, outputs):
+                if output.timed_out:
+                    print("{} did not finish within its timeout of {} seconds".format(
+                        spec['cmd'] + suffix, spec['timeout']))
+                elif test_specs.compile_pattern(spec['expect_text']).match(output.text):
+                    continue
+                elif output.truncated:
+                    print("Output of {} was cut off after {} bytes".format(
+                        spec['cmd'] + suffix, output.limit))
+                print_test_error(spec['cmd'] + suffix, spec['expect_text'], output.text)
+                had_error = True
+        test_span.set('result', "failed" if had_error else "passed")
+        if had_error:
+            test_span.status = "error"
+    timings.save()
     return had_error
 
 
@@ -132,17 +476,28 @@ def get_unittest_file_paths(path_list):
     return unittest_paths
 
 
-def find_and_run_tests(owner, changed_paths):
+def find_and_run_tests(owner, changed_paths, force=False):
     """
     Find an run tests based on a docker ownername (used to build image name) and a list of paths
+    Images whose ID has already passed the same unittest.yml are skipped unless force is set
     :param owner: str: prefix of docker image_name
     :param changed_paths: [str]: list of paths that were changed and may need to be tested
+    :param force: bool: when true, ignore the result cache and always run the tests
     :return: bool: true when we had errors
     """
     had_errors = False
     tested_images = 0
     images_with_errors = 0
-    for unittest_path in get_unittest_file_paths(changed_paths):
+    cache = result_cache.ResultCache()
+    unittest_paths = sorted(get_unittest_file_paths(changed_paths))
+    # Every file is checked before the first container starts, so one bad regex does not waste the other images' tests
+    valid_specs, spec_errors = test_specs.load_all(unittest_paths)
+    if spec_errors:
+        for unittest_path in spec_errors:
+            test_specs.print_errors(spec_errors[unittest_path])
+        print("ERROR: {} unittest.yml files are not valid, no images tested.".format(len(spec_errors)))
+        return True
+    for unittest_path in unittest_paths:
         parts = unittest_path.split(sep="/")
         if len(parts):
             tool, tag, _ = parts
@@ -150,11 +505,18 @@ def find_and_run_tests(owner, changed_paths):
             if not (str(os.environ.get('DOCKERHUB_URL')).lower() == "none" or str(os.environ.get('DOCKERHUB_URL')).lower() == 'null' or os.environ.get('DOCKERHUB_URL') == None or os.environ.get('DOCKERHUB_URL') == ''):
                 image_name = "{}/{}".format(
                     os.environ.get('DOCKERHUB_URL'), image_name)
-            had_error = run_tests(image_name, unittest_path)
+            identity = result_cache.image_id(image_name)
             tested_images += 1
+            if not force and cache.has_passed(identity, unittest_path):
+                print("Image {} has already passed {}, skipping. Use --force to test it again.".format(
+                    image_name, unittest_path))
+                continue
+            had_error = run_tests(image_name, unittest_path)
             if had_error:
                 images_with_errors += 1
                 had_errors = True
+            else:
+                cache.record_pass(identity, unittest_path, image_name)
         else:
             print("Skipping {}".format(unittest_path))
     if tested_images == 0:
@@ -167,16 +529,19 @@ def find_and_run_tests(owner, changed_paths):
 
 
 def main():
-    if len(sys.argv) < 2:
+    force = '--force' in sys.argv
+    args = [arg for arg in sys.argv if arg != '--force']
+    if len(args) < 2:
         print(
-            "Usage python3 tests/ci_image.py <docker_owner> [<unittest_or_dockerfile_path>...]")
+            "Usage python3 tests/ci_image.py [--force] <docker_owner> [<unittest_or_dockerfile_path>...]")
         sys.exit(1)
     else:
-        owner = sys.argv[1]
-        changed_paths = sys.argv[2:] if len(sys.argv) > 2 else []
-        had_errors = find_and_run_tests(owner, changed_paths)
-        if had_errors:
-            sys.exit(2)
+        owner = args[1]
+        changed_paths = args[2:] if len(args) > 2 else []
+        with tracing.entry_point("ci_image", owner=owner):
+            had_errors = find_and_run_tests(owner, changed_paths, force)
+            if had_errors:
+                sys.exit(2)
 
 
 if __name__ == "__main__":
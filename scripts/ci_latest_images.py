@@ -1,14 +1,33 @@
 #!/usr/bin/env python3
 """
-Prints out the paths for the unittest.yml files for all latest images to run their pytests
+Prints out the paths for the unittest.yml files for all latest images to run their pytests.
+With --shard-count, each CI runner tests one of several shards of similar estimated cost, keeping images that share base
+layers together.  The 'plan' command splits the images once, from recorded timings and registry sizes, into a file every shard
+runner reads with --shard-plan, so all runners agree on the split.  The 'merge' command combines the result files of every
+shard into one report.
 """
 
 import os
 import sys
 import re
+import json
+import hashlib
+import argparse
 import subprocess
-import yaml
+import threading
+import concurrent.futures
 import functions
+import docker_api
+import registry_api
+import relations_io
+import image_eviction
+import result_cache
+import test_specs
+import timings
+import tracing
+
+# Rough registry download speed, to turn an image's size into seconds when it has no recorded timings
+PULL_BYTES_PER_SECOND = 50 * 10**6
 
 
 def load_yaml(master_yaml):
@@ -16,10 +35,34 @@ def load_yaml(master_yaml):
     Loads a yaml file and returns a python yaml object
     :param yaml_file: the yaml file to open and read
     """
-    with open(master_yaml) as yaml_file:
-        yaml_data = yaml.safe_load(yaml_file)
-    yaml_file.close()
-    return yaml_data
+    return relations_io.load_yaml(master_yaml)
+
+
+def try_pull_image(docker_image):
+    """
+    Pulls the version of the image specified, returning whether it succeeded
+    :param docker_image: str: Docker image to pull in the format '<organization>/<image_name>:<version>'
+    """
+    with tracing.span("pull", image=docker_image) as pull_span:
+        client = docker_api.get_client()
+        if client:
+            try:
+                for message in client.pull(docker_image, docker_api.registry_auth()):
+                    if message.get('status') and not message.get('progressDetail'):
+                        print("{}{}".format(message['id'] + ": " if message.get('id') else "",
+                                            message['status']), flush=True)
+            except docker_api.DockerError as exc:
+                print("ERROR: Unable to pull {}: {}".format(docker_image, exc.message))
+                pull_span.status = "error"
+                return False
+            return True
+        pull_code = os.system("docker pull " + docker_image)
+        pull_span.set('exit_code', pull_code)
+        if pull_code != 0:
+            print("ERROR: Unable to pull " + docker_image)
+            pull_span.status = "error"
+            return False
+        return True
 
 
 def pull_image(docker_image):
@@ -27,9 +70,330 @@ def pull_image(docker_image):
     Ensures that the version of the image specified has been pulled
     :param docker_image: str: Docker image to pull in the format '<organization>/<image_name>:<version>'
     """
-    if os.system("docker pull " + docker_image) != 0:
-        print("ERROR: Unable to pull " + docker_image)
+    if not try_pull_image(docker_image):
+        sys.exit(1)
+
+
+def get_image_name(owner, image, tag):
+    """
+    Returns the full name of an image, including DOCKERHUB_URL when it is set
+    :param owner: str: Docker Hub organization of the image
+    :param image: str: name of the image
+    :param tag: str: version of the image
+    """
+    image_name = "{}/{}:{}".format(owner, image, tag).replace("+", "_")
+    if not (str(os.environ.get('DOCKERHUB_URL')).lower() == "none" or str(os.environ.get('DOCKERHUB_URL')).lower() == 'null' or os.environ.get('DOCKERHUB_URL') == None or os.environ.get('DOCKERHUB_URL') == ''):
+        image_name = "{}/{}".format(
+            os.environ.get('DOCKERHUB_URL'), image_name)
+    return image_name
+
+
+def run_image_tests(owner, image, tag, capture=False, force=False):
+    """
+    Runs the unittest.yml tests for a pulled image through ci_image.py
+    :param owner: str: Docker Hub organization of the image
+    :param image: str: name of the image
+    :param tag: str: version of the image
+    :param capture: bool: when true, the test output is collected and printed in one block once the tests finish
+    :param force: bool: when true, ci_image.py ignores the result cache
+    :return: bool: true if the tests passed
+    """
+    with tracing.span("latest.test", image="{}:{}".format(image, tag)) as test_span:
+        test_path = "{}/{}/unittest.yml".format(image, tag)
+        test_command = "python3 scripts/ci_image.py \"{}\" {}".format(
+            owner, test_path).split(" ")
+        if force:
+            test_command.insert(2, "--force")
+        if capture:
+            test_run = subprocess.run(test_command, stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT, universal_newlines=True)
+            print("Test output for {}:{}:\n{}".format(
+                image, tag, test_run.stdout), end="", flush=True)
+            test_code = test_run.returncode
+        else:
+            test_code = subprocess.Popen(test_command).wait()
+        test_span.set('exit_code', test_code)
+        if test_code != 0:
+            test_span.status = "error"
+        return test_code == 0
+
+
+def validate_test_specs(latest_images):
+    """
+    Loads and validates the unittest.yml of every latest image in one pass, before any image is pulled.  The parsed specs
+    are kept in the test_specs sidecar cache, so the ci_image.py run for each image does not parse them again.
+    :param latest_images: {image: tag}: the 'latest' section of relations.yaml
+    :return: ({image: tag}, {image: tag}): the images with valid tests, and the images whose tests are missing or not valid
+    """
+    with tracing.span("latest.validate", images=len(latest_images)):
+        test_paths = {image: "{}/{}/unittest.yml".format(image, latest_images[image]) for image in latest_images}
+        valid_specs, errors = test_specs.load_all(list(test_paths.values()))
+    valid = {}
+    invalid = {}
+    for image in latest_images:
+        if test_paths[image] in errors:
+            test_specs.print_errors(errors[test_paths[image]])
+            invalid[image] = latest_images[image]
+        else:
+            valid[image] = latest_images[image]
+    return valid, invalid
+
+
+def run_latest_images(owner, latest_images, workers=1, prefetch=1, eviction=None, force=False):
+    """
+    Pulls and tests every latest image, testing up to 'workers' images at once while pulling up to 'prefetch' images ahead
+    :param owner: str: Docker Hub organization of the images
+    :param latest_images: {image: tag}: the 'latest' section of relations.yaml
+    :param workers: int: number of images to test at once
+    :param prefetch: int: number of images to pull ahead of the ones being tested
+    :param eviction: ImageEvictionManager: optional manager that keeps pulled images within a disk budget
+    :param force: bool: when true, test every image even if it has already passed
+    :return: {image_name: str}: 'passed', 'cached', 'failed' or 'pull failed' for each image
+    """
+    results = {}
+    slots = threading.Semaphore(workers + prefetch)
+    cache = result_cache.ResultCache()
+
+    def pull(image, tag, image_name):
+        slots.acquire()
+        test_path = "{}/{}/unittest.yml".format(image, tag)
+        if not force and cache.has_passed(result_cache.remote_image_id(image_name), test_path):
+            return 'cached'
+        if not try_pull_image(image_name):
+            return False
+        if eviction:
+            eviction.touch(image_name)
+        return True
+
+    def validate(image, tag, image_name, pulled):
+        try:
+            # Time spent waiting here shows how much of each pull the prefetching failed to hide
+            with tracing.span("latest.wait_pull", image=image_name):
+                pulled.result()
+            if pulled.result() == 'cached':
+                print("Image {} has already passed its tests, skipping.".format(image_name))
+                return 'cached'
+            if not pulled.result():
+                return 'pull failed'
+            if run_image_tests(owner, image, tag, capture=workers > 1, force=force):
+                print("Test for {} successful.".format(image_name))
+                return 'passed'
+            print("ERROR: Image testing failed for " + image_name)
+            return 'failed'
+        finally:
+            if eviction:
+                eviction.release(image_name)
+            slots.release()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, prefetch)) as pull_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers) as test_executor:
+        futures = {}
+        for image in latest_images:
+            tag = latest_images[image]
+            image_name = get_image_name(owner, image, tag)
+            pulled = pull_executor.submit(pull, image, tag, image_name)
+            futures[image_name] = test_executor.submit(
+                validate, image, tag, image_name, pulled)
+        for image_name in futures:
+            results[image_name] = futures[image_name].result()
+    return results
+
+
+def name_hash(image):
+    """
+    Returns a hash of an image name that is the same on every runner, unlike hash()
+    :param image: str: name of the image
+    """
+    return hashlib.sha256(image.encode()).hexdigest()
+
+
+def image_costs(owner, latest_images, estimator=None, sizes=True):
+    """
+    Estimates the seconds each latest image takes to pull and test, from its recorded timings, or else from its compressed
+    size in the registry, or else the same default for every image
+    :param owner: str: Docker Hub organization of the images
+    :param latest_images: {image: tag}: the images
+    :param estimator: timings.Estimator: recorded timings, read from the database if not given
+    :param sizes: bool: when false, do not look up image sizes in the registry
+    :return: {image: float}: the estimated seconds of each image
+    """
+    estimator = estimator or timings.Estimator()
+    costs = {image: estimator.image_estimate(image, latest_images[image], ['pull', 'test']) for image in latest_images}
+    unknown = [image for image in latest_images if costs[image] is None]
+    if sizes and unknown:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            image_sizes = dict(zip(unknown, executor.map(
+                lambda image: registry_api.image_size(get_image_name(owner, image, latest_images[image])), unknown)))
+        for image in unknown:
+            if image_sizes[image]:
+                costs[image] = image_sizes[image] / PULL_BYTES_PER_SECOND + timings.DEFAULT_ESTIMATES['test']
+    for image in latest_images:
+        if costs[image] is None:
+            costs[image] = timings.DEFAULT_ESTIMATES['pull'] + timings.DEFAULT_ESTIMATES['test']
+    return costs
+
+
+def base_group(relations, image):
+    """
+    Returns the image at the top of an image's chain of parents built in this repository, so images sharing its layers can
+    be kept together.  Images without parents in relations.yaml, such as ubuntu:18.04, are not part of any chain.
+    :param relations: dict: loaded relations.yaml data
+    :param image: str: image in 'tool:version' format
+    """
+    images = (relations or {}).get('images') or {}
+
+    def built_here(node):
+        tool, _, version = node.partition(':')
+        entry = (images.get(tool) or {}).get(version) or {}
+        return [parent for parent in entry.get('parents') or [] if isinstance(parent, str)]
+    seen = {image}
+    while True:
+        parents = sorted(parent for parent in built_here(image) if built_here(parent) and parent not in seen)
+        if not parents:
+            return image
+        image = parents[0]
+        seen.add(image)
+
+
+def shard_latest_images(latest_images, relations, shard_count, costs):
+    """
+    Splits the latest images into shards of similar estimated cost, the same way on every runner.  Images sharing a base
+    image stay on one shard to reuse its layers, unless their group alone costs more than an even share.
+    :param latest_images: {image: tag}: the images
+    :param relations: dict: loaded relations.yaml data
+    :param shard_count: int: the number of shards
+    :param costs: {image: float}: the estimated seconds of each image, as returned by image_costs
+    :return: ([{image: tag}], [float]): the images of each shard in their original order, and the estimated seconds of each
+    """
+    groups = {}
+    for image in latest_images:
+        groups.setdefault(base_group(relations, "{}:{}".format(image, latest_images[image])), []).append(image)
+    share = sum(costs.values()) / shard_count
+    units = []
+    for group in groups.values():
+        if len(group) > 1 and sum(costs[image] for image in group) > share:
+            units.extend([image] for image in group)
+        else:
+            units.append(group)
+    # Largest first onto the least loaded shard, with ties broken by name so every runner agrees
+    units.sort(key=lambda unit: (-sum(costs[image] for image in unit), name_hash(unit[0])))
+    assigned = {}
+    loads = [0.0] * shard_count
+    for unit in units:
+        shard = min(range(shard_count), key=lambda index: (loads[index], index))
+        loads[shard] += sum(costs[image] for image in unit)
+        for image in unit:
+            assigned[image] = shard
+    shards = [{image: latest_images[image] for image in latest_images if assigned[image] == index}
+              for index in range(shard_count)]
+    return shards, loads
+
+
+def default_costs(latest_images):
+    """
+    Returns the same default cost for every image, for sharding from relations.yaml alone when there is no shard plan, as
+    the recorded timings and registry lookups can differ between runners
+    :param latest_images: {image: tag}: the images
+    """
+    return {image: timings.DEFAULT_ESTIMATES['pull'] + timings.DEFAULT_ESTIMATES['test'] for image in latest_images}
+
+
+def plan_shards(owner, relations, shard_count, costs=None):
+    """
+    Splits the latest images into shards once, for every shard runner to read with --shard-plan
+    :param owner: str: Docker Hub organization of the images
+    :param relations: dict: loaded relations.yaml data
+    :param shard_count: int: the number of shards
+    :param costs: {image: float}: the estimated seconds of each image, from image_costs if not given
+    :return: dict: the shard count, the images of each shard and their estimated seconds
+    """
+    latest_images = relations['latest']
+    shards, loads = shard_latest_images(latest_images, relations, shard_count,
+                                        costs or image_costs(owner, latest_images))
+    return {'shard_count': shard_count, 'shards': shards, 'loads': loads}
+
+
+def read_shard_plan(plan_path, shard_count):
+    """
+    Reads a shard plan written by the plan command, exiting if it is unreadable or was made for another shard count
+    :param plan_path: str: path of the plan file
+    :param shard_count: int: the number of shards this run expects
+    :return: ([{image: tag}], [float]): the images of each shard, and the estimated seconds of each
+    """
+    try:
+        with open(plan_path) as plan_file:
+            plan = json.load(plan_file)
+    except (OSError, ValueError) as exc:
+        print("ERROR: Unable to read the shard plan {}: {}".format(plan_path, exc), file=sys.stderr)
+        sys.exit(1)
+    if plan.get('shard_count') != shard_count:
+        print("ERROR: The shard plan {} splits the images into {} shards, not {}.".format(
+            plan_path, plan.get('shard_count'), shard_count), file=sys.stderr)
         sys.exit(1)
+    return plan['shards'], plan['loads']
+
+
+def write_results(results_path, owner, results, images, shard_index=0, shard_count=1):
+    """
+    Writes the results of a run to a JSON file for the merge command
+    :param results_path: str: path of the file to write
+    :param owner: str: Docker Hub organization of the images
+    :param results: {image_name: str}: results as returned by run_latest_images
+    :param images: {image: tag}: the images this run was given
+    :param shard_index: int: index of this run's shard
+    :param shard_count: int: number of shards
+    """
+    with open(results_path, 'w') as results_file:
+        json.dump({'owner': owner, 'shard_index': shard_index, 'shard_count': shard_count, 'images': images,
+                   'results': results}, results_file, indent=2)
+
+
+def merge_results(results_paths, relations=None):
+    """
+    Combines the result files of every shard, marking latest images no shard ran as 'not run'
+    :param results_paths: [str]: paths of the result files
+    :param relations: dict: optional loaded relations.yaml data to check that every latest image was run
+    :return: ({image_name: str}, [str]): the combined results, and problems with the set of shards
+    """
+    results = {}
+    images = {}
+    problems = []
+    shards = {}
+    owner = None
+    for results_path in results_paths:
+        with open(results_path) as results_file:
+            shard = json.load(results_file)
+        shards.setdefault(shard['shard_count'], set()).add(shard['shard_index'])
+        owner = owner or shard.get('owner')
+        images.update(shard['images'])
+        for image_name, result in shard['results'].items():
+            # An image run by more than one shard keeps its worst result
+            if results.get(image_name) in [None, 'passed', 'cached']:
+                results[image_name] = result
+    for shard_count, indexes in shards.items():
+        missing = sorted(set(range(shard_count)) - indexes)
+        if missing:
+            problems.append("No results for shards {} of {}".format(", ".join(str(index) for index in missing), shard_count))
+    if len(shards) > 1:
+        problems.append("Result files are from runs with different shard counts: {}".format(
+            ", ".join(str(count) for count in sorted(shards))))
+    for image, tag in ((relations or {}).get('latest') or {}).items():
+        if image not in images:
+            results[get_image_name(owner, image, tag)] = 'not run'
+    return results, problems
+
+
+def print_summary(results):
+    """
+    Prints the pass/fail result of every tested image
+    :param results: {image_name: str}: results as returned by run_latest_images
+    """
+    passed = len([image for image in results if results[image]
+                  in ['passed', 'cached']])
+    print("Latest image results:")
+    for image_name in results:
+        print("    {}: {}".format(image_name, results[image_name]))
+    print("Tested {} images. Passed: {}. Failed: {}.".format(
+        len(results), passed, len(results) - passed))
 
 
 def main():
@@ -37,35 +401,121 @@ def main():
     Main method
 
     """
-    if len(sys.argv) < 1:
-        print(
-            "Usage python3 scripts/ci_latest_images.py <docker_owner> <relations.yaml path>")
+    parser = argparse.ArgumentParser(
+        description="Pulls and tests every image in the 'latest' section of relations.yaml, with 'plan <owner> <relations>' splits them into shards, or with 'merge <results>...' combines the result files of several shards")
+    parser.add_argument("owner", help="Docker Hub organization of the images")
+    parser.add_argument("relations", help="Path to relations.yaml")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('LATEST_WORKERS', 1)),
+                        help="Number of images to test at once (default: LATEST_WORKERS or 1)")
+    parser.add_argument("--prefetch", type=int, default=1,
+                        help="Number of images to pull ahead of the ones being tested (default: 1)")
+    parser.add_argument("--disk-budget", default=os.environ.get('DOCKER_DISK_BUDGET', image_eviction.DEFAULT_DISK_BUDGET),
+                        help="Disk space pulled images may use before the least recently used ones are removed (default: DOCKER_DISK_BUDGET or {})".format(
+                            image_eviction.DEFAULT_DISK_BUDGET))
+    parser.add_argument("--force", action="store_true",
+                        help="Test every image, even if it has already passed with the same unittest.yml")
+    parser.add_argument("--shard-index", type=int, default=int(os.environ.get('SHARD_INDEX', 0)),
+                        help="Index of the shard to test, from 0 (default: SHARD_INDEX or 0)")
+    parser.add_argument("--shard-count", type=int, default=int(os.environ.get('SHARD_COUNT', 1)),
+                        help="Number of shards the latest images are split into (default: SHARD_COUNT or 1)")
+    parser.add_argument("--shard-plan", default=os.environ.get('SHARD_PLAN'),
+                        help="Shard plan written by the plan command, without it the images are split evenly by count (default: SHARD_PLAN)")
+    parser.add_argument("--results", help="Write the results to this JSON file, to combine shards with the merge command")
+    if sys.argv[1:2] == ["merge"]:
+        merge_main()
+        return
+    if sys.argv[1:2] == ["plan"]:
+        plan_main()
+        return
+    args = parser.parse_args()
+    if args.shard_count < 1 or not 0 <= args.shard_index < args.shard_count:
+        print("ERROR: Shard index {} is not between 0 and the shard count {}.".format(
+            args.shard_index, args.shard_count), file=sys.stderr)
         sys.exit(1)
-    else:
-        owner = sys.argv[1]
-        functions.docker_login()
-        relations = load_yaml(os.path.abspath(sys.argv[2]))
-        latest_images = relations['latest']
-        for image in latest_images:
-            tag = latest_images[image]
-            image_name = "{}/{}:{}".format(owner, image, tag).replace("+", "_")
-            if not (str(os.environ.get('DOCKERHUB_URL')).lower() == "none" or str(os.environ.get('DOCKERHUB_URL')).lower() == 'null' or os.environ.get('DOCKERHUB_URL') == None or os.environ.get('DOCKERHUB_URL') == ''):
-                image_name = "{}/{}".format(
-                    os.environ.get('DOCKERHUB_URL'), image_name)
-            pull_image(image_name)
-            test_path = "{}/{}/unittest.yml".format(image, tag)
-            test_command = "python3 scripts/ci_image.py \"{}\" {}".format(
-                owner, test_path).split(" ")
-            test_command = subprocess.Popen(test_command)
-            test_code = test_command.wait()
-            if test_code != 0:
-                print("ERROR: Image testing failed for " + image_name)
-                sys.exit(1)
+    with tracing.entry_point("ci_latest_images", owner=args.owner, workers=args.workers, prefetch=args.prefetch):
+        run(args)
+
+
+def run(args):
+    """
+    Pulls and tests the latest images as set by the command line arguments
+    :param args: argparse.Namespace: the parsed arguments
+    """
+    relations = load_yaml(os.path.abspath(args.relations))
+    shard_images = relations['latest']
+    if args.shard_count > 1:
+        with tracing.span("latest.shard", shard_index=args.shard_index, shard_count=args.shard_count) as shard_span:
+            if args.shard_plan:
+                shards, loads = read_shard_plan(args.shard_plan, args.shard_count)
             else:
-                print("Test for {} successful, purging and restarting for next image.".format(
-                    image_name))
-                purge_command = "docker system prune -a -f".split(" ")
-                purge_command = subprocess.Popen(purge_command)
+                # Each runner has its own timings cache and registry lookups can fail, so only relations.yaml is used
+                shards, loads = shard_latest_images(shard_images, relations, args.shard_count, default_costs(shard_images))
+            shard_images = shards[args.shard_index]
+            shard_span.set('images', len(shard_images))
+        print("Testing shard {} of {}: {} of {} images, estimated at ~{:.0f}s (shards range from ~{:.0f}s to ~{:.0f}s)".format(
+            args.shard_index, args.shard_count, len(shard_images), len(relations['latest']),
+            loads[args.shard_index], min(loads), max(loads)))
+    latest_images, invalid = validate_test_specs(shard_images)
+    # The slowest images start first, so they do not hold up the end of the run
+    latest_images = timings.longest_first(latest_images, ['pull', 'test'])
+    functions.docker_login()
+    upcoming = [get_image_name(args.owner, image, latest_images[image])
+                for image in latest_images]
+    eviction = image_eviction.ImageEvictionManager(
+        args.disk_budget, relations, upcoming)
+    results = run_latest_images(
+        args.owner, latest_images, max(1, args.workers), max(0, args.prefetch), eviction, args.force)
+    timings.save()
+    for image in invalid:
+        results[get_image_name(args.owner, image, invalid[image])] = 'invalid tests'
+    print_summary(results)
+    if args.results:
+        write_results(args.results, args.owner, results, shard_images, args.shard_index, args.shard_count)
+    if any(results[image_name] not in ['passed', 'cached'] for image_name in results):
+        sys.exit(1)
+
+
+def plan_main():
+    """
+    Main method of the plan command
+    """
+    parser = argparse.ArgumentParser(prog="ci_latest_images.py plan",
+                                     description="Splits the latest images into shards of similar estimated cost for --shard-plan")
+    parser.add_argument("owner", help="Docker Hub organization of the images")
+    parser.add_argument("relations", help="Path to relations.yaml")
+    parser.add_argument("--shard-count", type=int, default=int(os.environ.get('SHARD_COUNT', 1)),
+                        help="Number of shards to split the latest images into (default: SHARD_COUNT or 1)")
+    parser.add_argument("--output", help="Write the plan to this file instead of printing it")
+    args = parser.parse_args(sys.argv[2:])
+    if args.shard_count < 1:
+        print("ERROR: Shard count {} is less than 1.".format(args.shard_count), file=sys.stderr)
+        sys.exit(1)
+    plan = plan_shards(args.owner, load_yaml(os.path.abspath(args.relations)), args.shard_count)
+    for index, shard in enumerate(plan['shards']):
+        print("Shard {}: {} images, estimated at ~{:.0f}s".format(index, len(shard), plan['loads'][index]), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as plan_file:
+            json.dump(plan, plan_file, indent=2)
+    else:
+        print(json.dumps(plan))
+
+
+def merge_main():
+    """
+    Main method of the merge command
+    """
+    parser = argparse.ArgumentParser(prog="ci_latest_images.py merge",
+                                     description="Combines the --results files of every shard into one report")
+    parser.add_argument("results", nargs="+", help="Result files written with --results")
+    parser.add_argument("--relations", help="relations.yaml, to report latest images that no shard ran")
+    args = parser.parse_args(sys.argv[2:])
+    relations = load_yaml(os.path.abspath(args.relations)) if args.relations else None
+    results, problems = merge_results(args.results, relations)
+    print_summary(results)
+    for problem in problems:
+        print("ERROR: {}".format(problem))
+    if problems or any(results[image_name] not in ['passed', 'cached'] for image_name in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+"""
+Small Docker Engine API client used in place of the docker CLI when the daemon socket is available:
+    1) Requests go over a pool of keep-alive HTTP connections to the unix socket, so no process is started per call
+    2) Pull, push, build and log responses are streamed as they arrive instead of being buffered until the end
+    3) get_client returns None when the socket is missing, unreachable or DOCKER_API is set to false, and callers fall back to the CLI
+"""
+
+import os
+import re
+import sys
+import json
+import queue
+import base64
+import socket
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import posixpath
+import http.client
+import urllib.parse
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+POOL_SIZE = 8
+STREAM_STDOUT = 1
+STREAM_STDERR = 2
+STALE_ERRORS = (http.client.RemoteDisconnected,
+                BrokenPipeError, ConnectionResetError)
+
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+
+
+class DockerError(Exception):
+    """
+    Error returned by the Docker daemon
+    """
+
+    def __init__(self, status, message):
+        """
+        :param status: int: HTTP status of the response, or 0 for errors reported inside a stream
+        :param message: str: the error message
+        """
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class DockerTimeout(DockerError):
+    """
+    Raised when a container's output does not end before its deadline
+    """
+
+    def __init__(self, message):
+        """
+        :param message: str: the error message
+        """
+        super().__init__(0, message)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection to a unix socket
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        """
+        :param socket_path: str: path to the unix socket
+        :param timeout: float: optional socket timeout in seconds
+        """
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+        self.unix_socket = None
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+        # Kept after getresponse hands a closing connection's socket over to the response, so reads can still be timed out
+        self.unix_socket = self.sock
+
+
+def get_socket_path():
+    """
+    Returns the path of the Docker daemon socket, or None if DOCKER_HOST points somewhere other than a unix socket
+    """
+    docker_host = os.environ.get('DOCKER_HOST')
+    if not docker_host:
+        return DEFAULT_SOCKET
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://"):]
+    return None
+
+
+def get_client():
+    """
+    Returns a shared client for the Docker daemon socket, or None if the CLI should be used instead
+    """
+    if str(os.environ.get('DOCKER_API', '')).lower() in ['0', 'false', 'no']:
+        return None
+    socket_path = get_socket_path()
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    with CLIENTS_LOCK:
+        if socket_path not in CLIENTS:
+            client = DockerClient(socket_path)
+            try:
+                client.ping()
+            except (OSError, http.client.HTTPException, DockerError) as exc:
+                print("Unable to reach the Docker daemon at {} ({}), using the docker CLI instead.".format(
+                    socket_path, exc), file=sys.stderr)
+                client = None
+            CLIENTS[socket_path] = client
+        return CLIENTS[socket_path]
+
+
+def split_tag(image_name):
+    """
+    Splits an image name into its repository and tag, defaulting the tag to 'latest'
+    :param image_name: str: image in '[registry[:port]/]repository[:tag]' format
+    """
+    repository, _, tag = image_name.rpartition(':')
+    if not repository or '/' in tag:
+        return image_name, "latest"
+    return repository, tag
+
+
+def docker_config():
+    """
+    Returns the docker CLI config from DOCKER_CONFIG or ~/.docker, or an empty dict if it is missing or unreadable
+    """
+    config_path = os.path.join(os.environ.get('DOCKER_CONFIG') or os.path.expanduser(
+        "~/.docker"), "config.json")
+    try:
+        with open(config_path) as config_file:
+            return json.load(config_file) or {}
+    except (OSError, ValueError):
+        return {}
+
+
+def config_credentials(entry):
+    """
+    Returns the username and password of an 'auths' entry of the docker CLI config, or None if it has no inline credentials
+    :param entry: dict: the entry
+    """
+    if not (entry or {}).get('auth'):
+        return None
+    username, _, password = base64.b64decode(entry['auth']).decode().partition(':')
+    return {'username': username, 'password': password}
+
+
+def default_registry():
+    """
+    Returns the registry set in DOCKERHUB_URL, or None for Docker Hub
+    """
+    registry = os.environ.get('DOCKERHUB_URL')
+    if registry is None or registry == '' or str(registry).lower() in ["none", "null"]:
+        return None
+    return registry
+
+
+def registry_credentials(registry=None):
+    """
+    Returns the username and password for a registry, from DOCKERHUB_UN and DOCKERHUB_PW or the docker CLI config,
+    or None if no credentials are available
+    :param registry: str: optional registry address, defaulting to DOCKERHUB_URL or Docker Hub
+    """
+    if os.environ.get('DOCKERHUB_UN') and os.environ.get('DOCKERHUB_PW'):
+        return {'username': os.environ.get('DOCKERHUB_UN'),
+                'password': os.environ.get('DOCKERHUB_PW')}
+    auths = docker_config().get('auths') or {}
+    for server, entry in auths.items():
+        if (registry and registry in server) or (not registry and "docker.io" in server):
+            return config_credentials(entry)
+    return None
+
+
+def registry_auth(registry=None):
+    """
+    Returns the X-Registry-Auth header value for a registry, or None if no credentials are available
+    :param registry: str: optional registry address, defaulting to DOCKERHUB_URL or Docker Hub
+    """
+    if registry is None:
+        registry = default_registry()
+    auth = registry_credentials(registry)
+    if auth is None:
+        return None
+    auth['serveraddress'] = registry or "https://index.docker.io/v1/"
+    return base64.urlsafe_b64encode(json.dumps(auth).encode()).decode()
+
+
+def registry_config():
+    """
+    Returns the X-Registry-Config header value for a build, holding the credentials of every registry the docker CLI is logged
+    in to along with DOCKERHUB_URL, so that FROM lines can pull private parents, or None if no credentials are available
+    """
+    config = {}
+    for server, entry in (docker_config().get('auths') or {}).items():
+        if config_credentials(entry):
+            config[server] = config_credentials(entry)
+    registry = default_registry()
+    if registry_credentials(registry):
+        config[registry or "https://index.docker.io/v1/"] = registry_credentials(registry)
+    if not config:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(config).encode()).decode()
+
+
+def uses_credential_helpers():
+    """
+    Checks whether the docker CLI keeps its credentials in a credential helper, where the API client cannot read them
+    """
+    config = docker_config()
+    return bool(config.get('credsStore') or config.get('credHelpers'))
+
+
+def ignore_pattern(pattern):
+    """
+    Compiles a .dockerignore pattern into a regular expression, where '*' and '?' do not cross a '/' and '**' matches any
+    number of directories
+    :param pattern: str: the pattern, already cleaned
+    """
+    regex = ""
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        if pattern.startswith("**/", position):
+            regex += "(.*/)?"
+            position += 2
+        elif pattern.startswith("**", position):
+            regex += ".*"
+            position += 1
+        elif char == '*':
+            regex += "[^/]*"
+        elif char == '?':
+            regex += "[^/]"
+        elif char == '[' and pattern.find(']', position + 2) != -1:
+            end = pattern.find(']', position + 2)
+            chars = pattern[position + 1:end]
+            if chars[0] in "!^":
+                chars = "^" + chars[1:]
+            regex += "[" + chars.replace("\\", "\\\\") + "]"
+            position = end
+        elif char == '\\' and position + 1 < len(pattern):
+            position += 1
+            regex += re.escape(pattern[position])
+        else:
+            regex += re.escape(char)
+        position += 1
+    return re.compile(regex + "$")
+
+
+def dockerignore_patterns(context_dir):
+    """
+    Reads the .dockerignore file of a build context
+    :param context_dir: str: path to the build context
+    :return: [(re.Pattern, bool)]: each pattern, with False for '!' exceptions that add files back
+    """
+    patterns = []
+    try:
+        with open(os.path.join(context_dir, ".dockerignore"), encoding='utf-8') as ignore_file:
+            lines = ignore_file.read().splitlines()
+    except OSError:
+        return patterns
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        excluded = not line.startswith('!')
+        pattern = posixpath.normpath(line.lstrip('!').strip()).lstrip('/')
+        if pattern and pattern != '.':
+            patterns.append((ignore_pattern(pattern), excluded))
+    return patterns
+
+
+def is_ignored(relative_path, patterns):
+    """
+    Checks whether a path in a build context is left out by .dockerignore patterns, where the last pattern matching the path
+    or one of its parent directories wins, as in the docker CLI
+    :param relative_path: str: path relative to the build context, with forward slashes
+    :param patterns: [(re.Pattern, bool)]: as returned by dockerignore_patterns
+    """
+    parts = relative_path.split('/')
+    prefixes = ['/'.join(parts[:end]) for end in range(1, len(parts) + 1)]
+    ignored = False
+    for regex, excluded in patterns:
+        if any(regex.match(prefix) for prefix in prefixes):
+            ignored = excluded
+    return ignored
+
+
+def add_context(context_tar, context_dir, dockerfile="Dockerfile"):
+    """
+    Adds a build context to a tar archive, leaving out the files matched by its .dockerignore. The Dockerfile and
+    .dockerignore are always sent, as the docker CLI does
+    :param context_tar: TarFile: the archive to add to
+    :param context_dir: str: path to the build context
+    :param dockerfile: str: path to the Dockerfile inside the context
+    """
+    patterns = dockerignore_patterns(context_dir)
+    has_exceptions = any(not excluded for regex, excluded in patterns)
+    always_sent = [posixpath.normpath(dockerfile), ".dockerignore"]
+    context_tar.add(context_dir, arcname='.', recursive=False)
+    for root, dirs, files in os.walk(context_dir):
+        dirs.sort()
+        relative_root = os.path.relpath(root, context_dir).replace(os.sep, '/')
+        for name in sorted(dirs + files):
+            relative_path = name if relative_root == '.' else relative_root + '/' + name
+            if relative_path not in always_sent and is_ignored(relative_path, patterns):
+                # An ignored directory is still searched when an exception could add something inside it back
+                if name in dirs and not has_exceptions:
+                    dirs.remove(name)
+                continue
+            context_tar.add(os.path.join(root, name), arcname='./' + relative_path, recursive=False)
+
+
+def read_json_stream(response):
+    """
+    Yields the JSON messages of a progress stream (pull, push and build), raising DockerError for any error message
+    :param response: HTTPResponse: the streaming response
+    """
+    for line in iter(response.readline, b''):
+        line = line.strip()
+        if not line:
+            continue
+        message = json.loads(line.decode('utf-8', 'replace'))
+        if message.get('error'):
+            raise DockerError(0, message['error'])
+        yield message
+
+
+def read_multiplexed_stream(response, conn=None, deadline=None):
+    """
+    Yields (stream type, bytes) frames from a non-TTY container output stream
+    :param response: HTTPResponse or file: the attached output stream
+    :param conn: UnixHTTPConnection: the connection the stream is read from, needed for a deadline
+    :param deadline: float: optional time.monotonic() value after which DockerTimeout is raised
+    """
+    while True:
+        try:
+            if deadline is not None:
+                conn.unix_socket.settimeout(
+                    max(deadline - time.monotonic(), 0.001))
+            header = response.read(8)
+            if len(header) < 8:
+                return
+            stream_type, size = struct.unpack('>BxxxL', header)
+            data = response.read(size)
+        except socket.timeout:
+            raise DockerTimeout("The container's output did not end in time")
+        yield stream_type, data
+
+
+class DockerClient:
+    """
+    Thread safe Docker Engine API client over a unix socket
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None):
+        """
+        :param socket_path: str: path to the Docker daemon socket
+        :param timeout: float: optional socket timeout in seconds, builds and pulls can take a long time so there is none by default
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+    def connection(self):
+        """
+        Returns an idle pooled connection, or a new one if the pool is empty
+        :return: (UnixHTTPConnection, bool): the connection and whether it was reused
+        """
+        try:
+            return self.pool.get_nowait(), True
+        except queue.Empty:
+            return UnixHTTPConnection(self.socket_path, self.timeout), False
+
+    def release(self, conn, response):
+        """
+        Returns a connection to the pool once its response has been read, closing it if it cannot be reused
+        :param conn: UnixHTTPConnection: the connection
+        :param response: HTTPResponse: its fully read response
+        """
+        if response.will_close:
+            conn.close()
+            return
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def send(self, method, path, params=None, body=None, headers=None):
+        """
+        Sends a request and returns the connection along with the response, whose body has not been read
+        :param method: str: HTTP method
+        :param path: str: API path (e.g. '/images/json')
+        :param params: dict: optional query parameters, None values are dropped
+        :param body: dict, bytes or file: optional request body, dicts are sent as JSON
+        :param headers: dict: optional extra headers
+        """
+        if params:
+            path += "?" + urllib.parse.urlencode(
+                {key: value for key, value in params.items() if value is not None})
+        headers = dict(headers or {})
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = "application/json"
+        elif hasattr(body, 'seek'):
+            # Send a file with its length rather than chunked, so it is streamed from disk in one pass
+            body.seek(0, os.SEEK_END)
+            headers['Content-Length'] = str(body.tell())
+        while True:
+            conn, reused = self.connection()
+            try:
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                conn.request(method, path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except STALE_ERRORS:
+                conn.close()
+                # The daemon closed an idle pooled connection, retry on a new one
+                if not reused:
+                    raise
+
+    def check(self, conn, response):
+        """
+        Raises DockerError if a response is an error, reading its message and releasing the connection
+        :param conn: UnixHTTPConnection: the connection the response was read from
+        :param response: HTTPResponse: the response
+        """
+        if response.status < 400:
+            return
+        data = response.read()
+        self.release(conn, response)
+        try:
+            message = json.loads(data.decode()).get('message')
+        except ValueError:
+            message = data.decode('utf-8', 'replace')
+        raise DockerError(response.status, message or response.reason)
+
+    def request(self, method, path, params=None, body=None, headers=None):
+        """
+        Sends a request and returns its decoded JSON body, or None if the body is empty
+        """
+        conn, response = self.send(method, path, params, body, headers)
+        self.check(conn, response)
+        data = response.read()
+        self.release(conn, response)
+        return json.loads(data.decode()) if data else None
+
+    def stream(self, method, path, params=None, body=None, headers=None):
+        """
+        Sends a request and yields the messages of its JSON progress stream as they arrive
+        """
+        conn, response = self.send(method, path, params, body, headers)
+        self.check(conn, response)
+        try:
+            for message in read_json_stream(response):
+                yield message
+        except BaseException:
+            conn.close()
+            raise
+        self.release(conn, response)
+
+    def ping(self):
+        conn, response = self.send("GET", "/_ping")
+        self.check(conn, response)
+        response.read()
+        self.release(conn, response)
+        return True
+
+    def images(self, filters=None):
+        """
+        Lists local images
+        :param filters: {str: [str]}: optional filters (e.g. {'label': ['key=value']})
+        """
+        return self.request("GET", "/images/json", {'filters': json.dumps(filters) if filters else None})
+
+    def inspect_image(self, image_name):
+        """
+        Returns the details of a local image, or None if it does not exist
+        :param image_name: str: name or ID of the image
+        """
+        try:
+            return self.request("GET", "/images/{}/json".format(urllib.parse.quote(image_name, safe='')))
+        except DockerError as exc:
+            if exc.status == 404:
+                return None
+            raise
+
+    def pull(self, image_name, auth=None):
+        """
+        Pulls an image, yielding its progress messages
+        :param image_name: str: image in '[registry/]repository[:tag]' format
+        :param auth: str: optional X-Registry-Auth header value
+        """
+        repository, tag = split_tag(image_name)
+        headers = {'X-Registry-Auth': auth} if auth else None
+        return self.stream("POST", "/images/create", {'fromImage': repository, 'tag': tag}, headers=headers)
+
+    def push(self, image_name, auth):
+        """
+        Pushes an image, yielding its progress messages
+        :param image_name: str: image in '[registry/]repository[:tag]' format
+        :param auth: str: X-Registry-Auth header value, as returned by registry_auth
+        """
+        repository, tag = split_tag(image_name)
+        return self.stream("POST", "/images/{}/push".format(repository), {'tag': tag},
+                           headers={'X-Registry-Auth': auth})
+
+    def build(self, context_dir, image_name, dockerfile="Dockerfile", labels=None, quiet=False, registry_config=None):
+        """
+        Builds an image from a context directory, yielding its output messages
+        :param context_dir: str: path to the build context, whose .dockerignore is honoured
+        :param image_name: str: name to tag the image with
+        :param dockerfile: str: path to the Dockerfile inside the context
+        :param labels: dict: optional labels to add to the image
+        :param quiet: bool: when true, only the image ID is output
+        :param registry_config: str: optional X-Registry-Config header value, as returned by registry_config
+        """
+        with tempfile.TemporaryFile() as context:
+            with tarfile.open(fileobj=context, mode='w') as context_tar:
+                add_context(context_tar, context_dir, dockerfile)
+            context.seek(0)
+            params = {'t': image_name, 'dockerfile': dockerfile, 'q': int(quiet),
+                      'labels': json.dumps(labels) if labels else None}
+            headers = {'Content-Type': "application/x-tar"}
+            if registry_config:
+                headers['X-Registry-Config'] = registry_config
+            for message in self.stream("POST", "/build", params, body=context, headers=headers):
+                yield message
+
+    def tag(self, image, image_name):
+        """
+        Tags an image
+        :param image: str: name or ID of the existing image
+        :param image_name: str: the new name in 'repository[:tag]' format
+        """
+        repository, tag = split_tag(image_name)
+        self.request("POST", "/images/{}/tag".format(urllib.parse.quote(image, safe='')),
+                     {'repo': repository, 'tag': tag})
+
+    def remove_image(self, image_name, force=False):
+        """
+        Removes an image, returning False if it does not exist
+        :param image_name: str: name or ID of the image
+        :param force: bool: remove the image even if it is used by stopped containers
+        """
+        try:
+            self.request("DELETE", "/images/{}".format(urllib.parse.quote(image_name, safe='')),
+                         {'force': 'true' if force else None})
+        except DockerError as exc:
+            if exc.status == 404:
+                return False
+            raise
+        return True
+
+    def prune_images(self):
+        """
+        Removes dangling images, returning the number of bytes reclaimed
+        """
+        return (self.request("POST", "/images/prune") or {}).get('SpaceReclaimed', 0)
+
+    def disk_usage(self):
+        """
+        Returns the number of bytes used by local images
+        """
+        return (self.request("GET", "/system/df") or {}).get('LayersSize', 0)
+
+    def create_container(self, image_name, cmd=None, entrypoint=None, workdir=None, user=None, open_stdin=False, auto_remove=False):
+        """
+        Creates a container, returning its ID
+        :param image_name: str: name of the image
+        :param cmd: [str]: optional command
+        :param entrypoint: [str]: optional entrypoint overriding the image's
+        :param workdir: str: optional working directory
+        :param user: str: optional user to run as
+        :param open_stdin: bool: keep stdin open, as 'docker run -i' does
+        :param auto_remove: bool: remove the container once it exits, as 'docker run --rm' does
+        """
+        config = {'Image': image_name, 'AttachStdout': True, 'AttachStderr': True,
+                  'OpenStdin': open_stdin, 'HostConfig': {'AutoRemove': auto_remove}}
+        if cmd is not None:
+            config['Cmd'] = cmd
+        if entrypoint is not None:
+            config['Entrypoint'] = entrypoint
+        if workdir:
+            config['WorkingDir'] = workdir
+        if user:
+            config['User'] = user
+        return self.request("POST", "/containers/create", body=config)['Id']
+
+    def start_container(self, container_id):
+        self.request("POST", "/containers/{}/start".format(container_id))
+
+    def wait_container(self, container_id):
+        """
+        Waits for a container to exit, returning its exit code
+        :param container_id: str: ID of the container
+        """
+        return self.request("POST", "/containers/{}/wait".format(container_id))['StatusCode']
+
+    def container_logs(self, container_id, stdout=True, stderr=False, timeout=None):
+        """
+        Yields the output of a container as it is written, closing the connection if the caller stops reading early
+        :param container_id: str: ID of the container
+        :param stdout: bool: include standard output
+        :param stderr: bool: include standard error
+        :param timeout: float: optional number of seconds after which DockerTimeout is raised if the output has not ended
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        conn, response = self.send("GET", "/containers/{}/logs".format(container_id),
+                                   {'stdout': int(stdout), 'stderr': int(stderr), 'follow': 1})
+        self.check(conn, response)
+        finished = False
+        try:
+            for stream_type, data in read_multiplexed_stream(response, conn, deadline):
+                yield data
+            finished = True
+        finally:
+            if not finished:
+                conn.close()
+        if deadline is not None and conn.sock is not None:
+            conn.sock.settimeout(self.timeout)
+        self.release(conn, response)
+
+    def remove_container(self, container_id, force=True):
+        """
+        Removes a container, ignoring containers that no longer exist
+        :param container_id: str: ID of the container
+        :param force: bool: kill the container first if it is running
+        """
+        try:
+            self.request("DELETE", "/containers/{}".format(container_id),
+                         {'force': 'true' if force else None})
+        except DockerError as exc:
+            if exc.status not in [404, 409]:
+                raise
+
+    def run(self, image_name, cmd, workdir=None, user=None, timeout=None):
+        """
+        Runs a command in a new container and removes it, as 'docker run --rm' does
+        :param image_name: str: name of the image
+        :param cmd: [str]: command to run
+        :param workdir: str: optional working directory
+        :param user: str: optional user to run as
+        :param timeout: float: optional number of seconds after which the container is removed and DockerTimeout raised
+        :return: (int, str): the exit code and standard output of the command
+        """
+        container_id = self.create_container(
+            image_name, cmd, workdir=workdir, user=user)
+        try:
+            self.start_container(container_id)
+            output = b"".join(self.container_logs(
+                container_id, timeout=timeout))
+            return self.wait_container(container_id), output.decode('utf-8', 'replace')
+        finally:
+            self.remove_container(container_id)
+
+    def exec_create(self, container_id, cmd):
+        """
+        Creates an exec session for a command inside a running container, returning its ID
+        :param container_id: str: ID of the container
+        :param cmd: [str]: command to run
+        """
+        return self.request("POST", "/containers/{}/exec".format(container_id),
+                            body={'Cmd': cmd, 'AttachStdout': True, 'AttachStderr': False})['Id']
+
+    def exec_output(self, exec_id, timeout=None):
+        """
+        Starts an exec session and yields its standard output as it is written
+        :param exec_id: str: ID returned by exec_create
+        :param timeout: float: optional number of seconds after which DockerTimeout is raised if the output has not ended
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        # The daemon hands the connection over to the exec session, so it cannot go back to the pool
+        conn, response = self.send("POST", "/exec/{}/start".format(exec_id),
+                                   body={'Detach': False, 'Tty': False})
+        self.check(conn, response)
+        try:
+            for stream_type, data in read_multiplexed_stream(response, conn, deadline):
+                if stream_type == STREAM_STDOUT:
+                    yield data
+        finally:
+            conn.close()
+
+    def exec_exit_code(self, exec_id):
+        """
+        Returns the exit code of an exec session, or None if its command is still running
+        :param exec_id: str: ID returned by exec_create
+        """
+        return self.request("GET", "/exec/{}/json".format(exec_id)).get('ExitCode')
+
+    def exec_run(self, container_id, cmd, timeout=None):
+        """
+        Runs a command inside a running container, as 'docker exec' does
+        :param container_id: str: ID of the container
+        :param cmd: [str]: command to run
+        :param timeout: float: optional number of seconds after which DockerTimeout is raised if the command has not finished
+        :return: (int, str): the exit code and standard output of the command
+        """
+        exec_id = self.exec_create(container_id, cmd)
+        output = b"".join(self.exec_output(exec_id, timeout))
+        return self.exec_exit_code(exec_id), output.decode('utf-8', 'replace')
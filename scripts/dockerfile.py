@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Parses Dockerfiles once for every script that needs their instructions:
+    1) Follows the parser directives, joins line continuations, drops comments, reads heredocs and splits each instruction into
+       its keyword, flags and arguments
+    2) Resolves the build stages: ARG values declared before the first FROM are substituted into the FROM lines, 'FROM <image> AS
+       <name>' aliases and the sources of 'COPY --from' and 'RUN --mount=from=' are resolved to either an earlier stage or an image
+    3) Keeps each parsed file in memory keyed on the sha256 of its content, so validation, relations updates, build planning and
+       prefetching share one parse
+"""
+
+import os
+import re
+import sys
+import hashlib
+import collections
+
+INSTRUCTIONS = ['ADD', 'ARG', 'CMD', 'COPY', 'ENTRYPOINT', 'ENV', 'EXPOSE', 'FROM', 'HEALTHCHECK', 'LABEL', 'MAINTAINER',
+                'ONBUILD', 'RUN', 'SHELL', 'STOPSIGNAL', 'USER', 'VOLUME', 'WORKDIR']
+FLAG_INSTRUCTIONS = ['ADD', 'COPY', 'FROM', 'RUN']
+DIRECTIVE = re.compile(r"#\s*([a-zA-Z]+)\s*=\s*(\S+)\s*$")
+INSTRUCTION = re.compile(r"(\S+)\s*(.*)$", re.DOTALL)
+FLAG = re.compile(r"--([\w-]+)(?:=(\S*))?\s*")
+HEREDOC = re.compile(r"<<(-?)([\"']?)(\w+)\2")
+VARIABLE = re.compile(r"\$(?:\{(\w+)(?::([-+])([^}]*))?\}|(\w+))")
+DOCKERFILE_PATH = re.compile(r"^[^/]+/[^/]+/Dockerfile$")
+
+PARSED = {}
+
+# keyword: upper case instruction, flags: ((name, value),) in order, args: the rest of the instruction, line: its first line number
+Instruction = collections.namedtuple('Instruction', ['keyword', 'flags', 'args', 'line'])
+# name: lower case alias or None, image: the image after ARG substitution, None if it could not be resolved, base_stage: index of
+# the earlier stage it builds on or None, platform: the --platform flag or None
+Stage = collections.namedtuple('Stage', ['index', 'name', 'image', 'base_stage', 'platform', 'line'])
+
+
+def split_reference(reference):
+    """
+    Splits an image reference into its registry, repository, tag and digest
+    :param reference: str: image in '[registry[:port]/]repository[:tag][@digest]' format
+    :return: (str, str, str, str): the registry or None for Docker Hub, the repository, and the tag and digest or None
+    """
+    name, _, digest = reference.partition('@')
+    tag = None
+    if ':' in name.rsplit('/', 1)[-1]:
+        name, tag = name.rsplit(':', 1)
+    first, _, rest = name.partition('/')
+    if rest and ('.' in first or ':' in first or first == "localhost"):
+        return first, rest, tag, digest or None
+    return None, name, tag, digest or None
+
+
+def parent_name(reference):
+    """
+    Returns an image reference in the 'name:version' format of relations.yaml, without its registry or organization
+    :param reference: str: image in '[registry[:port]/]repository[:tag][@digest]' format
+    """
+    registry, repository, tag, digest = split_reference(reference)
+    name = repository.split('/')[-1]
+    if tag is None and digest:
+        return "{}@{}".format(name, digest)
+    return "{}:{}".format(name, tag or "latest")
+
+
+def substitute(text, values):
+    """
+    Expands $NAME, ${NAME}, ${NAME:-default} and ${NAME:+alternative} build argument references
+    :param text: str: the text to expand
+    :param values: {str: str}: build argument values, None for arguments declared without a value
+    :return: (str, [str]): the expanded text and the arguments that had no value
+    """
+    missing = []
+
+    def replace(match):
+        name = match.group(1) or match.group(4)
+        value = values.get(name)
+        if match.group(2) == '-':
+            return value if value else match.group(3)
+        if match.group(2) == '+':
+            return match.group(3) if value else ""
+        if value is None:
+            missing.append(name)
+            return ""
+        return value
+    return VARIABLE.sub(replace, text), missing
+
+
+def parse_arg(args):
+    """
+    Splits the arguments of an ARG instruction into (name, default) pairs, the default being None when not given
+    :param args: str: the arguments
+    """
+    declarations = []
+    for word in args.split():
+        name, equals, default = word.partition('=')
+        declarations.append((name, default.strip('"\'') if equals else None))
+    return declarations
+
+
+def read_instructions(content, errors=None):
+    """
+    Splits Dockerfile content into instructions
+    :param content: str: the Dockerfile content
+    :param errors: [str]: optional list to add the lines that hold no instruction to, such as a lone continuation
+    :return: [Instruction]: the instructions in order
+    """
+    lines = content.splitlines()
+    escape = '\\'
+    for line in lines:
+        directive = DIRECTIVE.match(line.strip())
+        if not directive:
+            break
+        if directive.group(1).lower() == 'escape':
+            escape = directive.group(2)
+    instructions = []
+    number = 0
+    while number < len(lines):
+        start = number + 1
+        text = lines[number]
+        number += 1
+        if not text.strip() or text.lstrip().startswith('#'):
+            continue
+        while text.rstrip().endswith(escape) and number < len(lines):
+            text = text.rstrip()[:-len(escape)]
+            # Comment and empty lines inside a continuation are dropped
+            while number < len(lines) and (not lines[number].strip() or lines[number].lstrip().startswith('#')):
+                number += 1
+            if number < len(lines):
+                text += lines[number]
+                number += 1
+        match = INSTRUCTION.match(text.strip())
+        if match is None:
+            if errors is not None:
+                errors.append("line {}: continuation with no instruction".format(start))
+            continue
+        keyword = match.group(1).upper()
+        args = match.group(2)
+        flags = []
+        if keyword in FLAG_INSTRUCTIONS:
+            flag = FLAG.match(args)
+            while flag:
+                flags.append((flag.group(1).lower(), flag.group(2) if flag.group(2) is not None else "true"))
+                args = args[flag.end():]
+                flag = FLAG.match(args)
+        if keyword in ['RUN', 'COPY', 'ADD']:
+            for heredoc in HEREDOC.finditer(args):
+                body = []
+                while number < len(lines):
+                    line = lines[number]
+                    number += 1
+                    if (line.lstrip('\t') if heredoc.group(1) else line) == heredoc.group(3):
+                        break
+                    body.append(line)
+                args += "\n" + "\n".join(body)
+        instructions.append(Instruction(keyword, tuple(flags), args.strip(), start))
+    return instructions
+
+
+class Dockerfile:
+    """
+    A parsed Dockerfile, shared between callers through the cache and so not to be modified
+    """
+
+    def __init__(self, content, build_args=None):
+        """
+        :param content: str: the Dockerfile content
+        :param build_args: {str: str}: optional values overriding the ARG defaults, as 'docker build --build-arg' does
+        """
+        build_args = build_args or {}
+        self.errors = []
+        self.instructions = tuple(read_instructions(content, self.errors))
+        self.stages = []
+        self.external_images = []
+        global_args = {}
+        stage_args = {}
+        for instruction in self.instructions:
+            if instruction.keyword not in INSTRUCTIONS:
+                self.errors.append("line {}: unknown instruction {}".format(instruction.line, instruction.keyword))
+            elif instruction.keyword == 'ARG':
+                for name, default in parse_arg(instruction.args):
+                    if not self.stages:
+                        global_args[name] = build_args.get(name, default)
+                    else:
+                        stage_args[name] = build_args.get(name, default if default is not None else global_args.get(name))
+            elif instruction.keyword == 'FROM':
+                self.add_stage(instruction, global_args)
+                stage_args = dict(global_args)
+            elif not self.stages:
+                self.errors.append("line {}: {} comes before the first FROM".format(instruction.line, instruction.keyword))
+            else:
+                for source in self.flag_sources(instruction):
+                    self.add_source(instruction, source, stage_args)
+        if not self.stages:
+            self.errors.append("no FROM instruction")
+        self.stages = tuple(self.stages)
+        self.external_images = tuple(self.external_images)
+        self.errors = tuple(self.errors)
+
+    def stage_index(self, name):
+        """
+        Returns the index of an earlier stage from its alias or number, or None if it does not name one
+        :param name: str: the alias or number
+        """
+        if name.isdigit():
+            return int(name) if int(name) < len(self.stages) else None
+        for stage in self.stages:
+            if stage.name == name.lower():
+                return stage.index
+        return None
+
+    def add_external(self, image):
+        if image.lower() != 'scratch' and image not in self.external_images:
+            self.external_images.append(image)
+
+    def add_stage(self, instruction, global_args):
+        words = instruction.args.split()
+        if not words:
+            self.errors.append("line {}: FROM has no image".format(instruction.line))
+            return
+        image, missing = substitute(words[0], global_args)
+        name = words[2].lower() if len(words) >= 3 and words[1].lower() == 'as' else None
+        base_stage = None
+        if missing or not image:
+            self.errors.append("line {}: FROM {} uses build arguments without a value: {}".format(
+                instruction.line, words[0], ", ".join(missing) or words[0]))
+            image = None
+        else:
+            base_stage = self.stage_index(image) if not image.isdigit() else None
+            if base_stage is None:
+                self.add_external(image)
+        self.stages.append(Stage(len(self.stages), name, image, base_stage,
+                                 dict(instruction.flags).get('platform'), instruction.line))
+
+    @staticmethod
+    def flag_sources(instruction):
+        """
+        Returns the stages or images an instruction copies or mounts from
+        :param instruction: Instruction: a COPY or RUN instruction
+        """
+        sources = []
+        for name, value in instruction.flags:
+            if name == 'from' and instruction.keyword == 'COPY':
+                sources.append(value)
+            elif name == 'mount' and instruction.keyword == 'RUN':
+                options = dict(option.partition('=')[::2] for option in value.split(','))
+                if options.get('from'):
+                    sources.append(options['from'])
+        return sources
+
+    def add_source(self, instruction, source, stage_args):
+        source, missing = substitute(source, stage_args)
+        if missing or not source:
+            self.errors.append("line {}: {} --from uses build arguments without a value: {}".format(
+                instruction.line, instruction.keyword, ", ".join(missing) or source))
+        elif source.isdigit():
+            if int(source) >= len(self.stages) - 1:
+                self.errors.append("line {}: {} --from={} does not name an earlier stage".format(
+                    instruction.line, instruction.keyword, source))
+        elif self.stage_index(source) is None:
+            self.add_external(source)
+
+    def base_images(self):
+        """
+        Returns the images the build starts from or copies from, as written with their registry and organization, leaving out
+        scratch and the build's own stages
+        """
+        return list(self.external_images)
+
+    def parents(self):
+        """
+        Returns the images the build depends on in the 'name:version' format of relations.yaml
+        """
+        parents = []
+        for image in self.external_images:
+            if parent_name(image) not in parents:
+                parents.append(parent_name(image))
+        return parents
+
+
+def parse(content, build_args=None):
+    """
+    Parses Dockerfile content, reusing the result for content already parsed in this process
+    :param content: str or bytes: the Dockerfile content
+    :param build_args: {str: str}: optional values overriding the ARG defaults
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    key = (hashlib.sha256(content).hexdigest(), tuple(sorted((build_args or {}).items())))
+    if key not in PARSED:
+        PARSED[key] = Dockerfile(content.decode('utf-8', 'replace'), build_args)
+    return PARSED[key]
+
+
+def load(dockerfile_path, build_args=None):
+    """
+    Parses a Dockerfile, reusing the result for content already parsed in this process
+    :param dockerfile_path: str: path to the Dockerfile
+    :param build_args: {str: str}: optional values overriding the ARG defaults
+    """
+    with open(dockerfile_path, 'rb') as dockerfile:
+        return parse(dockerfile.read(), build_args)
+
+
+def base_images(dockerfile_path):
+    """
+    Returns the images a Dockerfile starts from or copies from, or an empty list if it does not exist
+    :param dockerfile_path: str: path to the Dockerfile
+    """
+    if not os.path.exists(dockerfile_path):
+        return []
+    return load(dockerfile_path).base_images()
+
+
+def parents(dockerfile_path):
+    """
+    Returns the images a Dockerfile depends on in 'name:version' format, or an empty list if it does not exist
+    :param dockerfile_path: str: path to the Dockerfile
+    """
+    if not os.path.exists(dockerfile_path):
+        return []
+    return load(dockerfile_path).parents()
+
+
+def is_image_dockerfile(path):
+    """
+    Checks whether a repository path is the Dockerfile of an image, in '<tool>/<version>/Dockerfile' format
+    :param path: str: path relative to the repository root
+    """
+    return bool(DOCKERFILE_PATH.match(path))
+
+
+def main():
+    """
+    Main method
+    """
+    if len(sys.argv) < 2:
+        print("Usage python3 scripts/dockerfile.py <Dockerfile path>...")
+        sys.exit(1)
+    had_errors = False
+    for dockerfile_path in sys.argv[1:]:
+        parsed = load(dockerfile_path)
+        print("{}: {} stages, parents: {}".format(
+            dockerfile_path, len(parsed.stages), ", ".join(parsed.parents()) or "none"))
+        for error in parsed.errors:
+            print("ERROR: {}: {}".format(dockerfile_path, error), file=sys.stderr)
+            had_errors = True
+    if had_errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
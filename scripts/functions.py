@@ -1,13 +1,33 @@
 #!/usr/bin/env python3
 
 import base64
+import hashlib
 import json
 import os
 import re
 import sys
+import time
+import queue
+import shutil
 import subprocess
 import tempfile
+import threading
+import concurrent.futures
+import affected
+import build_planner
+import docker_api
+import registry_api
+import result_cache
+import timings
+import tracing
+import versions
 
+CONTENT_HASH_LABEL = "org.autodocker.content-hash"
+BUILD_CACHE_MODES = ['none', 'inline', 'local', 'registry']
+BUILD_CACHE_REFS = {'inline': "{owner}/{tool}:latest",
+                    'registry': "{owner}/{tool}:buildcache"}
+BUILD_CACHE_LOCK = threading.Lock()
+DEFAULT_PREFETCH_WORKERS = 4
 
 def get_deploy_branch():
     """
@@ -55,9 +75,11 @@ def fetch_deploy_branch():
                 Error Log:
                 {}""".format(git_config_cmd, git_config_proc.communicate()[1]))
             exit(1)
-        git_fetch_proc = subprocess.Popen(
-            git_fetch_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        if git_fetch_proc.wait() != 0:
+        with tracing.span("git.fetch", branch=deploy_branch) as fetch_span:
+            git_fetch_proc = subprocess.Popen(
+                git_fetch_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            fetch_span.set('exit_code', git_fetch_proc.wait())
+        if git_fetch_proc.returncode != 0:
             print("""ERROR: Unable to run git fetch command:
                 \'{}\'
                 Error Log:
@@ -109,24 +131,26 @@ def changed_paths_in_range(compare_range):
     Takes the two branches to compare, and returns a list of all files changed between the two SHAs.
     :param compare_range: List of the start and end SHA to compare
     """
-    cmd = "git diff --name-only --diff-filter=d {}".format(
-        compare_range).split()
-    paths_run = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    out_files = paths_run.communicate()[0].split("\n")[:-1]
-    if out_files == []:
-        return "No changed paths found."
-    else:
-        return paths_run.communicate()[0].split("\n")[:-1]
+    with tracing.span("git.diff", compare_range=compare_range):
+        cmd = "git diff --name-only --diff-filter=d {}".format(
+            compare_range).split()
+        paths_run = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        out_files = paths_run.communicate()[0].split("\n")[:-1]
+        if out_files == []:
+            return "No changed paths found."
+        else:
+            return paths_run.communicate()[0].split("\n")[:-1]
 
 
-def build_docker_cmd(command, owner, tool, version):
+def build_docker_cmd(command, owner, tool, version, labels=None):
     """
     Given a docker repo owner, image name, and version, produce an appropriate local docker command.
     :param command: The specific Git command to produce
     :param owner: The repo name for the DockerHub that the user is a part of
     :param tool: The Docker image to be built
     :param version: The specific version of the Docker image specified by the 'tools' variable
+    :param labels: Optional dict of labels to add to the image, only used by 'build'
     """
     # Ensure the command is lower-case
     command = command.lower()
@@ -135,8 +159,16 @@ def build_docker_cmd(command, owner, tool, version):
         owner = "{}/{}".format(os.environ.get('DOCKERHUB_URL'), owner)
     # Generate local build command
     if (command == "build"):
-        cmd = "docker build -q -f \"{}/{}/Dockerfile\" -t \"{}/{}:{}\" \"{}/{}/\"".format(
-            tool, version, owner, tool, version, tool, version)
+        label_args = "".join("--label {}={} ".format(key, value)
+                             for key, value in sorted((labels or {}).items()))
+        cache_mode = get_build_cache_mode()
+        if cache_mode == 'none':
+            cmd = "docker build -q {}-f \"{}/{}/Dockerfile\" -t \"{}/{}:{}\" \"{}/{}/\"".format(
+                label_args, tool, version, owner, tool, version, tool, version)
+        else:
+            # BuildKit streams its progress, and imports and exports layer caches so fresh runners can reuse layers
+            cmd = "docker buildx build --progress plain --load {}{}-f \"{}/{}/Dockerfile\" -t \"{}/{}:{}\" \"{}/{}/\"".format(
+                build_cache_args(cache_mode, owner, tool, version), label_args, tool, version, owner, tool, version, tool, version)
         return cmd
     # Generate a command to return the image ID
     elif (command == "images"):
@@ -156,6 +188,288 @@ def build_docker_cmd(command, owner, tool, version):
         exit(1)
 
 
+def get_build_cache_mode():
+    """
+    Returns the build cache mode set in BUILD_CACHE, one of:
+        none: plain 'docker build' without any cache source (the default)
+        inline: BuildKit build embedding cache metadata in the image, reusing the layers of BUILD_CACHE_REF (default '<owner>/<tool>:latest')
+        local: BuildKit build importing and exporting a per tool cache directory under BUILD_CACHE_DIR (default '<AUTODOCKER_CACHE_DIR>/buildx')
+        registry: BuildKit build importing and exporting a per tool cache image at BUILD_CACHE_REF (default '<owner>/<tool>:buildcache')
+    The local and registry modes need a buildx builder using the docker-container driver (e.g. set with BUILDX_BUILDER)
+    """
+    mode = str(os.environ.get('BUILD_CACHE', 'none')).lower()
+    if mode in ['', 'null', 'false']:
+        mode = 'none'
+    if mode not in BUILD_CACHE_MODES:
+        print("Error, BUILD_CACHE \"{}\" not recognized, please verify it is one of the following: {}".format(
+            mode, ", ".join(BUILD_CACHE_MODES)))
+        exit(1)
+    return mode
+
+
+def build_cache_dir(tool):
+    """
+    Returns the local build cache directory for a tool
+    :param tool: The name of the Docker image
+    """
+    return os.path.join(os.environ.get('BUILD_CACHE_DIR') or os.path.join(result_cache.get_cache_dir(), "buildx"), tool)
+
+
+def build_cache_args(cache_mode, owner, tool, version):
+    """
+    Returns the cache import and export options for a BuildKit build, each followed by a space
+    :param cache_mode: The build cache mode, as returned by get_build_cache_mode
+    :param owner: The repo name for the DockerHub that the user is a part of, including any DOCKERHUB_URL
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    """
+    if cache_mode == 'local':
+        # Export to a new directory that replaces the old one after the build, as exporting in place never drops old layers
+        cache_dir = build_cache_dir(tool)
+        return "--cache-from type=local,src={} --cache-to type=local,dest={}-{}.new,mode=max ".format(cache_dir, cache_dir, version)
+    cache_ref = (os.environ.get('BUILD_CACHE_REF') or BUILD_CACHE_REFS[cache_mode]).format(
+        owner=owner, tool=tool)
+    if cache_mode == 'inline':
+        return "--cache-from type=registry,ref={} --cache-to type=inline ".format(cache_ref)
+    return "--cache-from type=registry,ref={} --cache-to type=registry,ref={},mode=max ".format(cache_ref, cache_ref)
+
+
+def rotate_build_cache(tool, version):
+    """
+    Replaces a tool's local build cache with the cache exported by a successful build, when using the local build cache mode
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image that was built
+    """
+    if get_build_cache_mode() != 'local':
+        return
+    cache_dir = build_cache_dir(tool)
+    new_cache_dir = "{}-{}.new".format(cache_dir, version)
+    with BUILD_CACHE_LOCK:
+        if os.path.isdir(new_cache_dir):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.rename(new_cache_dir, cache_dir)
+
+
+def image_reference(owner, tool, version):
+    """
+    Returns the full name of an image, including DOCKERHUB_URL when it is set
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    """
+    return build_docker_cmd("images", owner, tool, version).split()[2]
+
+
+def build_context_hash(tool, version):
+    """
+    Returns a sha256 hash over every file in an image's build context, including the Dockerfile, so that identical
+    contexts always give the same hash
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image, the context being '<tool>/<version>/'
+    """
+    digest = hashlib.sha256()
+    context = os.path.join(tool, version)
+    for root, dirs, files in os.walk(context):
+        dirs.sort()
+        for filename in sorted(files):
+            file_path = os.path.join(root, filename)
+            relative_path = os.path.relpath(
+                file_path, context).replace(os.sep, '/')
+            digest.update("{}\0{}\0".format(relative_path,
+                                             os.path.getsize(file_path)).encode())
+            with open(file_path, 'rb') as infile:
+                for block in iter(lambda: infile.read(65536), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def image_content_hash(image_name):
+    """
+    Returns the content hash label of a local image, or None if the image is missing or has no label
+    :param image_name: Full name of the image
+    """
+    client = docker_api.get_client()
+    if client:
+        image_info = client.inspect_image(image_name)
+        if not image_info:
+            return None
+        # Docker reports 'Labels': null for an image built without any labels
+        return ((image_info.get('Config') or {}).get('Labels') or {}).get(CONTENT_HASH_LABEL)
+    inspect_run = subprocess.run(["docker", "image", "inspect", "-f", "{{{{ index .Config.Labels \"{}\" }}}}".format(CONTENT_HASH_LABEL), image_name],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    label = inspect_run.stdout.strip()
+    if inspect_run.returncode != 0 or label in ['', '<no value>']:
+        return None
+    return label
+
+
+def find_local_image_by_hash(content_hash):
+    """
+    Returns the ID of a local image labelled with a content hash, or None if there is none
+    :param content_hash: The build context hash, as returned by build_context_hash
+    """
+    client = docker_api.get_client()
+    if client:
+        images = client.images(
+            {'label': ["{}={}".format(CONTENT_HASH_LABEL, content_hash)]})
+        return images[0]['Id'] if images else None
+    images_run = subprocess.run(["docker", "images", "-q", "--filter", "label={}={}".format(CONTENT_HASH_LABEL, content_hash)],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if images_run.returncode != 0 or not images_run.stdout.strip():
+        return None
+    return images_run.stdout.split()[0]
+
+
+def remote_content_hash_matches(image_name, content_hash):
+    """
+    Checks the content hash label of an image in the registry without pulling it
+    :param image_name: Full name of the image
+    :param content_hash: The build context hash, as returned by build_context_hash
+    :return: True or False when the registry could be asked, or None when it could not (e.g. buildx is not installed)
+    """
+    inspect_run = subprocess.run(["docker", "buildx", "imagetools", "inspect", image_name, "--format", "{{json .Image.Config.Labels}}"],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if inspect_run.returncode != 0:
+        return None
+    try:
+        labels = json.loads(inspect_run.stdout) or {}
+    except ValueError:
+        return None
+    return labels.get(CONTENT_HASH_LABEL) == content_hash
+
+
+def reuse_existing_image(owner, tool, version, content_hash):
+    """
+    Looks for an image already built from the same build context, first in the local daemon and then in the registry,
+    and tags it as '<owner>/<tool>:<version>' so that it does not need to be rebuilt.  Set FORCE_REBUILD to skip this.
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    :param content_hash: The build context hash, as returned by build_context_hash
+    :return: True if an existing image is now tagged as the requested image
+    """
+    with tracing.span("build.reuse_check", image="{}:{}".format(tool, version)) as reuse_span:
+        reuse_span.set('result', "miss")
+        if str(os.environ.get('FORCE_REBUILD', '')).lower() in ['1', 'true', 'yes']:
+            return False
+        image_name = image_reference(owner, tool, version)
+        image_id = find_local_image_by_hash(content_hash)
+        if image_id:
+            if tag_image(image_id, image_name):
+                print("Found local image {} with the same build context, tagged it as {} instead of rebuilding.".format(
+                    image_id, image_name), file=sys.stderr)
+                reuse_span.set('result', "local")
+                return True
+        if remote_content_hash_matches(image_name, content_hash) == False:
+            return False
+        if not pull_quietly(owner, tool, version):
+            return False
+        if image_content_hash(image_name) == content_hash:
+            print("Pulled {} from the registry, it was built from the same build context so it will not be rebuilt.".format(
+                image_name), file=sys.stderr)
+            reuse_span.set('result', "registry")
+            return True
+        print("Registry image {} was built from a different build context, rebuilding.".format(
+            image_name), file=sys.stderr)
+        return False
+
+
+def tag_image(image, image_name):
+    """
+    Tags an existing image, returning whether it succeeded
+    :param image: Name or ID of the existing image
+    :param image_name: The new full name of the image
+    """
+    client = docker_api.get_client()
+    if client:
+        try:
+            client.tag(image, image_name)
+        except docker_api.DockerError:
+            return False
+        return True
+    return subprocess.run(["docker", "tag", image, image_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode == 0
+
+
+def pull_quietly(owner, tool, version):
+    """
+    Pulls an image without printing its progress, returning whether it succeeded
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    """
+    return pull_reference(image_reference(owner, tool, version))
+
+
+def pull_reference(image_name):
+    """
+    Pulls an image by its full name without printing its progress, returning whether it succeeded
+    :param image_name: The full name of the image (e.g. 'ubuntu:18.04')
+    """
+    client = docker_api.get_client()
+    if client:
+        try:
+            for message in client.pull(image_name, docker_api.registry_auth()):
+                pass
+        except docker_api.DockerError:
+            return False
+        return True
+    pull_run = subprocess.run(["docker", "pull", image_name],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return pull_run.returncode == 0
+
+
+def reference_exists_locally(image_name):
+    """
+    Checks whether an image is present in the local Docker daemon by its full name
+    :param image_name: The full name of the image (e.g. 'ubuntu:18.04')
+    """
+    client = docker_api.get_client()
+    if client:
+        return client.inspect_image(image_name) is not None
+    return subprocess.run(["docker", "image", "inspect", image_name],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode == 0
+
+
+def image_exists_locally(owner, tool, version):
+    """
+    Checks whether an image is present in the local Docker daemon
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    """
+    client = docker_api.get_client()
+    if client:
+        return client.inspect_image(image_reference(owner, tool, version)) is not None
+    image_cmd = build_docker_cmd("images", owner, tool, version).split()
+    image_run = subprocess.Popen(
+        image_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return image_run.communicate()[0] != ''
+
+
+def build_with_api(owner, tool, version, labels=None):
+    """
+    Builds an image through the Docker Engine API when it is available and no BuildKit cache mode is set, printing the
+    output as it arrives. The docker CLI is used instead when its credentials are kept in a credential helper, as the
+    API client cannot pass them on for pulling private parent images
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    :param labels: Optional dict of labels to add to the image
+    :return: (bool, str): whether the API was used, and the error message if the build failed
+    """
+    client = docker_api.get_client()
+    if not client or get_build_cache_mode() != 'none' or docker_api.uses_credential_helpers():
+        return False, None
+    try:
+        for message in client.build("{}/{}/".format(tool, version), image_reference(owner, tool, version), labels=labels,
+                                    quiet=True, registry_config=docker_api.registry_config()):
+            if message.get('stream'):
+                print(message['stream'], end="", flush=True)
+    except docker_api.DockerError as exc:
+        return True, exc.message
+    return True, None
+
+
 def ensure_local_image(owner, tool, version):
     """
     Given a docker repo owner, image name, and version, check if it exists locally and pull if necessary.
@@ -163,59 +477,289 @@ def ensure_local_image(owner, tool, version):
     :param tool: The Docker image to be built
     :param version: The specific version of the Docker image specified by the 'tools' variable
     """
-    image_cmd = build_docker_cmd("images", owner, tool, version).split()
-    image_run = subprocess.Popen(
-        image_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    if image_run.communicate()[0] == '':
-        print("Image {}/{}:{} does not exist locally for tagging, building...".format(owner, tool, version))
-        build_cmd = build_docker_cmd(
-            "build", owner, tool, version).replace('\"', '').split()
-        build_run = subprocess.Popen(
-            build_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        if build_run.wait() != 0:
-            print("""Error: Unable to build image \'{}/{}:{}\'
-                Error Log:
-                {}""".format(owner, tool, version, build_run.communicate()[1]))
+    with tracing.span("ensure_local_image", image="{}:{}".format(tool, version)):
+        if not image_exists_locally(owner, tool, version):
+            print("Image {}/{}:{} does not exist locally for tagging, building...".format(owner, tool, version))
+            content_hash = build_context_hash(tool, version)
+            if reuse_existing_image(owner, tool, version, content_hash):
+                print(
+                    "Image \'{}/{}:{}\' successfully built locally!".format(owner, tool, version), file=sys.stderr)
+                return
+            used_api, build_err = build_with_api(
+                owner, tool, version, {CONTENT_HASH_LABEL: content_hash})
+            if not used_api:
+                build_cmd = build_docker_cmd(
+                    "build", owner, tool, version, {CONTENT_HASH_LABEL: content_hash}).replace('\"', '').split()
+                build_run = subprocess.Popen(
+                    build_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                # Read the output before checking the exit code, BuildKit progress output can fill the pipe
+                build_err = build_run.communicate()[1]
+                if build_run.returncode == 0:
+                    build_err = None
+            if build_err is not None:
+                print("""Error: Unable to build image \'{}/{}:{}\'
+                    Error Log:
+                    {}""".format(owner, tool, version, build_err))
+            else:
+                rotate_build_cache(tool, version)
+                print(
+                    "Image \'{}/{}:{}\' successfully built locally!".format(owner, tool, version), file=sys.stderr)
         else:
             print(
-                "Image \'{}/{}:{}\' successfully built locally!".format(owner, tool, version), file=sys.stderr)
-    else:
-        print(
-            "Image \'{}/{}:{}\' already exists locally!".format(owner, tool, version), file=sys.stderr)
+                "Image \'{}/{}:{}\' already exists locally!".format(owner, tool, version), file=sys.stderr)
+
+
+def prefetch_images(dockerfile_paths, plan=None):
+    """
+    Returns the images named in the FROM lines of the changed Dockerfiles, leaving out the ones built from this change set
+    :param dockerfile_paths: List of '<tool>/<version>/Dockerfile' paths
+    :param plan: Build plan from build_planner.plan_builds, whose images are built rather than pulled
+    """
+    images = []
+    for dockerfile_path in dockerfile_paths:
+        for image in build_planner.dockerfile_base_images(dockerfile_path):
+            if image.split('/')[-1] in (plan or {}) or image in images:
+                continue
+            images.append(image)
+    return images
+
+
+class ParentPrefetch:
+    """
+    Pulls the parent images of the changed Dockerfiles in background threads, so that the pulls overlap the checks
+    run before the build instead of happening inside it
+    """
+
+    def __init__(self, images, max_workers=None):
+        """
+        :param images: Full names of the images to pull
+        :param max_workers: Maximum number of images to pull at once, defaults to PREFETCH_WORKERS or 4
+        """
+        self.images = list(images)
+        self.max_workers = max_workers or int(
+            os.environ.get('PREFETCH_WORKERS') or DEFAULT_PREFETCH_WORKERS)
+        self.pending = queue.Queue()
+        self.threads = []
+        self.durations = {}
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts pulling in daemon threads, which do not hold up the exit of a pipeline that fails before the build
+        """
+        for image in self.images:
+            self.pending.put(image)
+        for number in range(min(self.max_workers, len(self.images))):
+            thread = threading.Thread(target=self.worker, name="prefetch-{}".format(number), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def worker(self):
+        while True:
+            try:
+                image = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            with tracing.span("prefetch.pull", image=image) as pull_span:
+                started = time.perf_counter()
+                if reference_exists_locally(image):
+                    result = "present"
+                elif pull_reference(image):
+                    result = "pulled"
+                else:
+                    result = "failed"
+                    pull_span.status = "error"
+                pull_span.set('result', result)
+            with self.lock:
+                self.durations[image] = time.perf_counter() - started
+                self.results[image] = result
 
+    def join(self):
+        """
+        Waits for every pull to finish and reports how much pulling happened before the wait
+        :return: The number of seconds of pulling that overlapped earlier stages
+        """
+        with tracing.span("prefetch.wait", images=len(self.images)) as wait_span:
+            started = time.perf_counter()
+            for thread in self.threads:
+                thread.join()
+            waited = time.perf_counter() - started
+            pulling = sum(self.durations[image] for image in self.durations if self.results[image] == "pulled")
+            saved = max(0.0, pulling - waited)
+            wait_span.set('saved', round(saved, 3))
+        for image in self.images:
+            if self.results.get(image) == "failed":
+                print("WARNING: Unable to prefetch {}, the build will try to pull it again.".format(image), file=sys.stderr)
+        print("Prefetched {} of {} parent images ({} already present) with {:.1f}s of pulling, waited {:.1f}s before building, saving about {:.1f}s".format(
+            list(self.results.values()).count("pulled"), len(self.images), list(self.results.values()).count("present"),
+            pulling, waited, saved), file=sys.stderr)
+        return saved
 
-def build_image(owner, changed_paths):
+
+def build_single_image(owner, dockerfile_path):
+    """
+    Given a Docker repo owner and the relative path to a single Dockerfile, execute a Docker 'build' command.
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param dockerfile_path: Relative path to the Dockerfile in '<tool>/<version>/Dockerfile' format
+    """
+    tool, version, filename = dockerfile_path.split('/')
+    with tracing.span("build", image="{}:{}".format(tool, version)) as build_span:
+        print("Building {}/{}:{}...".format(owner, tool, version), file=sys.stderr)
+        content_hash = build_context_hash(tool, version)
+        if reuse_existing_image(owner, tool, version, content_hash):
+            print("Successfully built {}/{}:{}...".format(owner,
+                                                          tool, version), file=sys.stderr)
+            build_span.set('result', "reused")
+            return True
+        used_api, build_err = build_with_api(
+            owner, tool, version, {CONTENT_HASH_LABEL: content_hash})
+        if not used_api:
+            build_command = build_docker_cmd(
+                "build", owner, tool, version, {CONTENT_HASH_LABEL: content_hash}).replace('\"', '').split(" ")
+            build_proc = subprocess.Popen(build_command)
+            build_span.set('exit_code', build_proc.wait())
+            if build_proc.returncode == 0:
+                build_err = None
+            else:
+                build_err = str(build_proc.communicate()[1])
+        if build_err is None:
+            rotate_build_cache(tool, version)
+            print("Successfully built {}/{}:{}...".format(owner,
+                                                          tool, version), file=sys.stderr)
+            build_span.set('result', "built")
+            return True
+        else:
+            build_span.set('result', "failed")
+            build_span.status = "error"
+            print("""ERROR: Unable to build image \'{}/{}:{}\'
+            Error Log:
+            {}""".format(owner, tool, version, build_err))
+            return False
+
+
+def build_image(owner, changed_paths, max_workers=None, plan=None):
     """
-    Given a Docker repo owner (e.g. "medforomics") and a list of relative changed_paths to Dockerfiles, execute a Docker 'build' command.
+    Given a Docker repo owner (e.g. "medforomics") and a list of relative changed_paths to Dockerfiles, execute a Docker 'build' command
+    for each changed Dockerfile.  Parents are built before their children, and independent images are built concurrently.
     :param owner: The repo name for the DockerHub that the user is a part of
     :param changed_paths: List of all files that had been changed between two Git SHAs
+    :param max_workers: Maximum number of images to build at once, defaults to BUILD_WORKERS
+    :param plan: Build plan from build_planner.plan_builds, computed from changed_paths if not given
     """
     dockerfile_path = check_dockerfile_count(changed_paths)
     print(dockerfile_path)
+    if dockerfile_path == '0':
+        return None
     print("Building changed Dockerfiles...\n", file=sys.stderr)
-    tool, version, filename = dockerfile_path.split('/')
-    print("Building {}/{}:{}...".format(owner, tool, version), file=sys.stderr)
-    build_command = build_docker_cmd(
-        "build", owner, tool, version).replace('\"', '').split(" ")
-    build_proc = subprocess.Popen(build_command)
-    build_code = build_proc.wait()
-    if build_code == 0:
-        print("Successfully built {}/{}:{}...".format(owner,
-                                                      tool, version), file=sys.stderr)
+    if plan is None:
+        plan = build_planner.plan_builds(
+            get_dockerfile_paths(changed_paths), build_planner.load_relations())
+    # Images with the longest chain of builds behind them start first
+    priority = build_planner.critical_paths(plan, timings.Estimator().plan_estimates(plan, 'build'))
+    results = build_planner.run_plan(
+        plan, lambda path: build_single_image(owner, path), max_workers, priority)
+    timings.save()
+    if len(results) > 1:
+        build_planner.print_results("Build", results)
+    if all(results.values()):
         return True
-    else:
-        print("""ERROR: Unable to build image \'{}/{}:{}\'
-        Error Log:
-        {}""".format(owner, tool, version, build_proc.communicate()[1]))
 
 
-def push_images(owner, changed_paths):
+def push_with_api(owner, tool, version):
     """
-    Given a Docker repo owner and a list of relative path to Dockerfiles, issue a Docker 'push' command for the images built by build_image, as long as it is not prefixed with 'test_'.
+    Pushes an image through the Docker Engine API when it is available and registry credentials are set, printing
+    each layer's status as it changes
     :param owner: The repo name for the DockerHub that the user is a part of
-    :param changed_paths: List of all files that had been changed between two Git SHAs
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    :return: (bool, bool): whether the API was used, and whether the push succeeded
+    """
+    client = docker_api.get_client()
+    auth = docker_api.registry_auth()
+    if not client or not auth:
+        return False, False
+    try:
+        for message in client.push(image_reference(owner, tool, version), auth):
+            if message.get('status') and not message.get('progressDetail'):
+                print("{}{}".format(message['id'] + ": " if message.get('id') else "",
+                                    message['status']), flush=True)
+    except docker_api.DockerError as exc:
+        print(exc.message)
+        return True, False
+    return True, True
+
+
+def local_image_info(image_name):
+    """
+    Returns the details of a local image as shown by 'docker image inspect', or None if it does not exist
+    :param image_name: Full name of the image
+    """
+    client = docker_api.get_client()
+    if client:
+        return client.inspect_image(image_name)
+    inspect_run = subprocess.run(["docker", "image", "inspect", image_name],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if inspect_run.returncode != 0:
+        return None
+    try:
+        return json.loads(inspect_run.stdout)[0]
+    except (ValueError, IndexError):
+        return None
+
+
+def image_tags(tool, version, relations=None):
+    """
+    Returns the tags to push for an image: its version, plus 'latest' when relations.yaml records it as the latest version
+    :param tool: The name of the Docker image
+    :param version: The version of the Docker image
+    :param relations: Loaded relations.yaml data, or None
+    """
+    tags = [version]
+    if relations and str((relations.get('latest') or {}).get(tool)) == str(version):
+        tags.append("latest")
+    return tags
+
+
+def push_tag(owner, tool, tag, image_info=None):
+    """
+    Pushes one tag of an image, unless the registry already has the same image under that tag
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param tool: The name of the Docker image
+    :param tag: The tag to push
+    :param image_info: Details of the local image, as returned by local_image_info, used to compare digests with the registry
+    :return: True if the tag is in the registry
+    """
+    with tracing.span("push", image="{}:{}".format(tool, tag), tag=tag) as push_span:
+        image_name = image_reference(owner, tool, tag)
+        if image_info and registry_api.has_image(image_name, image_info.get('Id'), image_info.get('RepoDigests')):
+            print("{} already has the same digest in the registry, skipping push.".format(
+                image_name), file=sys.stderr)
+            push_span.set('result', "skipped")
+            return True
+        used_api, pushed = push_with_api(owner, tool, tag)
+        if not used_api:
+            push_command = build_docker_cmd("push", owner, tool, tag).replace(
+                '\"', '').split(" ")
+            push_command = subprocess.Popen(push_command)
+            push_span.set('exit_code', push_command.wait())
+            pushed = push_command.returncode == 0
+        push_span.set('result', "pushed" if pushed else "failed")
+        if not pushed:
+            push_span.status = "error"
+        return pushed
+
+
+def push_single_image(owner, dockerfile_path, relations=None):
+    """
+    Given a Docker repo owner and the relative path to a single Dockerfile, issue a Docker 'push' command for the image, as long as
+    it is not prefixed with 'test_'.  The version tag and, when relations.yaml records it as the latest version, the 'latest' tag
+    are pushed concurrently, skipping any tag the registry already has.
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param dockerfile_path: Relative path to the Dockerfile in '<tool>/<version>/Dockerfile' format
+    :param relations: Loaded relations.yaml data, used to find the 'latest' version of the image
     """
-    dockerfile_path = check_dockerfile_count(changed_paths)
     tool, version, filename = dockerfile_path.split('/')
     # Verify that this is not a test image
     if not 'test_' in tool:
@@ -223,20 +767,49 @@ def push_images(owner, changed_paths):
         ensure_local_image(owner, tool, version)
         # Once the image is verified, push the image
         print("Pushing {}/{}:{}...".format(owner, tool, version), file=sys.stderr)
-        push_command = build_docker_cmd("push", owner, tool, version).replace(
-            '\"', '').split(" ")
-        push_command = subprocess.Popen(push_command)
-        push_code = push_command.wait()
-        if push_code == 0:
+        tags = image_tags(tool, version, relations)
+        for tag in tags[1:]:
+            tag_image(image_reference(owner, tool, version),
+                      image_reference(owner, tool, tag))
+        image_info = local_image_info(image_reference(owner, tool, version))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(tags)) as executor:
+            pushed = all(list(executor.map(
+                lambda tag: push_tag(owner, tool, tag, image_info), tags)))
+        if pushed:
             print(
                 "Successfully pushed new branch based on {}/{}:{}".format(owner, tool, version), file=sys.stderr)
+            return True
         else:
             print("""ERROR: Image for {}/{}:{} was unable to be pushed.
                 Please try again after verifying you have access to {}/{}:{} on DockerHub!""".format(
                 owner, tool, version, owner, tool, version))
+            return False
     elif 'test_' in tool:
         print("""Test image found: \'{}/{}:{}\'
             Skipping push of test image""".format(owner, tool, version), file=sys.stderr)
+        return True
+
+
+def push_images(owner, changed_paths, max_workers=None, plan=None):
+    """
+    Given a Docker repo owner and a list of relative path to Dockerfiles, issue a Docker 'push' command for the images built by build_image,
+    as long as it is not prefixed with 'test_'.  Parents are pushed before their children.  Only the images whose Dockerfile
+    was edited are pushed, as the released images rebuilt on top of them are only built and tested, keeping their tags final.
+    :param owner: The repo name for the DockerHub that the user is a part of
+    :param changed_paths: List of all files that had been changed between two Git SHAs
+    :param max_workers: Maximum number of images to push at once, defaults to BUILD_WORKERS
+    :param plan: Build plan from build_planner.plan_builds, computed from changed_paths if not given
+    :return: {image: bool or None}: the push result for each image
+    """
+    relations = build_planner.load_relations()
+    if plan is None:
+        plan = build_planner.plan_builds(
+            affected.changed_dockerfiles(changed_paths), relations)
+    results = build_planner.run_plan(
+        plan, lambda path: push_single_image(owner, path, relations), max_workers)
+    if len(results) > 1:
+        build_planner.print_results("Push", results)
+    return results
 
 
 def print_changed(compare_range):
@@ -267,30 +840,39 @@ def check_org():
     return os.environ.get('DOCKERHUB_ORG')
 
 
+def get_dockerfile_paths(changed_paths):
+    """
+    Takes in the list of changed paths and returns the Dockerfiles of the images they affect: those whose Dockerfile or copied
+    build context files changed, and the images in the repository building on them
+    :param changed_paths: List of the file paths to be checked for a Dockerfile
+    """
+    if changed_paths == "No changed paths found.":
+        return []
+    return affected.resolve(changed_paths, relations=build_planner.load_relations())[0]
+
+
 def check_dockerfile_count(changed_paths):
     """
     Takes in the list of changed paths and finds the total number of found Dockerfiles
     :param changed_paths: List of the file paths to be checked for a Dockerfile
+    :return: str: the Dockerfile paths in build order separated by spaces, or '0' if none were found
     """
     # Check for the number of Dockerfiles present in the changed paths
-    dockerfile_count = 0
-    dockerfile_path = ''
-    for changed_path in changed_paths:
-        if '/dockerfile' in changed_path.lower():
-            dockerfile_count += 1
-            dockerfile_path = changed_path
-    # Fail if there is more than one Dockerfile to be built
-    if dockerfile_count > 1:
-        print("""ERROR: System is currently only setup to handle one Dockerfile changed or added at a time.
-        Currently, you have {} Dockerfile changes posted""".format(dockerfile_count), file=sys.stderr)
-        dockerfile_path = '1'
+    dockerfile_paths = get_dockerfile_paths(changed_paths)
     # Error if no changes have been made to any Dockerfiles
-    elif dockerfile_count == 0:
+    if len(dockerfile_paths) == 0:
         print("No changes to Dockerfiles or latest symlinks detected, nothing to build or push.", file=sys.stderr)
-        dockerfile_path = '0'
+        return '0'
+    elif len(dockerfile_paths) > 1:
+        plan = build_planner.plan_builds(
+            dockerfile_paths, build_planner.load_relations())
+        dockerfile_paths = [plan[image]['path'] for image in plan]
+        print("{} Dockerfiles found, building in order: {}".format(
+            len(dockerfile_paths), ", ".join(dockerfile_paths)), file=sys.stderr)
     else:
-        print("Dockerfile found: {}".format(dockerfile_path), file=sys.stderr)
-    return dockerfile_path
+        print("Dockerfile found: {}".format(
+            dockerfile_paths[0]), file=sys.stderr)
+    return " ".join(dockerfile_paths)
 
 
 def check_test_image(dockerfile_path):
@@ -326,21 +908,219 @@ def pytest_cleanup(dockerfile_path):
 
 
 def docker_login():
-    if str(os.environ.get('DOCKERHUB_URL')).lower() == "none" or str(os.environ.get('DOCKERHUB_URL')).lower() == 'null' or os.environ.get('DOCKERHUB_URL') == None:
-        print("DockerHub repository found, logging in.".format(
-            os.environ.get('DOCKERHUB_URL')), file=sys.stderr)
-        login_command = "docker login -u {} -p {}".format(os.environ.get(
-            'DOCKERHUB_UN'), os.environ.get('DOCKERHUB_PW')).split(" ")
-    else:
-        print("Non-DockerHub repository found, adding URL {} and logging in.".format(
-            os.environ.get('DOCKERHUB_URL')), file=sys.stderr)
-        login_command = "docker login {} -u {} -p {}".format(os.environ.get(
-            'DOCKERHUB_URL'), os.environ.get('DOCKERHUB_UN'), os.environ.get('DOCKERHUB_PW')).split(" ")
-    login_command_run = subprocess.Popen(login_command)
-    login_code = login_command_run.wait()
-    if login_code != 0:
-        print("Error logging in to container reposity specified.")
-        exit(1)
+    with tracing.span("login"):
+        if str(os.environ.get('DOCKERHUB_URL')).lower() == "none" or str(os.environ.get('DOCKERHUB_URL')).lower() == 'null' or os.environ.get('DOCKERHUB_URL') == None:
+            print("DockerHub repository found, logging in.".format(
+                os.environ.get('DOCKERHUB_URL')), file=sys.stderr)
+            login_command = "docker login -u {} -p {}".format(os.environ.get(
+                'DOCKERHUB_UN'), os.environ.get('DOCKERHUB_PW')).split(" ")
+        else:
+            print("Non-DockerHub repository found, adding URL {} and logging in.".format(
+                os.environ.get('DOCKERHUB_URL')), file=sys.stderr)
+            login_command = "docker login {} -u {} -p {}".format(os.environ.get(
+                'DOCKERHUB_URL'), os.environ.get('DOCKERHUB_UN'), os.environ.get('DOCKERHUB_PW')).split(" ")
+        login_command_run = subprocess.Popen(login_command)
+        login_code = login_command_run.wait()
+        if login_code != 0:
+            print("Error logging in to container reposity specified.")
+            exit(1)
+
+
+class PipelineContext:
+    """
+    Values shared between the stages of a pipeline run, each computed at most once
+    """
+
+    def __init__(self, master_relations=None):
+        """
+        :param master_relations: Path to the deploy branch copy of relations.yaml, used by the validate_version stage
+        """
+        self.master_relations = master_relations
+        self.values = {}
+        self.outputs = {}
+
+    def value(self, name, compute):
+        """
+        Returns a shared value, computing it on first use
+        :param name: Name of the value
+        :param compute: Function that computes the value
+        """
+        if name not in self.values:
+            self.values[name] = compute()
+        return self.values[name]
+
+    def compare_range(self):
+        return self.value('compare_range', get_compare_range)
+
+    def changed_paths(self):
+        return self.value('changed_paths', lambda: changed_paths_in_range(self.compare_range()))
+
+    def owner(self):
+        return self.value('owner', check_org)
+
+    def dockerfile_paths(self):
+        return self.value('dockerfile_paths', lambda: [path for path in check_dockerfile_count(self.changed_paths()).split(" ")
+                                                       if path != '0'])
+
+    def changed_dockerfile_paths(self):
+        return self.value('changed_dockerfile_paths', lambda: affected.changed_dockerfiles(self.changed_paths()))
+
+    def changed_image_paths(self):
+        return self.value('changed_image_paths', lambda: affected.changed_images(self.changed_paths()))
+
+    def push_plan(self):
+        return self.value('push_plan', lambda: build_planner.plan_builds(self.changed_dockerfile_paths(), build_planner.load_relations()))
+
+    def retest_paths(self):
+        return self.value('retest_paths', lambda: affected.resolve(self.changed_paths(), relations=build_planner.load_relations())[1])
+
+    def plan(self):
+        return self.value('plan', lambda: build_planner.plan_builds(self.dockerfile_paths(), build_planner.load_relations()))
+
+    def is_test(self):
+        return self.value('is_test', lambda: all([check_test_image(dockerfile_path) for dockerfile_path in self.dockerfile_paths()]))
+
+    def set_output(self, name, value):
+        """
+        Records a stage output and passes it on to GitHub Actions
+        :param name: Name of the output
+        :param value: Value of the output
+        """
+        self.outputs[name] = value
+        if os.environ.get('GITHUB_OUTPUT'):
+            with open(os.environ.get('GITHUB_OUTPUT'), 'a') as output_file:
+                output_file.write("{}={}\n".format(name, value))
+        else:
+            print("::set-output name={}::{}".format(name, value))
+
+
+def pipeline_fetch_deploy_branch(context):
+    try:
+        fetch_deploy_branch()
+    except SystemExit as exc:
+        # fetch_deploy_branch exits cleanly when already on the deploy branch
+        if exc.code not in [0, None]:
+            raise
+    return True
+
+
+def pipeline_check_dockerfile_count(context):
+    dockerfile_paths = context.dockerfile_paths()
+    context.set_output('docker_file', " ".join(dockerfile_paths) or '0')
+    context.set_output('build', str(len(dockerfile_paths) > 0).lower())
+    # Only the edited Dockerfiles are new versions to push and record in relations.yaml
+    context.set_output('changed_docker_file', " ".join(context.changed_dockerfile_paths()))
+    return True
+
+
+def pipeline_validate_version(context):
+    import validate_version
+    if not context.master_relations:
+        print("ERROR: The validate_version stage requires --master-relations <relations.yaml>")
+        return False
+    master_yaml = validate_version.load_yaml(context.master_relations)
+    released = versions.VersionIndex(master_yaml['images'])
+    # Descendants rebuilt on top of a changed image are only built and tested, so only the changed images are validated
+    for dockerfile_path in context.changed_image_paths():
+        tool, version, filename = dockerfile_path.split('/')
+        if dockerfile_path not in context.changed_dockerfile_paths():
+            if released.has(tool, version):
+                print("ERROR: Files copied into {}:{} changed, but this version is already released and locked.\n"
+                      "Please create a new version of the image instead.".format(tool, version), file=sys.stderr)
+                return False
+        elif not validate_version.check_exists(master_yaml, tool, version):
+            return False
+        if not validate_version.check_dockerfile(dockerfile_path):
+            return False
+    return True
+
+
+def pipeline_prefetch_parents(context):
+    images = prefetch_images(context.dockerfile_paths(), context.plan())
+    if images:
+        context.value('prefetch', lambda: ParentPrefetch(images).start())
+    return True
+
+
+def pipeline_analyze_dockerfiles(context):
+    import build_cost
+    return build_cost.check(context.dockerfile_paths(), build_cost.get_gate())
+
+
+def pipeline_build_image(context):
+    if not context.dockerfile_paths():
+        return True
+    if 'prefetch' in context.values:
+        context.values['prefetch'].join()
+    if get_build_cache_mode() == 'registry':
+        # Exporting the build cache pushes to the registry, so log in first
+        pipeline_login(context)
+    return bool(build_image(context.owner(), context.changed_paths(), plan=context.plan()))
+
+
+def pipeline_test_image(context):
+    import ci_image
+    # Images whose unittest.yml alone changed are retested as well as the rebuilt ones
+    if not context.retest_paths():
+        return True
+    return not ci_image.find_and_run_tests(context.owner(), context.retest_paths())
+
+
+def pipeline_check_test(context):
+    context.set_output('is_test', context.is_test())
+    return True
+
+
+def pipeline_login(context):
+    context.value('login', docker_login)
+    return True
+
+
+def pipeline_push_images(context):
+    if not context.changed_dockerfile_paths() or context.is_test():
+        return True
+    results = push_images(context.owner(), context.changed_paths(),
+                          plan=context.push_plan())
+    return all(results.values())
+
+
+PIPELINE_STAGES = {
+    'fetch_deploy_branch': pipeline_fetch_deploy_branch,
+    'check_dockerfile_count': pipeline_check_dockerfile_count,
+    'prefetch_parents': pipeline_prefetch_parents,
+    'validate_version': pipeline_validate_version,
+    'analyze_dockerfiles': pipeline_analyze_dockerfiles,
+    'build_image': pipeline_build_image,
+    'test_image': pipeline_test_image,
+    'check_test': pipeline_check_test,
+    'login': pipeline_login,
+    'push_images': pipeline_push_images
+}
+
+
+def run_pipeline(stages, context=None):
+    """
+    Runs a sequence of stages in this process, sharing the compare range, changed paths, build plan and login between them
+    :param stages: List of stage names from PIPELINE_STAGES
+    :param context: PipelineContext to share, a new one is created if not given
+    :return: True if every stage succeeded
+    """
+    context = context or PipelineContext()
+    for stage in stages:
+        if stage not in PIPELINE_STAGES:
+            print("ERROR: Pipeline stage \'{}\' not recognized, valid stages are: {}".format(
+                stage, ", ".join(PIPELINE_STAGES)))
+            return False
+    for stage in stages:
+        print("Running pipeline stage {}...".format(stage), file=sys.stderr)
+        with tracing.span("stage", stage=stage) as stage_span:
+            succeeded = PIPELINE_STAGES[stage](context)
+            if not succeeded:
+                stage_span.status = "error"
+        if not succeeded:
+            print("ERROR: Pipeline stage {} failed.".format(stage))
+            return False
+    return True
 
 
 def main():
@@ -354,45 +1134,58 @@ def main():
         sys.exit(1)
     else:
         command = sys.argv[1]
-        if command == 'fetch_deploy_branch':
-            fetch_deploy_branch()
-        elif command == 'build_docker_cmd':
-            print(build_docker_cmd(sys.argv[2], sys.argv[3],
-                                   sys.argv[5], sys.argv[4]))
-        elif command == 'ensure_local_image':
-            ensure_local_image(sys.argv[2], sys.argv[3], sys.argv[4])
-        elif command == 'build_image':
-            print(build_image(check_org(), changed_paths_in_range(get_compare_range())))
-        elif command == 'push_images':
-            push_images(check_org(), changed_paths_in_range(
-                get_compare_range()))
-        elif command == 'print_changed':
-            print_changed(get_compare_range())
-        elif command == 'check_org':
-            print(check_org())
-        elif command == 'check_dockerfile_count':
-            print(check_dockerfile_count(
-                changed_paths_in_range(get_compare_range())))
-        elif command == 'check_test':
-            print(check_test_image(sys.argv[2]))
-        elif command == 'login':
-            docker_login()
-        else:
-            print("""ERROR: Command \'{}\' not recognized.  Valid commands and their associated requirements:
-                python scripts/functions.py \'fetch_deploy_branch\' - Runs a \'git fetch\' on the deploy branch ID while also tracking the current branch under development
-                python scripts/functions.py \'build_docker_cmd\',\'Docker command (ie build, pull, push)\', \'Dockerhub repository\', \'Base directory for tool\', \
-                    \'Version subdirectory for tool\' - Returns a valid Docker command that you have specified on the tool requested
-                python scripts/functions.py \'esure_local_image\', \'Dockerhub repository\', \'Base directory for tool\', \'Version subdirectory for tool\' \
-                    - Checks whether a specified Docker image exists locally for the specified tool
-                python scripts/functions.py \'build_image\' - Checks the list provided for a Dockerfile and builds the associated image
-                python scripts/functions.py \'push_images\' - Checks the list provided for a Dockerfile, then pushes the image associated with \
-                    said Dockerfile
-                python scripts/functions.py \'print_changed\' - Returns a printed list of all file paths that are different between the deploy branch and the current branch.
-                python scripts/functions.py \'check_org\' - Returns the currently set Dockerhub repository \
-                python scripts/functions.py \'check_dockerfile_count\' - Returns either the Dockerfile path, or a code if either no Dockerfiles fdound (\'0\') or if more than one Dockerfile is found (\'1\') \
-                python scripts/functions.py \'check_test\' \'Dockerfile path\'- Returns whether or not this image is considered a test image (preceeded by \'test_\'), and will build and test, but then skip the push to Dockerhub.
-                """.format(command))
-            sys.exit(1)
+        with tracing.entry_point("functions", command=command):
+            if command == 'fetch_deploy_branch':
+                fetch_deploy_branch()
+            elif command == 'build_docker_cmd':
+                print(build_docker_cmd(sys.argv[2], sys.argv[3],
+                                       sys.argv[5], sys.argv[4]))
+            elif command == 'ensure_local_image':
+                ensure_local_image(sys.argv[2], sys.argv[3], sys.argv[4])
+            elif command == 'build_image':
+                print(build_image(check_org(), changed_paths_in_range(get_compare_range())))
+            elif command == 'push_images':
+                push_images(check_org(), changed_paths_in_range(
+                    get_compare_range()))
+            elif command == 'print_changed':
+                print_changed(get_compare_range())
+            elif command == 'check_org':
+                print(check_org())
+            elif command == 'check_dockerfile_count':
+                print(check_dockerfile_count(
+                    changed_paths_in_range(get_compare_range())))
+            elif command == 'check_test':
+                print(all([check_test_image(dockerfile_path)
+                           for dockerfile_path in sys.argv[2:]]))
+            elif command == 'login':
+                docker_login()
+            elif command == 'pipeline':
+                stages = sys.argv[2:]
+                master_relations = None
+                if '--master-relations' in stages:
+                    position = stages.index('--master-relations')
+                    master_relations = stages[position + 1]
+                    del stages[position:position + 2]
+                if not run_pipeline(stages, PipelineContext(master_relations)):
+                    sys.exit(1)
+            else:
+                print("""ERROR: Command \'{}\' not recognized.  Valid commands and their associated requirements:
+                    python scripts/functions.py \'fetch_deploy_branch\' - Runs a \'git fetch\' on the deploy branch ID while also tracking the current branch under development
+                    python scripts/functions.py \'build_docker_cmd\',\'Docker command (ie build, pull, push)\', \'Dockerhub repository\', \'Base directory for tool\', \
+                        \'Version subdirectory for tool\' - Returns a valid Docker command that you have specified on the tool requested
+                    python scripts/functions.py \'esure_local_image\', \'Dockerhub repository\', \'Base directory for tool\', \'Version subdirectory for tool\' \
+                        - Checks whether a specified Docker image exists locally for the specified tool
+                    python scripts/functions.py \'build_image\' - Checks the list provided for a Dockerfile and builds the associated image
+                    python scripts/functions.py \'push_images\' - Checks the list provided for a Dockerfile, then pushes the image associated with \
+                        said Dockerfile
+                    python scripts/functions.py \'print_changed\' - Returns a printed list of all file paths that are different between the deploy branch and the current branch.
+                    python scripts/functions.py \'check_org\' - Returns the currently set Dockerhub repository \
+                    python scripts/functions.py \'check_dockerfile_count\' - Returns either the Dockerfile paths in build order, or a code if no Dockerfiles are found (\'0\') \
+                    python scripts/functions.py \'check_test\' \'Dockerfile path(s)\'- Returns whether or not all of these images are considered test images (preceeded by \'test_\'), and will build and test, but then skip the push to Dockerhub.
+                    python scripts/functions.py \'pipeline\' [--master-relations \'relations.yaml path\'] \'stage\'... - Runs the given stages in one process, sharing the changed paths, \
+                        build plan and login between them.  Stages: {}
+                    """.format(command, ", ".join(PIPELINE_STAGES)))
+                sys.exit(1)
 
 
 if __name__ == "__main__":
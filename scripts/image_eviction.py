@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Keeps the local Docker image store under a disk budget while testing many images in a row:
+    1) Records when each pulled image was last used
+    2) Protects any image that is an ancestor of an image still waiting to be tested, using the relations.yaml graph
+    3) Removes the least recently used unprotected images only once the budget has been exceeded
+"""
+
+import re
+import sys
+import subprocess
+import threading
+import docker_api
+import tracing
+from collections import OrderedDict
+
+DEFAULT_DISK_BUDGET = "10GB"
+SIZE_UNITS = {'b': 1, 'kb': 10**3, 'mb': 10**6, 'gb': 10**9, 'tb': 10**12,
+              'kib': 2**10, 'mib': 2**20, 'gib': 2**30, 'tib': 2**40}
+
+
+def parse_size(size):
+    """
+    Converts a size such as '1.5GB' or '512MiB' (as printed by docker) into bytes
+    :param size: str: the size to convert, a bare number is taken as bytes
+    """
+    match = re.match(r"^\s*([0-9.]+)\s*([a-zA-Z]*)\s*$", str(size))
+    if not match or (match.group(2) and match.group(2).lower() not in SIZE_UNITS):
+        print("ERROR: Unable to read size \'{}\', please use a value such as \'10GB\'.".format(
+            size), file=sys.stderr)
+        exit(1)
+    return int(float(match.group(1)) * SIZE_UNITS.get(match.group(2).lower(), 1))
+
+
+def short_name(image_name):
+    """
+    Strips the registry and organization from an image name, leaving 'tool:version' as used in relations.yaml
+    :param image_name: str: full name of the image
+    """
+    return image_name.split('/')[-1]
+
+
+def ancestors(relations, image):
+    """
+    Finds every ancestor of an image in the relations.yaml 'images' graph
+    :param relations: dict: loaded relations.yaml data
+    :param image: str: image in 'tool:version' format
+    """
+    found = set()
+    pending = [image]
+    while pending:
+        tool, _, version = pending.pop().partition(':')
+        entry = ((relations or {}).get('images') or {}).get(tool, {}).get(version)
+        for parent in (entry or {}).get('parents') or []:
+            if isinstance(parent, str) and parent not in found:
+                found.add(parent)
+                pending.append(parent)
+    return found
+
+
+class ImageEvictionManager:
+    """
+    Tracks pulled images and removes the least recently used ones that no upcoming image depends on
+    """
+
+    def __init__(self, budget, relations=None, upcoming=None):
+        """
+        :param budget: int or str: number of bytes (or a size such as '10GB') that images may use on disk
+        :param relations: dict: loaded relations.yaml data used to find shared parents
+        :param upcoming: [str]: full names of the images that still have to be tested, in order
+        """
+        self.budget = budget if isinstance(budget, int) else parse_size(budget)
+        self.relations = relations
+        self.upcoming = list(upcoming or [])
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def protected(self):
+        """
+        Returns the 'tool:version' names that must be kept because an upcoming image is built on them
+        """
+        keep = set()
+        for image_name in self.upcoming:
+            keep.add(short_name(image_name))
+            keep.update(ancestors(self.relations, short_name(image_name)))
+        return keep
+
+    def touch(self, image_name):
+        """
+        Marks an image as the most recently used one
+        :param image_name: str: full name of the image
+        """
+        with self.lock:
+            self.images.pop(image_name, None)
+            self.images[image_name] = True
+
+    def release(self, image_name):
+        """
+        Marks an image as tested, then evicts images if the budget is exceeded
+        :param image_name: str: full name of the image
+        """
+        with self.lock:
+            if image_name in self.upcoming:
+                self.upcoming.remove(image_name)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used unprotected images until the images on disk fit in the budget
+        :return: [str]: the images that were removed
+        """
+        removed = []
+        with self.lock:
+            usage = self.disk_usage()
+            if usage <= self.budget:
+                return removed
+            keep = self.protected()
+            for image_name in list(self.images):
+                if usage <= self.budget:
+                    break
+                if short_name(image_name) in keep:
+                    continue
+                print("Image store at {:.2f}GB is over the {:.2f}GB budget, removing {}.".format(
+                    usage / 10**9, self.budget / 10**9, image_name), file=sys.stderr)
+                self.remove(image_name)
+                del self.images[image_name]
+                removed.append(image_name)
+                usage = self.disk_usage()
+            if usage > self.budget:
+                print("Image store is still over budget, all remaining images are needed by upcoming tests.",
+                      file=sys.stderr)
+        return removed
+
+    def disk_usage(self):
+        """
+        Returns the number of bytes used by images in the local Docker image store
+        """
+        client = docker_api.get_client()
+        if client:
+            return client.disk_usage()
+        df_run = subprocess.run(["docker", "system", "df", "--format", "{{.Type}}\t{{.Size}}"],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        for line in df_run.stdout.splitlines():
+            fields = line.split("\t")
+            if len(fields) == 2 and fields[0] == "Images":
+                return parse_size(fields[1])
+        return 0
+
+    def remove(self, image_name):
+        """
+        Removes an image along with any dangling layers it leaves behind
+        :param image_name: str: full name of the image
+        """
+        with tracing.span("evict", image=image_name):
+            self.remove_image(image_name)
+
+    def remove_image(self, image_name):
+        """
+        Removes an image and prunes dangling layers through the Docker daemon
+        :param image_name: str: full name of the image
+        """
+        client = docker_api.get_client()
+        if client:
+            try:
+                client.remove_image(image_name)
+                client.prune_images()
+            except docker_api.DockerError as exc:
+                print("Unable to remove {}: {}".format(
+                    image_name, exc.message), file=sys.stderr)
+            return
+        subprocess.run(["docker", "image", "rm", image_name],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        subprocess.run(["docker", "image", "prune", "-f"],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
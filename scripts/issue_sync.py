@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Opens GitHub issues for images that need updating, without re-reading the issue list for every image:
+    1) The open issue titles are fetched once per run, using conditional requests against ETags kept from earlier runs
+    2) New issues are queued and created together at the end of the run, skipping any title that is already open
+    3) Requests wait and retry when GitHub reports that the rate limit has been reached
+The backend is pluggable, GithubRestBackend talks to the GitHub REST API and InMemoryBackend stands in for it in tests.
+"""
+
+import os
+import sys
+import json
+import time
+import http.client
+import urllib.parse
+import result_cache
+
+DEFAULT_API_URL = "https://api.github.com"
+ETAG_FILENAME = "github-etags.json"
+MAX_RETRIES = 5
+MAX_RATE_LIMIT_WAIT = 900
+
+
+class GithubRestBackend:
+    """
+    Minimal GitHub REST API client for listing and creating issues over one keep-alive connection
+    """
+
+    def __init__(self, token, repo, api_url=None, etag_path=None):
+        """
+        :param token: str: GitHub token used to authenticate
+        :param repo: str: repository in 'owner/name' format
+        :param api_url: str: base URL of the API, defaults to GITHUB_API_URL or api.github.com
+        :param etag_path: str: file to keep ETags and cached responses in between runs, or None to keep them in memory only
+        """
+        self.token = token
+        self.repo = repo
+        url = urllib.parse.urlparse(
+            api_url or os.environ.get('GITHUB_API_URL') or DEFAULT_API_URL)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.base_path = url.path.rstrip('/')
+        self.connection = None
+        self.etag_path = etag_path
+        self.etags = {}
+        if etag_path and os.path.exists(etag_path):
+            try:
+                with open(etag_path) as etag_file:
+                    self.etags = json.load(etag_file)
+            except ValueError:
+                self.etags = {}
+
+    def connect(self):
+        """
+        Returns the keep-alive connection to the API, opening it if needed
+        """
+        if self.connection is None:
+            if self.scheme == 'http':
+                self.connection = http.client.HTTPConnection(
+                    self.netloc, timeout=60)
+            else:
+                self.connection = http.client.HTTPSConnection(
+                    self.netloc, timeout=60)
+        return self.connection
+
+    def request(self, method, path, body=None):
+        """
+        Sends a request, using a cached ETag for GET requests and waiting out any rate limit
+        :param method: str: HTTP method
+        :param path: str: path below the API base URL, including any query string
+        :param body: dict: optional JSON body
+        :return: (int, object): the status code and decoded JSON response
+        """
+        headers = {'Accept': 'application/vnd.github.v3+json',
+                   'User-Agent': 'auto-docker'}
+        if self.token:
+            headers['Authorization'] = "token {}".format(self.token)
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if method == 'GET' and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]['etag']
+        for attempt in range(MAX_RETRIES):
+            try:
+                self.connect().request(
+                    method, self.base_path + path, body=body, headers=headers)
+                response = self.connect().getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                self.connection = None
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                continue
+            if response.status == 304:
+                return 200, self.etags[path]['data']
+            wait = rate_limit_wait(response)
+            if wait is not None and attempt < MAX_RETRIES - 1:
+                print("GitHub rate limit reached, waiting {} seconds.".format(
+                    wait), file=sys.stderr)
+                time.sleep(wait)
+                continue
+            decoded = json.loads(data.decode('utf-8')) if data else None
+            if method == 'GET' and response.status == 200 and response.getheader('ETag'):
+                self.etags[path] = {
+                    'etag': response.getheader('ETag'), 'data': decoded}
+            return response.status, decoded
+        return response.status, None
+
+    def list_open_issue_titles(self):
+        """
+        Returns the titles of every open issue in the repository
+        """
+        titles = []
+        page = 1
+        while True:
+            status, issues = self.request(
+                'GET', "/repos/{}/issues?state=open&per_page=100&page={}".format(self.repo, page))
+            if status != 200:
+                print("ERROR: Unable to list open issues for {}, status {}.".format(
+                    self.repo, status), file=sys.stderr)
+                exit(1)
+            titles.extend(issue['title'] for issue in issues)
+            if len(issues) < 100:
+                break
+            page += 1
+        self.save_etags()
+        return titles
+
+    def create_issue(self, title, body):
+        """
+        Opens a new issue
+        :param title: str: title of the issue
+        :param body: str: body of the issue
+        :return: bool: true if the issue was created
+        """
+        status, _ = self.request(
+            'POST', "/repos/{}/issues".format(self.repo), {'title': title, 'body': body})
+        return status == 201
+
+    def save_etags(self):
+        """
+        Writes the ETag cache to disk, if a path was given
+        """
+        if not self.etag_path:
+            return
+        os.makedirs(os.path.dirname(self.etag_path) or '.', exist_ok=True)
+        with open(self.etag_path, 'w') as etag_file:
+            json.dump(self.etags, etag_file)
+
+
+def rate_limit_wait(response):
+    """
+    Returns how many seconds to wait before retrying a rate limited response, or None if it was not rate limited
+    :param response: http.client.HTTPResponse: the response to check
+    """
+    if response.status not in [403, 429]:
+        return None
+    if response.getheader('Retry-After'):
+        return min(int(response.getheader('Retry-After')), MAX_RATE_LIMIT_WAIT)
+    if response.getheader('X-RateLimit-Remaining') == '0' and response.getheader('X-RateLimit-Reset'):
+        return min(max(int(response.getheader('X-RateLimit-Reset')) - int(time.time()), 1), MAX_RATE_LIMIT_WAIT)
+    return None
+
+
+class InMemoryBackend:
+    """
+    In-process stand-in for GithubRestBackend
+    """
+
+    def __init__(self, titles=None):
+        """
+        :param titles: [str]: titles of the issues that are already open
+        """
+        self.titles = list(titles or [])
+        self.created = []
+        self.list_calls = 0
+
+    def list_open_issue_titles(self):
+        self.list_calls += 1
+        return list(self.titles)
+
+    def create_issue(self, title, body):
+        self.titles.append(title)
+        self.created.append((title, body))
+        return True
+
+
+def default_backend():
+    """
+    Returns a GithubRestBackend for GITHUB_REPOSITORY authenticated with GITHUB_TOKEN
+    """
+    return GithubRestBackend(os.environ.get('GITHUB_TOKEN'), os.environ.get('GITHUB_REPOSITORY'),
+                             etag_path=os.path.join(result_cache.get_cache_dir(), ETAG_FILENAME))
+
+
+class IssueSync:
+    """
+    Queues issues to open and creates the ones that are not already open
+    """
+
+    def __init__(self, backend=None):
+        """
+        :param backend: the backend to use, defaults to default_backend()
+        """
+        self.backend = backend or default_backend()
+        self.titles = None
+        self.queued = []
+
+    def open_titles(self):
+        """
+        Returns the set of open issue titles, fetching it on first use
+        """
+        if self.titles is None:
+            self.titles = set(self.backend.list_open_issue_titles())
+        return self.titles
+
+    def is_open(self, title):
+        """
+        Checks whether an issue with this title is open or already queued
+        :param title: str: title of the issue
+        """
+        return title in self.open_titles() or title in [queued[0] for queued in self.queued]
+
+    def queue(self, title, body):
+        """
+        Queues an issue to be opened by flush, unless one with the same title is already open
+        :param title: str: title of the issue
+        :param body: str: body of the issue
+        :return: bool: true if the issue was queued
+        """
+        if self.is_open(title):
+            return False
+        self.queued.append((title, body))
+        return True
+
+    def flush(self):
+        """
+        Opens every queued issue
+        :return: int: number of issues created
+        """
+        created = 0
+        for title, body in self.queued:
+            if self.backend.create_issue(title, body):
+                self.open_titles().add(title)
+                created += 1
+            else:
+                print("ERROR: Unable to open issue \'{}\'.".format(
+                    title), file=sys.stderr)
+        self.queued = []
+        return created
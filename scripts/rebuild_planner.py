@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Plans the rebuilds needed downstream of a new parent image version:
+    1) Finds every descendant of the previous parent version in the relations.yaml graph, skipping terminated images and their descendants
+    2) Proposes a bumped version for each descendant matching the type of the parent update
+    3) Groups the rebuilds into waves, where every image in a wave only depends on images in earlier waves and can be built in parallel
+With --apply, each planned image is scaffolded as a new '<tool>/<version>/' directory with its FROM lines pointing at the new parents,
+so that a single pipeline run builds the whole set in dependency order.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import relations_graph
+import relations_io
+import versions
+
+
+def bump_version(version, update_type):
+    """
+    Increments a 'major.minor.patch' version number to match the type of update made to a parent image
+    :param version: str: the version number to increment
+    :param update_type: str: 'major', 'minor' or 'patch'
+    """
+    major, minor, patch = [int(part) for part in version.split(sep=".")[:3]]
+    if update_type == 'major':
+        major += 1
+        minor = 0
+        patch = 0
+    elif update_type == 'minor':
+        minor += 1
+        patch = 0
+    else:
+        patch += 1
+    return "{}.{}.{}".format(major, minor, patch)
+
+
+def infer_update_type(prev_version, new_version):
+    """
+    Returns the type of update between two versions, exiting if the new version is not higher than the previous one
+    :param prev_version: str: the previous version
+    :param new_version: str: the new version
+    """
+    if versions.version_parts(new_version) <= versions.version_parts(prev_version):
+        print("ERROR: New version {} is not higher than the previous version {}, there is nothing to rebuild.".format(
+            new_version, prev_version), file=sys.stderr)
+        exit(1)
+    return versions.update_type(prev_version, new_version)
+
+
+def plan_rebuilds(graph, image_name, prev_version, new_version, update_type):
+    """
+    Plans the rebuilds of every descendant of a parent image version
+    :param graph: RelationsGraph: the relations graph
+    :param image_name: str: name of the updated parent image
+    :param prev_version: str: version of the parent that the descendants are currently built on
+    :param new_version: str: new version of the parent
+    :param update_type: str: 'major', 'minor' or 'patch', as returned by get_update_type
+    :return: [[{'image', 'version', 'new_version', 'parents'}]]: the rebuilds, grouped into waves
+    """
+    root = (image_name, str(prev_version))
+    renamed = {root: (image_name, str(new_version))}
+    order = []
+    pending = sorted(graph.children.get(root, ()))
+    while pending:
+        node = pending.pop(0)
+        if node in renamed:
+            continue
+        if graph.is_terminated(node[0]):
+            print("Skipping terminated image {} and its descendants.".format(
+                relations_graph.join_image(node)), file=sys.stderr)
+            continue
+        try:
+            renamed[node] = (node[0], bump_version(node[1], update_type))
+        except ValueError:
+            print("Skipping {}, its version does not match the pattern '0.0.0'.".format(
+                relations_graph.join_image(node)), file=sys.stderr)
+            continue
+        order.append(node)
+        pending.extend(sorted(graph.children.get(node, ())))
+    levels = {root: 0}
+    waves = []
+    for node in topological_nodes(graph, order, root):
+        level = 1 + max(levels[parent]
+                        for parent in graph.parents[node] if parent in levels)
+        levels[node] = level
+        while len(waves) < level:
+            waves.append([])
+        waves[level - 1].append({
+            'image': node[0],
+            'version': node[1],
+            'new_version': renamed[node][1],
+            'parents': sorted(relations_graph.join_image(renamed.get(parent, parent)) for parent in graph.parents[node])
+        })
+    return waves
+
+
+def topological_nodes(graph, nodes, root):
+    """
+    Orders planned nodes so that every node comes after any of its planned parents
+    :param graph: RelationsGraph: the relations graph
+    :param nodes: [(str, str)]: the planned nodes
+    :param root: (str, str): the updated parent image
+    """
+    planned = set(nodes)
+    placed = set([root])
+    ordered = []
+    while len(ordered) < len(nodes):
+        ready = [node for node in nodes if node not in placed and
+                 all(parent in placed or parent not in planned for parent in graph.parents[node])]
+        if not ready:
+            print("ERROR: Circular parent relationship found between images: {}".format(
+                ", ".join(relations_graph.join_image(node) for node in nodes if node not in placed)), file=sys.stderr)
+            exit(1)
+        for node in sorted(ready):
+            placed.add(node)
+            ordered.append(node)
+    return ordered
+
+
+def print_plan(waves):
+    """
+    Prints a rebuild plan, one wave at a time
+    :param waves: [[dict]]: the plan as returned by plan_rebuilds
+    """
+    if not waves:
+        print("No downstream images require rebuilding.")
+        return
+    for number, wave in enumerate(waves, start=1):
+        print("Wave {} ({} images, built in parallel):".format(number, len(wave)))
+        for rebuild in wave:
+            print("    {}:{} -> {}:{} (parents: {})".format(rebuild['image'], rebuild['version'], rebuild['image'],
+                                                         rebuild['new_version'], ", ".join(rebuild['parents'])))
+
+
+def scaffold_rebuild(rebuild, parent_versions):
+    """
+    Copies an image's directory to its new version and points its FROM lines at the new parent versions
+    :param rebuild: dict: one entry of the plan
+    :param parent_versions: {str: str}: old 'name:version' parents mapped to their new 'name:version'
+    :return: str: path to the new Dockerfile, or None if it could not be created
+    """
+    source = os.path.join(rebuild['image'], rebuild['version'])
+    target = os.path.join(rebuild['image'], rebuild['new_version'])
+    if not os.path.isdir(source):
+        print("Unable to scaffold {}, directory {} does not exist.".format(
+            target, source), file=sys.stderr)
+        return None
+    if os.path.exists(target):
+        print("{} already exists, leaving it in place.".format(
+            target), file=sys.stderr)
+        return os.path.join(target, "Dockerfile")
+    shutil.copytree(source, target)
+    dockerfile_path = os.path.join(target, "Dockerfile")
+    with open(dockerfile_path) as dockerfile:
+        lines = dockerfile.readlines()
+    with open(dockerfile_path, "w") as dockerfile:
+        for line in lines:
+            if line.strip().upper().startswith('FROM '):
+                for old_parent, new_parent in parent_versions.items():
+                    line = re.sub(r"(?<=[\s/]){}(?=\s|$)".format(
+                        re.escape(old_parent)), new_parent, line)
+            dockerfile.write(line)
+    return dockerfile_path
+
+
+def apply_plan(waves, image_name, prev_version, new_version):
+    """
+    Scaffolds every rebuild in a plan
+    :param waves: [[dict]]: the plan as returned by plan_rebuilds
+    :param image_name: str: name of the updated parent image
+    :param prev_version: str: previous version of the parent
+    :param new_version: str: new version of the parent
+    :return: [str]: paths to the new Dockerfiles, in build order
+    """
+    parent_versions = {"{}:{}".format(image_name, prev_version): "{}:{}".format(
+        image_name, new_version)}
+    dockerfile_paths = []
+    for wave in waves:
+        for rebuild in wave:
+            parent_versions["{}:{}".format(rebuild['image'], rebuild['version'])] = "{}:{}".format(
+                rebuild['image'], rebuild['new_version'])
+    for wave in waves:
+        for rebuild in wave:
+            dockerfile_path = scaffold_rebuild(rebuild, parent_versions)
+            if dockerfile_path:
+                dockerfile_paths.append(dockerfile_path)
+    return dockerfile_paths
+
+
+def main():
+    """
+    Main method
+    """
+    parser = argparse.ArgumentParser(
+        description="Plans the rebuilds of every image downstream of a new parent image version")
+    parser.add_argument("relations", help="Path to relations.yaml")
+    parser.add_argument(
+        "image", help="The new parent image in 'image_name:image_version' format")
+    parser.add_argument("--previous", help="Previous version of the parent, defaults to the highest lower version in relations.yaml")
+    parser.add_argument("--update-type", choices=['major', 'minor', 'patch'],
+                        help="Type of update, inferred from the versions if not given")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the plan as JSON")
+    parser.add_argument("--apply", action="store_true",
+                        help="Scaffold the new image directories instead of only printing the plan")
+    args = parser.parse_args()
+    graph = relations_graph.RelationsGraph(
+        relations_io.load_yaml(args.relations))
+    image_name, new_version = relations_graph.split_image(args.image)
+    prev_version = args.previous or graph.version_index.predecessor(
+        image_name, new_version)
+    if prev_version is None:
+        print("No previous version of {} found, nothing to rebuild.".format(
+            image_name))
+        return
+    update_type = args.update_type or infer_update_type(
+        prev_version, new_version)
+    waves = plan_rebuilds(graph, image_name, prev_version,
+                          new_version, update_type)
+    if args.json:
+        print(json.dumps(waves, indent=2))
+    else:
+        print_plan(waves)
+    if args.apply:
+        for dockerfile_path in apply_plan(waves, image_name, prev_version, new_version):
+            print("Created {}".format(dockerfile_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Minimal Docker registry (distribution v2) client used to check what a registry already holds without pulling:
+    1) Manifest digests are read with HEAD requests, full manifests with GET, over pooled keep-alive HTTPS connections
+    2) Bearer token challenges are answered with the credentials from docker_api.registry_credentials, caching a token per scope
+"""
+
+import re
+import sys
+import json
+import queue
+import base64
+import threading
+import http.client
+import urllib.parse
+import docker_api
+
+DOCKER_HUB = "registry-1.docker.io"
+DOCKER_HUB_ALIASES = ["docker.io", "index.docker.io", DOCKER_HUB]
+MANIFEST_TYPES = ", ".join(["application/vnd.docker.distribution.manifest.v2+json",
+                            "application/vnd.docker.distribution.manifest.list.v2+json",
+                            "application/vnd.oci.image.manifest.v1+json",
+                            "application/vnd.oci.image.index.v1+json"])
+POOL_SIZE = 4
+TIMEOUT = 30
+CHALLENGE_PARAMS = re.compile(r'(\w+)="([^"]*)"')
+
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+
+
+class RegistryError(Exception):
+    """
+    Error returned by a registry
+    """
+
+    def __init__(self, status, message):
+        """
+        :param status: int: HTTP status of the response
+        :param message: str: the error message
+        """
+        super().__init__(message)
+        self.status = status
+
+
+def parse_reference(image_name):
+    """
+    Splits an image name into its registry, repository and tag, following the docker CLI's rules
+    :param image_name: str: image in '[registry[:port]/]repository[:tag]' format
+    :return: (str, str, str): the registry host, repository path and tag
+    """
+    repository, tag = docker_api.split_tag(image_name)
+    first, _, rest = repository.partition('/')
+    if rest and ('.' in first or ':' in first or first == "localhost"):
+        registry = first
+        repository = rest
+    else:
+        registry = DOCKER_HUB
+    if registry in DOCKER_HUB_ALIASES:
+        registry = DOCKER_HUB
+        if '/' not in repository:
+            repository = "library/" + repository
+    return registry, repository, tag
+
+
+def get_client(registry):
+    """
+    Returns a shared client for a registry
+    :param registry: str: registry host, as returned by parse_reference
+    """
+    with CLIENTS_LOCK:
+        if registry not in CLIENTS:
+            credentials = docker_api.registry_credentials(
+                None if registry == DOCKER_HUB else registry)
+            CLIENTS[registry] = RegistryClient(registry, credentials)
+        return CLIENTS[registry]
+
+
+def open_connection(url_parts):
+    """
+    Opens an HTTP connection for a parsed URL, using plain HTTP for local registries
+    :param url_parts: urllib.parse.SplitResult: the parsed URL
+    """
+    if url_parts.scheme == "http":
+        return http.client.HTTPConnection(url_parts.netloc, timeout=TIMEOUT)
+    return http.client.HTTPSConnection(url_parts.netloc, timeout=TIMEOUT)
+
+
+class RegistryClient:
+    """
+    Thread safe client for a single registry
+    """
+
+    def __init__(self, registry, credentials=None):
+        """
+        :param registry: str: registry host, with an optional port
+        :param credentials: {'username', 'password'}: optional registry credentials
+        """
+        self.registry = registry
+        self.credentials = credentials
+        local = registry.split(':')[0] in ["localhost", "127.0.0.1"]
+        self.base_url = urllib.parse.urlsplit(
+            "{}://{}".format("http" if local else "https", registry))
+        self.pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        self.tokens = {}
+
+    def basic_auth(self):
+        if not self.credentials:
+            return None
+        return "Basic " + base64.b64encode("{}:{}".format(
+            self.credentials['username'], self.credentials['password']).encode()).decode()
+
+    def send(self, method, path, headers):
+        """
+        Sends one request over a pooled connection and returns (status, headers, body)
+        """
+        try:
+            conn = self.pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = open_connection(self.base_url)
+            reused = False
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            conn.close()
+            # The registry closed an idle pooled connection, retry on a new one
+            if not reused:
+                raise
+            return self.send(method, path, headers)
+        if response.will_close:
+            conn.close()
+        else:
+            try:
+                self.pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        return response.status, response.headers, body
+
+    def authorize(self, challenge, scope):
+        """
+        Answers a WWW-Authenticate challenge, returning the Authorization header value to retry with
+        :param challenge: str: the WWW-Authenticate header
+        :param scope: str: the repository scope requested (e.g. 'repository:org/image:pull')
+        """
+        if challenge.lower().startswith("basic"):
+            return self.basic_auth()
+        params = dict(CHALLENGE_PARAMS.findall(challenge))
+        if 'realm' not in params:
+            return None
+        query = {'service': params.get('service'),
+                 'scope': params.get('scope', scope)}
+        realm = urllib.parse.urlsplit(params['realm'])
+        conn = open_connection(realm)
+        headers = {}
+        if self.basic_auth():
+            headers['Authorization'] = self.basic_auth()
+        try:
+            conn.request("GET", "{}?{}".format(realm.path or "/", urllib.parse.urlencode(
+                {key: value for key, value in query.items() if value})), headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RegistryError(response.status, "Unable to get a registry token from {}".format(
+                params['realm']))
+        token = json.loads(body.decode())
+        return "Bearer " + (token.get('token') or token.get('access_token'))
+
+    def request(self, method, repository, reference, headers=None):
+        """
+        Requests a manifest, authenticating when the registry asks to
+        :param method: str: 'HEAD' or 'GET'
+        :param repository: str: repository path
+        :param reference: str: tag or digest
+        :param headers: dict: optional extra headers
+        :return: (int, HTTPMessage, bytes): the status, headers and body of the response
+        """
+        scope = "repository:{}:pull".format(repository)
+        path = "/v2/{}/manifests/{}".format(repository, reference)
+        headers = dict(headers or {}, Accept=MANIFEST_TYPES)
+        if scope in self.tokens:
+            headers['Authorization'] = self.tokens[scope]
+        status, response_headers, body = self.send(method, path, headers)
+        if status == 401 and response_headers.get('WWW-Authenticate'):
+            authorization = self.authorize(
+                response_headers['WWW-Authenticate'], scope)
+            if authorization:
+                self.tokens[scope] = authorization
+                headers['Authorization'] = authorization
+                status, response_headers, body = self.send(
+                    method, path, headers)
+        if status >= 400 and status != 404:
+            raise RegistryError(status, "Registry {} returned {} for {}:{}".format(
+                self.registry, status, repository, reference))
+        return status, response_headers, body
+
+    def manifest_digest(self, repository, tag):
+        """
+        Returns the digest of a tag's manifest, or None if the tag does not exist
+        :param repository: str: repository path
+        :param tag: str: the tag
+        """
+        status, headers, body = self.request("HEAD", repository, tag)
+        if status == 404:
+            return None
+        return headers.get('Docker-Content-Digest')
+
+    def manifest(self, repository, tag):
+        """
+        Returns a tag's manifest, or None if the tag does not exist
+        :param repository: str: repository path
+        :param tag: str: the tag
+        """
+        status, headers, body = self.request("GET", repository, tag)
+        if status == 404:
+            return None
+        return json.loads(body.decode())
+
+
+def has_image(image_name, image_id, repo_digests=None):
+    """
+    Checks whether a registry tag already points at a local image, without pulling it.  The manifest digest from a HEAD
+    request is compared with the image's repo digests first, and the manifest's config digest with the image ID otherwise.
+    :param image_name: str: image in '[registry[:port]/]repository[:tag]' format
+    :param image_id: str: ID of the local image
+    :param repo_digests: [str]: the local image's 'repository@digest' entries
+    :return: bool: true if the tag points at the same image, false if it does not or the registry could not be checked
+    """
+    registry, repository, tag = parse_reference(image_name)
+    client = get_client(registry)
+    try:
+        digest = client.manifest_digest(repository, tag)
+        if digest is None:
+            return False
+        if any(repo_digest.split('@')[-1] == digest for repo_digest in repo_digests or []):
+            return True
+        manifest = client.manifest(repository, tag) or {}
+    except (OSError, http.client.HTTPException, ValueError, RegistryError) as exc:
+        print("Unable to check {} in its registry: {}".format(
+            image_name, exc), file=sys.stderr)
+        return False
+    return (manifest.get('config') or {}).get('digest') == image_id
+
+
+def image_size(image_name):
+    """
+    Returns the compressed size of an image's layers from its registry manifest, without pulling it.  For a multi-platform
+    image the linux/amd64 manifest is used.
+    :param image_name: str: image in '[registry[:port]/]repository[:tag]' format
+    :return: int: the size in bytes, or None if the tag does not exist or the registry could not be checked
+    """
+    registry, repository, tag = parse_reference(image_name)
+    client = get_client(registry)
+    try:
+        manifest = client.manifest(repository, tag) or {}
+        for entry in manifest.get('manifests') or []:
+            platform = entry.get('platform') or {}
+            if platform.get('os') == "linux" and platform.get('architecture') == "amd64":
+                manifest = client.manifest(repository, entry['digest']) or {}
+                break
+    except (OSError, http.client.HTTPException, ValueError, RegistryError) as exc:
+        print("Unable to check {} in its registry: {}".format(
+            image_name, exc), file=sys.stderr)
+        return None
+    if not manifest.get('layers'):
+        return None
+    return sum(layer.get('size', 0) for layer in manifest['layers'])
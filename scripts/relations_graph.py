@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+In-memory index of the 'images' graph in relations.yaml:
+    1) Every image version is a node keyed by (name, version)
+    2) Forward (children) and reverse (parents) adjacency sets give constant time lookups in both directions
+    3) Only nodes changed through the graph are re-normalized when it is written back, so untouched entries round trip unchanged
+"""
+
+import relations_io
+import versions
+
+NULL_ENTRIES = [None, 'null', 'none', '']
+
+
+def split_image(image):
+    """
+    Splits an image string into a (name, version) node key
+    :param image: str: image in 'name:version' format
+    """
+    name, _, version = str(image).partition(':')
+    return (name, version)
+
+
+def join_image(node):
+    """
+    Joins a (name, version) node key back into an image string
+    :param node: (str, str): the node key
+    """
+    return "{}:{}".format(node[0], node[1])
+
+
+def clean_entries(relations_list):
+    """
+    Flattens a parent or child list from relations.yaml into a set of image strings, dropping any null equivalent values
+    :param relations_list: list, str or None: the parents or children of an entry
+    """
+    entries = set()
+    if isinstance(relations_list, list):
+        for item in relations_list:
+            entries.update(clean_entries(item))
+    elif relations_list not in NULL_ENTRIES:
+        entries.add(str(relations_list))
+    return entries
+
+
+class RelationsGraph:
+    """
+    Indexed view of a loaded relations.yaml file
+    """
+
+    def __init__(self, data):
+        """
+        :param data: dict: loaded relations.yaml data, which is updated in place by to_data
+        """
+        self.data = data
+        self.data.setdefault('images', {})
+        if self.data['images'] is None:
+            self.data['images'] = {}
+        self.parents = {}
+        self.children = {}
+        self.version_keys = {}
+        self.touched = set()
+        self.version_index = versions.VersionIndex()
+        for name in self.data['images']:
+            for version, entry in (self.data['images'][name] or {}).items():
+                node = (name, str(version))
+                self.version_keys[node] = version
+                self.version_index.add(name, version)
+                self.add_node(node)
+                entry = entry or {}
+                for parent in clean_entries(entry.get('parents')):
+                    self.link(split_image(parent), node)
+                for child in clean_entries(entry.get('children')):
+                    self.link(node, split_image(child))
+
+    def add_node(self, node):
+        """
+        Adds an empty node to the indexes if it is not already present
+        :param node: (str, str): the node key
+        """
+        if node not in self.parents:
+            self.parents[node] = set()
+            self.children[node] = set()
+
+    def link(self, parent, child):
+        """
+        Records a parent to child edge in both adjacency sets
+        :param parent: (str, str): node key of the parent
+        :param child: (str, str): node key of the child
+        :return: bool: true if the edge was not already present
+        """
+        self.add_node(parent)
+        self.add_node(child)
+        if child in self.children[parent] and parent in self.parents[child]:
+            return False
+        self.children[parent].add(child)
+        self.parents[child].add(parent)
+        return True
+
+    def has_image(self, name, version=None):
+        """
+        Checks whether an image, or a specific version of it, is recorded in relations.yaml
+        :param name: str: name of the image
+        :param version: str: optional version of the image
+        """
+        if version is None:
+            return name in self.data['images']
+        return (name, str(version)) in self.version_keys
+
+    def versions(self, name):
+        """
+        Returns the recorded versions of an image, in file order
+        :param name: str: name of the image
+        """
+        return [str(version) for version in (self.data['images'].get(name) or {})]
+
+    def get_parents(self, name, version):
+        """
+        Returns the parents of an image version as 'name:version' strings
+        :param name: str: name of the image
+        :param version: str: version of the image
+        """
+        return set(join_image(node) for node in self.parents.get((name, str(version)), ()))
+
+    def get_children(self, name, version):
+        """
+        Returns the children of an image version as 'name:version' strings
+        :param name: str: name of the image
+        :param version: str: version of the image
+        """
+        return set(join_image(node) for node in self.children.get((name, str(version)), ()))
+
+    def is_terminated(self, name):
+        """
+        Checks whether an image has been marked as not to be automatically updated
+        :param name: str: name of the image
+        """
+        return name in (self.data.get('terminated') or {})
+
+    def add_image(self, name, version, parents, children):
+        """
+        Adds or updates an image version along with the edges to its parents and children
+        :param name: str: name of the image
+        :param version: str: version of the image
+        :param parents: list: parent images in 'name:version' format
+        :param children: list: child images in 'name:version' format
+        """
+        node = (name, str(version))
+        self.add_node(node)
+        self.touched.add(node)
+        if node not in self.version_keys:
+            self.version_keys[node] = str(version)
+            self.version_index.add(name, version)
+            self.data['images'].setdefault(name, {})
+            if self.data['images'][name] is None:
+                self.data['images'][name] = {}
+            self.data['images'][name][str(version)] = {}
+        for parent in clean_entries(parents):
+            if self.link(split_image(parent), node) or split_image(parent) not in self.version_keys:
+                self.touch(split_image(parent))
+        for child in clean_entries(children):
+            if self.link(node, split_image(child)) and split_image(child) in self.version_keys:
+                self.touch(split_image(child))
+
+    def touch(self, node):
+        """
+        Marks a node for re-normalization, adding a relations.yaml entry for it if it has none
+        :param node: (str, str): the node key
+        """
+        self.touched.add(node)
+        if node not in self.version_keys:
+            self.version_keys[node] = node[1]
+            self.version_index.add(node[0], node[1])
+            self.data['images'].setdefault(node[0], {})
+            if self.data['images'][node[0]] is None:
+                self.data['images'][node[0]] = {}
+            self.data['images'][node[0]][node[1]] = {}
+
+    def set_latest(self, name, version):
+        """
+        Records a version as the latest version of an image
+        :param name: str: name of the image
+        :param version: str: version of the image
+        """
+        if not self.data.get('latest'):
+            self.data['latest'] = {}
+        self.data['latest'][name] = version
+
+    def to_data(self):
+        """
+        Writes the touched nodes back into the relations.yaml data and returns it
+        """
+        for node in sorted(self.touched):
+            entry = self.data['images'][node[0]][self.version_keys[node]]
+            children = sorted(join_image(child) for child in self.children[node])
+            entry['children'] = children if children else [None]
+            entry['parents'] = sorted(join_image(parent)
+                                      for parent in self.parents[node])
+        self.touched = set()
+        return self.data
+
+    def dump(self, stream=None):
+        """
+        Dumps the relations.yaml data, including any changes, as YAML
+        :param stream: file: optional stream to write to, returns a string otherwise
+        """
+        return relations_io.dump_yaml(self.to_data(), stream)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Shared loading and dumping of relations.yaml for every script:
+    1) Uses libyaml's CSafeLoader/CSafeDumper when PyYAML was built with it, falling back to the pure Python classes
+    2) Parses each distinct file content once per process, handing out independent copies so callers can modify them freely
+    3) Keeps a JSON sidecar keyed on the sha256 of the file content, so later scripts in the same job skip the YAML parsing. The
+       cache directory is restored across runs, so an unreadable sidecar is ignored and the file is parsed again
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import yaml
+import result_cache
+
+try:
+    Loader = yaml.CSafeLoader
+    Dumper = yaml.CSafeDumper
+except AttributeError:
+    Loader = yaml.SafeLoader
+    Dumper = yaml.SafeDumper
+
+SIDECAR_DIRNAME = "relations"
+PARSED = {}
+
+
+def sidecar_path(content_hash):
+    """
+    Returns the path of the sidecar file for a file content hash
+    :param content_hash: str: sha256 of the relations.yaml content
+    """
+    return os.path.join(result_cache.get_cache_dir(), SIDECAR_DIRNAME, content_hash + ".json")
+
+
+def load_yaml(yaml_path, sidecar=True):
+    """
+    Loads a yaml file and returns a python yaml object, which the caller is free to modify
+    :param yaml_path: str: the yaml file to open and read
+    :param sidecar: bool: when true, read and write the parsed data from a sidecar file in AUTODOCKER_CACHE_DIR
+    """
+    with open(yaml_path, 'rb') as yaml_file:
+        content = yaml_file.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    if content_hash not in PARSED:
+        parsed = None
+        if sidecar and os.path.exists(sidecar_path(content_hash)):
+            try:
+                with open(sidecar_path(content_hash), encoding='utf-8') as sidecar_file:
+                    parsed = pickle.dumps(json.load(sidecar_file), protocol=pickle.HIGHEST_PROTOCOL)
+            except (OSError, ValueError):
+                parsed = None
+        if parsed is None:
+            data = yaml.load(content, Loader=Loader)
+            parsed = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+            if sidecar:
+                write_sidecar(content_hash, data)
+        PARSED[content_hash] = parsed
+    return pickle.loads(PARSED[content_hash])
+
+
+def write_sidecar(content_hash, data):
+    """
+    Writes parsed data to its sidecar file, ignoring any failure as the sidecar is only an optimization. Data that JSON cannot
+    hold exactly, such as YAML dates or non-string keys, is not written and is parsed from the YAML every time
+    :param content_hash: str: sha256 of the relations.yaml content
+    :param data: dict: the parsed data
+    """
+    path = sidecar_path(content_hash)
+    try:
+        encoded = json.dumps(data)
+        if json.loads(encoded) != data:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp{}".format(os.getpid()), 'w', encoding='utf-8') as sidecar_file:
+            sidecar_file.write(encoded)
+        os.replace(path + ".tmp{}".format(os.getpid()), path)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def dump_yaml(data, stream=None):
+    """
+    Dumps data as YAML in the same layout as yaml.safe_dump
+    :param data: dict: the data to dump
+    :param stream: file: optional stream to write to, returns a string otherwise
+    """
+    return yaml.dump(data, stream, Dumper=Dumper)
+
+
+def write_yaml(data, yaml_path):
+    """
+    Overwrites a yaml file with the data provided
+    :param data: dict: the data to write
+    :param yaml_path: str: the yaml file to write
+    """
+    with open(yaml_path, 'w') as yaml_file:
+        dump_yaml(data, yaml_file)
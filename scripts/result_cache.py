@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Remembers which images have already passed their unittest.yml tests, so unchanged images are not tested again.
+An entry is keyed on the image ID together with a hash of the unittest.yml contents, as versioned images never change.
+Entries are stored as one small file each under AUTODOCKER_CACHE_DIR (default '.autodocker-cache'), so that
+concurrent test processes never write to the same file.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import subprocess
+import docker_api
+
+DEFAULT_CACHE_DIR = ".autodocker-cache"
+RESULTS_DIRNAME = "test-results"
+
+
+def get_cache_dir():
+    """
+    Returns the directory used for auto-docker caches, taken from AUTODOCKER_CACHE_DIR if it is set
+    """
+    return os.environ.get('AUTODOCKER_CACHE_DIR') or DEFAULT_CACHE_DIR
+
+
+def file_hash(file_path):
+    """
+    Returns the sha256 hash of a file's contents
+    :param file_path: str: path to the file to hash
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as infile:
+        for block in iter(lambda: infile.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def local_image_id(image_name):
+    """
+    Returns the ID of an image present in the local Docker daemon, or None if it is not present
+    :param image_name: str: name of the image
+    """
+    client = docker_api.get_client()
+    if client:
+        image_info = client.inspect_image(image_name)
+        return image_info['Id'] if image_info else None
+    inspect_run = subprocess.run(["docker", "image", "inspect", "-f", "{{.Id}}", image_name],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if inspect_run.returncode != 0:
+        return None
+    return inspect_run.stdout.strip() or None
+
+
+def remote_image_id(image_name):
+    """
+    Returns the ID of an image from its registry manifest without pulling it, or None if it cannot be found.
+    The config digest of a single-platform manifest is the same value as the local image ID.
+    :param image_name: str: name of the image
+    """
+    manifest_run = subprocess.run(["docker", "manifest", "inspect", image_name],
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if manifest_run.returncode != 0:
+        return None
+    try:
+        return json.loads(manifest_run.stdout)['config']['digest']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def image_id(image_name):
+    """
+    Returns the ID of an image, checking the local Docker daemon before the registry
+    :param image_name: str: name of the image
+    """
+    return local_image_id(image_name) or remote_image_id(image_name)
+
+
+class ResultCache:
+    """
+    On-disk store of passed (image ID, unittest.yml hash) combinations
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: str: directory to keep the cache in, defaults to AUTODOCKER_CACHE_DIR
+        """
+        self.results_dir = os.path.join(
+            cache_dir or get_cache_dir(), RESULTS_DIRNAME)
+
+    def entry_path(self, identity, unittest_path):
+        """
+        Returns the path of the entry for an image ID and unittest.yml
+        :param identity: str: ID of the image
+        :param unittest_path: str: path to the image's unittest.yml
+        """
+        key = "{}\n{}".format(identity, file_hash(unittest_path))
+        return os.path.join(self.results_dir, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def has_passed(self, identity, unittest_path):
+        """
+        Checks whether an image ID has already passed the current contents of a unittest.yml
+        :param identity: str: ID of the image, or None if it is unknown
+        :param unittest_path: str: path to the image's unittest.yml
+        """
+        if not identity or not os.path.exists(unittest_path):
+            return False
+        return os.path.exists(self.entry_path(identity, unittest_path))
+
+    def record_pass(self, identity, unittest_path, image_name):
+        """
+        Records that an image ID has passed the current contents of a unittest.yml
+        :param identity: str: ID of the image, or None if it is unknown
+        :param unittest_path: str: path to the image's unittest.yml
+        :param image_name: str: name of the image, kept in the entry for reference
+        """
+        if not identity:
+            return
+        os.makedirs(self.results_dir, exist_ok=True)
+        entry_path = self.entry_path(identity, unittest_path)
+        with open(entry_path + ".tmp{}".format(os.getpid()), 'w') as outfile:
+            json.dump({'image': image_name, 'id': identity, 'unittest': unittest_path,
+                       'time': int(time.time())}, outfile)
+        os.replace(entry_path + ".tmp{}".format(os.getpid()), entry_path)
+        print("Recorded passing tests for {} in the result cache.".format(
+            image_name), file=sys.stderr)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Loads and validates unittest.yml files for ci_image.py and ci_latest_images.py:
+    1) Each distinct file content is parsed and validated once per process: every test needs a 'cmd', an 'expect_text' that
+       compiles as a regex and, optionally, a positive 'timeout'
+    2) Valid specs are kept in a JSON sidecar keyed on the sha256 of the file content under AUTODOCKER_CACHE_DIR, so later
+       processes, such as one ci_image.py per latest image, skip parsing unchanged files entirely
+    3) Expected text patterns are compiled once per process and shared by every test using them
+    4) load_all validates the files of a whole set of images in one pass, so every problem is reported before a container starts
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import threading
+import yaml
+import result_cache
+
+SIDECAR_DIRNAME = "unittest"
+PARSED = {}
+PATTERNS = {}
+PATTERNS_LOCK = threading.Lock()
+
+
+def sidecar_path(content_hash):
+    """
+    Returns the path of the sidecar file for a file content hash
+    :param content_hash: str: sha256 of the unittest.yml content
+    """
+    return os.path.join(result_cache.get_cache_dir(), SIDECAR_DIRNAME, content_hash + ".json")
+
+
+def compile_pattern(expect_text):
+    """
+    Returns the compiled regex for an expected text, compiling each distinct text once
+    :param expect_text: str: regex the output of a test has to match
+    """
+    with PATTERNS_LOCK:
+        if expect_text not in PATTERNS:
+            PATTERNS[expect_text] = re.compile(expect_text, re.DOTALL)
+        return PATTERNS[expect_text]
+
+
+def validate(unittest_config, filename):
+    """
+    Checks the contents of a unittest.yml file, returning the test specs along with every problem found
+    :param unittest_config: the loaded YAML
+    :param filename: str: path of the file, for the error messages
+    :return: ([{'cmd', 'expect_text', 'timeout'}], [str]): the specs, with a timeout of None when it is not set, and the errors
+    """
+    if not isinstance(unittest_config, dict) or not isinstance(unittest_config.get('commands'), list) \
+            or not unittest_config['commands']:
+        return [], ["{}: expected a non-empty 'commands' list".format(filename)]
+    specs = []
+    errors = []
+    for number, testinfo in enumerate(unittest_config['commands'], start=1):
+        if not isinstance(testinfo, dict):
+            errors.append("{}: command {} is not a mapping".format(filename, number))
+            continue
+        cmd = testinfo.get('cmd')
+        expect_text = testinfo.get('expect_text')
+        timeout = testinfo.get('timeout')
+        if not isinstance(cmd, str) or not cmd.strip():
+            errors.append("{}: command {} has no 'cmd'".format(filename, number))
+        if not isinstance(expect_text, str):
+            errors.append("{}: command {} has no 'expect_text'".format(filename, number))
+        else:
+            try:
+                compile_pattern(expect_text)
+            except re.error as exc:
+                errors.append("{}: 'expect_text' of command {} is not a valid regex: {}".format(
+                    filename, number, exc))
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+            errors.append("{}: 'timeout' of command {} is not a positive number of seconds: {}".format(
+                filename, number, timeout))
+        specs.append({'cmd': cmd, 'expect_text': expect_text, 'timeout': timeout})
+    return specs, errors
+
+
+def parse(filename, sidecar=True):
+    """
+    Loads and validates one unittest.yml file, using the in-memory and sidecar caches
+    :param filename: str: path to the unittest.yml file
+    :param sidecar: bool: when true, read and write valid specs from a sidecar file in AUTODOCKER_CACHE_DIR
+    :return: ([dict], [str]): the specs and the errors found, as returned by validate
+    """
+    try:
+        with open(filename, 'rb') as unittest_file:
+            content = unittest_file.read()
+    except OSError as exc:
+        return [], ["{}: unable to read the file: {}".format(filename, exc.strerror)]
+    content_hash = hashlib.sha256(content).hexdigest()
+    if content_hash in PARSED:
+        return [dict(spec) for spec in PARSED[content_hash]], []
+    specs = None
+    if sidecar:
+        try:
+            with open(sidecar_path(content_hash)) as sidecar_file:
+                specs = json.load(sidecar_file)
+        except (OSError, ValueError):
+            specs = None
+    if specs is None:
+        try:
+            specs, errors = validate(yaml.safe_load(content), filename)
+        except yaml.YAMLError as exc:
+            return [], ["{}: not valid YAML: {}".format(filename, exc)]
+        if errors:
+            return [], errors
+        if sidecar:
+            write_sidecar(content_hash, specs)
+    PARSED[content_hash] = specs
+    return [dict(spec) for spec in specs], []
+
+
+def write_sidecar(content_hash, specs):
+    """
+    Writes valid specs to their sidecar file, ignoring any failure as the sidecar is only an optimization
+    :param content_hash: str: sha256 of the unittest.yml content
+    :param specs: [dict]: the specs
+    """
+    path = sidecar_path(content_hash)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp{}".format(os.getpid()), 'w') as sidecar_file:
+            json.dump(specs, sidecar_file)
+        os.replace(path + ".tmp{}".format(os.getpid()), path)
+    except OSError:
+        pass
+
+
+def load_specs(filename, sidecar=True):
+    """
+    Returns the test specs of a unittest.yml file, exiting with every problem printed if it is not valid
+    :param filename: str: path to the unittest.yml file
+    :param sidecar: bool: when true, use the sidecar cache in AUTODOCKER_CACHE_DIR
+    :return: [{'cmd', 'expect_text', 'timeout'}]: the settings of each test, with a timeout of None when it is not set
+    """
+    specs, errors = parse(filename, sidecar)
+    if errors:
+        print_errors(errors)
+        exit(1)
+    return specs
+
+
+def load_all(filenames, sidecar=True):
+    """
+    Loads and validates every unittest.yml file in one pass
+    :param filenames: [str]: paths to the unittest.yml files
+    :param sidecar: bool: when true, use the sidecar cache in AUTODOCKER_CACHE_DIR
+    :return: ({filename: [dict]}, {filename: [str]}): the specs of the valid files, and the errors of the others
+    """
+    specs = {}
+    errors = {}
+    for filename in filenames:
+        file_specs, file_errors = parse(filename, sidecar)
+        if file_errors:
+            errors[filename] = file_errors
+        else:
+            specs[filename] = file_specs
+    return specs, errors
+
+
+def print_errors(errors):
+    """
+    Prints validation errors
+    :param errors: [str]: the errors
+    """
+    for error in errors:
+        print("ERROR: {}".format(error), file=sys.stderr)
+
+
+def main():
+    """
+    Main method
+    """
+    if len(sys.argv) < 2:
+        print("Usage python3 scripts/test_specs.py <unittest.yml>...")
+        sys.exit(1)
+    specs, errors = load_all(sys.argv[1:])
+    for filename in errors:
+        print_errors(errors[filename])
+    print("Checked {} files: {} valid, {} with errors.".format(
+        len(sys.argv) - 1, len(specs), len(errors)))
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Remembers how long each image takes to pull, build and test, so work can be scheduled longest first:
+    1) At the end of every build_image, ci_image.py test and ci_latest_images.py run, the durations of the successful 'build',
+       'test' and 'pull' spans are written to a SQLite database (AUTODOCKER_TIMINGS_DB, default
+       '<AUTODOCKER_CACHE_DIR>/timings.sqlite') keyed by image, tag and phase, keeping the latest runs of each
+    2) Estimates are the median of those runs, falling back to other tags of the same image and then to a default per phase
+    3) build_planner.run_plan starts the images with the longest chain of builds behind them first, and ci_latest_images.py
+       starts with the slowest images
+    4) 'timings.py plan --estimate' predicts the wall time of the builds and tests for a change set
+"""
+
+import os
+import sys
+import time
+import heapq
+import sqlite3
+import argparse
+import threading
+import statistics
+import build_planner
+import dockerfile
+import result_cache
+import tracing
+
+TIMINGS_ENV = "AUTODOCKER_TIMINGS_DB"
+TIMINGS_FILENAME = "timings.sqlite"
+HISTORY = 10
+# Seconds assumed for an image with no recorded runs of a phase
+DEFAULT_ESTIMATES = {'pull': 60, 'build': 300, 'test': 60}
+
+RECORDED = set()
+RECORDED_LOCK = threading.Lock()
+
+
+def get_db_path():
+    """
+    Returns the path of the timing database, taken from AUTODOCKER_TIMINGS_DB if it is set
+    """
+    return os.environ.get(TIMINGS_ENV) or os.path.join(result_cache.get_cache_dir(), TIMINGS_FILENAME)
+
+
+def connect(db_path=None):
+    """
+    Opens the timing database, creating it if needed
+    :param db_path: str: path to the database, defaults to get_db_path()
+    """
+    db_path = db_path or get_db_path()
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    # Several CI processes can finish at once, so wait for each other's writes
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.execute("CREATE TABLE IF NOT EXISTS timings (image TEXT NOT NULL, tag TEXT NOT NULL, phase TEXT NOT NULL, "
+                       "seconds REAL NOT NULL, recorded REAL NOT NULL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS timings_key ON timings (image, tag, phase, recorded)")
+    return connection
+
+
+def image_key(reference):
+    """
+    Returns the image name and tag of an image reference, without its registry or organization
+    :param reference: str: image in '[registry/][organization/]name[:tag]' format
+    """
+    registry, repository, tag, digest = dockerfile.split_reference(reference)
+    return repository.split('/')[-1], tag or "latest"
+
+
+def span_timing(span):
+    """
+    Returns the timing a finished span records, or None if it is not a successful pull, build or test
+    :param span: dict: span as written to the trace file
+    :return: (str, str, str, float): the image, tag, phase and seconds
+    """
+    attributes = span['attributes']
+    if span['status'] != "ok" or not attributes.get('image'):
+        return None
+    if span['name'] == 'build' and attributes.get('result') == "built":
+        phase = 'build'
+    elif span['name'] == 'test' and attributes.get('result') == "passed":
+        phase = 'test'
+    elif span['name'] == 'pull' or (span['name'] == 'prefetch.pull' and attributes.get('result') == "pulled"):
+        phase = 'pull'
+    else:
+        return None
+    image, tag = image_key(attributes['image'])
+    unittest_parts = str(attributes.get('unittest', '')).split('/')
+    if phase == 'test' and len(unittest_parts) == 3:
+        # The unittest.yml path keeps the version as written in relations.yaml, where the image name has '+' replaced
+        image, tag = unittest_parts[:2]
+    return image, tag, phase, span['duration']
+
+
+def record(timings, db_path=None):
+    """
+    Adds timings to the database, keeping the latest HISTORY runs of each image, tag and phase
+    :param timings: [(str, str, str, float)]: the image, tag, phase and seconds of each run
+    :param db_path: str: path to the database, defaults to get_db_path()
+    """
+    connection = connect(db_path)
+    try:
+        with connection:
+            now = time.time()
+            connection.executemany("INSERT INTO timings VALUES (?, ?, ?, ?, ?)",
+                                   [(image, tag, phase, seconds, now) for image, tag, phase, seconds in timings])
+            for key in set(timing[:3] for timing in timings):
+                connection.execute("DELETE FROM timings WHERE rowid IN (SELECT rowid FROM timings WHERE image = ? AND tag = ? "
+                                   "AND phase = ? ORDER BY recorded DESC LIMIT -1 OFFSET ?)", key + (HISTORY,))
+    finally:
+        connection.close()
+
+
+def save(db_path=None):
+    """
+    Writes the timings of the spans finished in this process since the last save, warning instead of failing if the database
+    cannot be written, as the timings only guide scheduling
+    :param db_path: str: path to the database, defaults to get_db_path()
+    """
+    with tracing.SPANS_LOCK:
+        spans = list(tracing.SPANS)
+    timings = []
+    with RECORDED_LOCK:
+        for span in spans:
+            if span['span_id'] not in RECORDED:
+                RECORDED.add(span['span_id'])
+                if span_timing(span):
+                    timings.append(span_timing(span))
+    if not timings:
+        return
+    try:
+        record(timings, db_path)
+    except (sqlite3.Error, OSError) as exc:
+        print("WARNING: Unable to record timings in {}: {}".format(db_path or get_db_path(), exc), file=sys.stderr)
+
+
+class Estimator:
+    """
+    Estimated durations from the recorded timings, read once when created
+    """
+
+    def __init__(self, db_path=None):
+        """
+        :param db_path: str: path to the database, defaults to get_db_path()
+        """
+        self.runs = {}
+        self.image_runs = {}
+        db_path = db_path or get_db_path()
+        if not os.path.exists(db_path):
+            return
+        try:
+            connection = sqlite3.connect(db_path, timeout=30)
+            try:
+                rows = connection.execute("SELECT image, tag, phase, seconds FROM timings ORDER BY recorded DESC").fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error as exc:
+            print("WARNING: Unable to read timings from {}: {}".format(db_path, exc), file=sys.stderr)
+            return
+        for image, tag, phase, seconds in rows:
+            self.runs.setdefault((image, tag, phase), []).append(seconds)
+            self.image_runs.setdefault((image, phase), []).append(seconds)
+
+    def estimate(self, image, tag, phase, default=None):
+        """
+        Returns the estimated seconds of a phase for an image
+        :param image: str: name of the image
+        :param tag: str: tag of the image
+        :param phase: str: 'pull', 'build' or 'test'
+        :param default: float: value returned when neither this tag nor any other tag of the image has recorded runs
+        """
+        runs = self.runs.get((image, str(tag), phase))
+        if not runs:
+            runs = self.image_runs.get((image, phase), [])[:HISTORY]
+        return statistics.median(runs) if runs else default
+
+    def has_history(self, image, tag, phase):
+        """
+        Checks whether an estimate comes from recorded runs rather than the default
+        :param image: str: name of the image
+        :param tag: str: tag of the image
+        :param phase: str: 'pull', 'build' or 'test'
+        """
+        return self.estimate(image, tag, phase) is not None
+
+    def image_estimate(self, image, tag, phases, default=None):
+        """
+        Returns the estimated seconds of several phases for an image, using DEFAULT_ESTIMATES for phases without history,
+        or default when no phase has any
+        :param image: str: name of the image
+        :param tag: str: tag of the image
+        :param phases: [str]: the phases to add up
+        :param default: float: value returned when the image has no recorded runs of any of the phases
+        """
+        if not any(self.has_history(image, tag, phase) for phase in phases):
+            return default
+        return sum(self.estimate(image, tag, phase, DEFAULT_ESTIMATES[phase]) for phase in phases)
+
+    def plan_estimates(self, plan, phase):
+        """
+        Returns the estimated seconds of a phase for every image in a build plan
+        :param plan: {image: {'path': str, 'depends': set}}: the plan, as returned by build_planner.plan_builds
+        :param phase: str: 'pull', 'build' or 'test'
+        """
+        return {image: self.estimate(*image.split(':', 1), phase, DEFAULT_ESTIMATES[phase]) for image in plan}
+
+
+def longest_first(images, phases, estimator=None):
+    """
+    Orders images by their estimated duration, slowest first, keeping the given order for images with no history
+    :param images: {image: tag}: the images to order
+    :param phases: [str]: the phases to add up
+    :param estimator: Estimator: estimates to use, read from the database if not given
+    :return: {image: tag}: the same images in the new order
+    """
+    estimator = estimator or Estimator()
+    order = sorted(images, key=lambda image: -estimator.image_estimate(image, images[image], phases, 0))
+    return {image: images[image] for image in order}
+
+
+def simulate(plan, durations, workers):
+    """
+    Predicts the wall time of running a plan with build_planner.run_plan
+    :param plan: {image: {'path': str, 'depends': set}}: the plan, as returned by build_planner.plan_builds
+    :param durations: {image: float}: estimated seconds of each image
+    :param workers: int: number of images processed at once
+    :return: (float, {image: float}): the predicted wall time, and the time each image finishes
+    """
+    priority = build_planner.critical_paths(plan, durations)
+    waiting = {image: set(plan[image]['depends']) for image in plan}
+    running = []
+    finished = {}
+    clock = 0.0
+    while waiting or running:
+        ready = sorted((image for image in waiting if not waiting[image]), key=lambda image: -priority[image])
+        for image in ready[:workers - len(running)]:
+            del waiting[image]
+            heapq.heappush(running, (clock + durations[image], image))
+        if not running:
+            break
+        clock, image = heapq.heappop(running)
+        finished[image] = clock
+        for child in waiting:
+            waiting[child].discard(image)
+    return clock, finished
+
+
+def print_plan(changed_paths, relations, workers, estimate):
+    """
+    Prints the build order and tests for a change set, with their predicted durations when asked
+    :param changed_paths: [str]: paths relative to the repository root
+    :param relations: dict: loaded relations.yaml data, or None
+    :param workers: int: number of images built at once
+    :param estimate: bool: when true, print the estimated duration of each image and the predicted wall time
+    """
+    import affected
+    rebuild, retest, reasons = affected.resolve(changed_paths, relations=relations)
+    plan = build_planner.plan_builds(rebuild, relations)
+    estimator = Estimator()
+    durations = estimator.plan_estimates(plan, 'build')
+    build_time, finished = simulate(plan, durations, workers)
+    priority = build_planner.critical_paths(plan, durations)
+    print("Build ({} at once):".format(workers))
+    for image in sorted(plan, key=lambda image: finished.get(image, 0)):
+        line = "    {}".format(image)
+        if estimate:
+            line += ": ~{:.0f}s{}, critical path ~{:.0f}s, done at ~{:.0f}s".format(
+                durations[image], "" if estimator.has_history(*image.split(':', 1), 'build') else " (no history)",
+                priority[image], finished.get(image, 0))
+        print(line)
+    test_time = 0.0
+    print("Test (one image at a time):")
+    for dockerfile_path in retest:
+        image = build_planner.image_from_path(dockerfile_path)
+        tool, tag = image.split(':', 1)
+        seconds = estimator.estimate(tool, tag, 'test', DEFAULT_ESTIMATES['test'])
+        test_time += seconds
+        line = "    {}".format(image)
+        if estimate:
+            line += ": ~{:.0f}s{}".format(seconds, "" if estimator.has_history(tool, tag, 'test') else " (no history)")
+        print(line)
+    if estimate:
+        print("Predicted wall time: ~{:.0f}s building + ~{:.0f}s testing = ~{:.0f}s".format(
+            build_time, test_time, build_time + test_time))
+
+
+def print_history(image=None):
+    """
+    Prints the recorded estimate of every image, tag and phase
+    :param image: str: optional image name to limit the output to
+    """
+    estimator = Estimator()
+    for key in sorted(estimator.runs):
+        if image is None or key[0] == image:
+            print("{}:{} {}: ~{:.1f}s over {} runs".format(
+                key[0], key[1], key[2], estimator.estimate(*key), len(estimator.runs[key])))
+
+
+def main():
+    """
+    Main method
+    """
+    parser = argparse.ArgumentParser(
+        description="Shows recorded pull, build and test timings, and predicts the wall time of a change set")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="Print the builds and tests for a change set")
+    plan_parser.add_argument("changed_paths", nargs="*",
+                             help="Changed paths, defaults to the paths changed in the compare range of the current build")
+    plan_parser.add_argument("--estimate", action="store_true", help="Print estimated durations and the predicted wall time")
+    plan_parser.add_argument("--workers", help="Number of images built at once (default: BUILD_WORKERS or {})".format(
+        build_planner.DEFAULT_WORKERS))
+    plan_parser.add_argument("--relations", default=build_planner.RELATION_FILENAME,
+                             help="relations.yaml file (default: %(default)s)")
+    show_parser = subparsers.add_parser("show", help="Print the recorded estimates")
+    show_parser.add_argument("image", nargs="?", help="Image name to show")
+    args = parser.parse_args()
+    if args.command == "show":
+        print_history(args.image)
+        return
+    changed_paths = args.changed_paths
+    if not changed_paths:
+        import functions
+        changed_paths = functions.changed_paths_in_range(functions.get_compare_range())
+    print_plan(changed_paths, build_planner.load_relations(args.relations),
+               build_planner.get_workers(args.workers), args.estimate)
+
+
+if __name__ == "__main__":
+    main()
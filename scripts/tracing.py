@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Lightweight phase timing for every entry point:
+    1) Each major operation runs inside a named span recording its start time, duration, outcome and attributes such as the image and tag
+    2) When AUTODOCKER_TRACE names a file, every finished span is appended to it as one JSON line, so child processes and later
+       jobs add to the same trace
+    3) Each entry point prints a summary table of its spans to stderr when it finishes, and 'tracing.py summary <trace file>'
+       summarizes a whole trace, optionally grouped by an attribute (e.g. --by image)
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import contextlib
+
+TRACE_ENV = "AUTODOCKER_TRACE"
+
+SPANS = []
+SPANS_LOCK = threading.Lock()
+LOCAL = threading.local()
+
+
+def get_trace_path():
+    """
+    Returns the trace file set in AUTODOCKER_TRACE, or None if tracing is off
+    """
+    return os.environ.get(TRACE_ENV) or None
+
+
+class Span:
+    """
+    A named, timed operation
+    """
+
+    def __init__(self, name, attributes):
+        """
+        :param name: str: name of the operation (e.g. 'build')
+        :param attributes: dict: attributes of the operation (e.g. {'image': 'base:1.0.0'})
+        """
+        self.name = name
+        self.attributes = dict(attributes)
+        self.span_id = uuid.uuid4().hex[:16]
+        stack = getattr(LOCAL, 'stack', [])
+        self.parent_id = stack[-1].span_id if stack else os.environ.get(
+            TRACE_ENV + "_PARENT")
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.status = "ok"
+
+    def set(self, key, value):
+        """
+        Records an attribute, such as an exit code known only once the operation ends
+        :param key: str: name of the attribute
+        :param value: the value, which must be JSON serializable
+        """
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {'name': self.name, 'span_id': self.span_id, 'parent_id': self.parent_id, 'start': round(self.start, 6),
+                'duration': round(self.duration, 6), 'status': self.status, 'pid': os.getpid(),
+                'thread': threading.current_thread().name, 'attributes': self.attributes}
+
+
+def record(span):
+    """
+    Keeps a finished span for the summary, appending it to the trace file when tracing is on
+    :param span: Span: the finished span
+    """
+    with SPANS_LOCK:
+        SPANS.append(span.to_dict())
+        trace_path = get_trace_path()
+        if trace_path:
+            try:
+                with open(trace_path, 'a') as trace_file:
+                    trace_file.write(json.dumps(
+                        SPANS[-1], default=str) + "\n")
+            except OSError as exc:
+                print("Unable to write to trace file {}: {}".format(
+                    trace_path, exc), file=sys.stderr)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a span, marking it as an error if it raises or exits with a non-zero code
+    :param name: str: name of the operation
+    :param attributes: attributes of the operation
+    """
+    current = Span(name, attributes)
+    stack = getattr(LOCAL, 'stack', None)
+    if stack is None:
+        stack = LOCAL.stack = []
+    stack.append(current)
+    try:
+        yield current
+    except SystemExit as exc:
+        if exc.code not in [0, None]:
+            current.status = "error"
+            current.set('exit_code', exc.code)
+        raise
+    except BaseException as exc:
+        current.status = "error"
+        current.set('error', "{}: {}".format(type(exc).__name__, exc))
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.started
+        stack.pop()
+        record(current)
+
+
+@contextlib.contextmanager
+def entry_point(name, **attributes):
+    """
+    Wraps a script's main method in a root span, passing it on to child processes and printing the summary table at the end
+    :param name: str: name of the entry point (e.g. 'functions pipeline')
+    :param attributes: attributes of the run
+    """
+    try:
+        with span(name, **attributes) as root:
+            previous = os.environ.get(TRACE_ENV + "_PARENT")
+            os.environ[TRACE_ENV + "_PARENT"] = root.span_id
+            try:
+                yield root
+            finally:
+                if previous is None:
+                    del os.environ[TRACE_ENV + "_PARENT"]
+                else:
+                    os.environ[TRACE_ENV + "_PARENT"] = previous
+    finally:
+        if get_trace_path():
+            print_summary(SPANS)
+
+
+def summarize(spans, group_by=None):
+    """
+    Totals span durations by name, and optionally by an attribute
+    :param spans: [dict]: spans as written to the trace file
+    :param group_by: str: optional attribute to group by as well as the name (e.g. 'image')
+    :return: [dict]: one row per group with count, errors, total, mean and max seconds, slowest total first
+    """
+    groups = {}
+    for entry in spans:
+        key = (entry['name'], str(entry['attributes'].get(group_by, '')) if group_by else '')
+        group = groups.setdefault(
+            key, {'name': key[0], 'group': key[1], 'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+        group['count'] += 1
+        group['errors'] += entry['status'] != "ok"
+        group['total'] += entry['duration']
+        group['max'] = max(group['max'], entry['duration'])
+    rows = sorted(groups.values(), key=lambda group: (-group['total'], group['name'], group['group']))
+    for row in rows:
+        row['mean'] = row['total'] / row['count']
+    return rows
+
+
+def print_summary(spans, group_by=None, outfile=None):
+    """
+    Prints a table of span timings
+    :param spans: [dict]: spans as written to the trace file
+    :param group_by: str: optional attribute to group by as well as the name
+    :param outfile: file: where to print, defaults to stderr
+    """
+    outfile = outfile or sys.stderr
+    rows = summarize(spans, group_by)
+    if not rows:
+        return
+    name_width = max(len("span"), max(len(row['name']) for row in rows))
+    group_width = max(len(group_by or ""), max(len(row['group']) for row in rows))
+    header = "{:<{}}  ".format("span", name_width)
+    if group_by:
+        header += "{:<{}}  ".format(group_by, group_width)
+    print("Timing summary:", file=outfile)
+    print(header + "{:>6} {:>6} {:>10} {:>10} {:>10}".format("count", "errors", "total s", "mean s", "max s"), file=outfile)
+    for row in rows:
+        line = "{:<{}}  ".format(row['name'], name_width)
+        if group_by:
+            line += "{:<{}}  ".format(row['group'], group_width)
+        print(line + "{:>6} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            row['count'], row['errors'], row['total'], row['mean'], row['max']), file=outfile)
+
+
+def load_trace(trace_path):
+    """
+    Reads the spans from a trace file, skipping any partially written line
+    :param trace_path: str: path to the JSON lines trace file
+    """
+    spans = []
+    with open(trace_path) as trace_file:
+        for line in trace_file:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans
+
+
+def main():
+    """
+    Main method
+    """
+    parser = argparse.ArgumentParser(
+        description="Summarizes the spans recorded in AUTODOCKER_TRACE files")
+    parser.add_argument("command", choices=["summary"])
+    parser.add_argument("trace", nargs="+", help="JSON lines trace files")
+    parser.add_argument(
+        "--by", help="Attribute to group spans by as well as their name (e.g. image)")
+    args = parser.parse_args()
+    spans = []
+    for trace_path in args.trace:
+        spans.extend(load_trace(trace_path))
+    print_summary(spans, args.by, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,14 @@ Receives a Dockerfile, and adds relevant information to the relations.yaml file
 import os
 import sys
 import re
-import yaml
-import numpy as np
-from github import Github
+import dockerfile
+import issue_sync
+import result_cache
+import relations_graph
+import relations_io
+import versions
+import rebuild_planner
+import tracing
 
 # Global varibles set
 RELATION_FILENAME = "relations.yaml"
@@ -28,38 +33,28 @@ def get_update_type(image_version, prev_version):
     :param prev_version: str: the version that exists in relations.yaml
     """
     # Split the version numbering to find what type of update was performed
-    prev_version_major = int(prev_version.split(sep=".")[0])
-    prev_version_minor = int(prev_version.split(sep=".")[1])
-    prev_version_patch = int(prev_version.split(sep=".")[2])
-    curr_version_major = int(image_version.split(sep=".")[0])
-    curr_version_minor = int(image_version.split(sep=".")[1])
-    curr_version_patch = int(image_version.split(sep=".")[2])
-    # Ensure that the new major version is not less than the old major version
-    if curr_version_major < prev_version_major:
-        print("ERROR: New major version number {} is less than the previous major version number {}, this is not allowed!\nPlease re-version your Docker image.".format(curr_version_major, prev_version_major))
-        exit(1)
-    elif curr_version_major > prev_version_major:
-        print("New major version number detected, re-versioning and creating new child image paths.")
-        return 'major'
-    else:
-        # Do the same with the minor version
-        if curr_version_minor < prev_version_minor:
+    prev_version_major, prev_version_minor, prev_version_patch = versions.version_parts(prev_version)
+    curr_version_major, curr_version_minor, curr_version_patch = versions.version_parts(image_version)
+    update_type = versions.update_type(prev_version, image_version)
+    # Ensure that the first number that changed has not gone down
+    if versions.version_parts(image_version) < versions.version_parts(prev_version):
+        if update_type == 'major':
+            print("ERROR: New major version number {} is less than the previous major version number {}, this is not allowed!\nPlease re-version your Docker image.".format(curr_version_major, prev_version_major))
+        elif update_type == 'minor':
             print("ERROR: New minor version number {} is less than the previous minor version number {} under the same major version {}, this is not allowed!\nPlease re-version your Docker image.".format(
                 curr_version_minor, prev_version_minor, prev_version_major))
-            exit(1)
-        elif curr_version_minor > prev_version_minor:
-            print(
-                "New minor version number detected, re-versioning and creating new child image paths.")
-            return 'minor'
         else:
-            # Finally check the patch version, and default to this
-            if curr_version_patch < prev_version_patch:
-                print("ERROR: New patch version number {} is less than the previous patch version number {} under the same major-minor version {}.{}, this is not allowed!\nPlease re-version your Docker image.".format(
-                    curr_version_patch, prev_version_patch, curr_version_major, curr_version_minor))
-                exit(1)
-            else:
-                print("Patch detected, creating new child image paths.")
-                return 'patch'
+            print("ERROR: New patch version number {} is less than the previous patch version number {} under the same major-minor version {}.{}, this is not allowed!\nPlease re-version your Docker image.".format(
+                curr_version_patch, prev_version_patch, curr_version_major, curr_version_minor))
+        exit(1)
+    if update_type == 'major':
+        print("New major version number detected, re-versioning and creating new child image paths.")
+    elif update_type == 'minor':
+        print(
+            "New minor version number detected, re-versioning and creating new child image paths.")
+    else:
+        print("Patch detected, creating new child image paths.")
+    return update_type
 
 
 def is_terminated(image_name):
@@ -73,16 +68,17 @@ def is_terminated(image_name):
         return False
 
 
-def update_children(child_list, update_type):
+def update_children(child_list, update_type, issues=None):
     """
     Takes the image name and version, increments it, and returns an updated child image name
-    :param image_name: str : Name of the Docker image to be incrimented
-    :param image_version: str : Version number to incriment
+    :param child_list: list : Child images in 'image_name:image_version' format to be incremented
+    :param update_type: str : Type of update made to the parent image ('major', 'minor' or 'patch')
+    :param issues: IssueSync : Optional issue queue shared across calls, one is created and flushed here if not given
     """
-    g = Github(GITHUB_TOKEN)
-    issue_array = []
-    for issue in list(g.get_repo(GITHUB_REPO).get_issues(state='open')):
-        issue_array.append(issue.title)
+    flush = issues is None
+    if issues is None:
+        issues = issue_sync.IssueSync(issue_sync.GithubRestBackend(
+            GITHUB_TOKEN, GITHUB_REPO, etag_path=os.path.join(result_cache.get_cache_dir(), issue_sync.ETAG_FILENAME)))
     for child in child_list:
         if child == None:
             continue
@@ -95,37 +91,24 @@ def update_children(child_list, update_type):
                     "This image has been flagged as not to be automatically updated, skipping.")
                 continue
             else:
-                # Get the versioning information from the previous entry
-                child_major = int(child_version.split(sep=".")[0])
-                child_minor = int(child_version.split(sep=".")[1])
-                child_patch = int(child_version.split(sep=".")[2])
                 # Re-set the version number to match the change from the previous image to the new image
-                if(update_type == 'major'):
-                    child_major += 1
-                    child_minor = 0
-                    child_patch = 0
-                elif(update_type == 'minor'):
-                    child_minor += 1
-                    child_patch = 0
-                else:
-                    child_patch += 1
-                new_child_version = "{}.{}.{}".format(
-                    child_major, child_minor, child_patch)
+                new_child_version = rebuild_planner.bump_version(
+                    child_version, update_type)
                 position = child_list.index(child)
                 new_child = "{}:{}".format(child_image, new_child_version)
                 child_list[position] = new_child
                 print("Found child image that will require updating: Update {} to {}".format(
                     child, new_child))
                 issue_title = "Update {} to {}".format(child, new_child)
-                if not issue_title in issue_array:
-                    issue_body = "Parent image has been updated, please update the image {} to use the new parent image.  Recommended versioning: {}".format(
-                        child, new_child_version)
-                    g.get_repo(GITHUB_REPO).create_issue(
-                        title=issue_title, body=issue_body)
-                else:
+                issue_body = "Parent image has been updated, please update the image {} to use the new parent image.  Recommended versioning: {}".format(
+                    child, new_child_version)
+                if not issues.queue(issue_title, issue_body):
                     print("Issue for updating {} to {} already open.".format(
                         child, new_child))
                     continue
+    if flush:
+        with tracing.span("issues.sync"):
+            issues.flush()
 
 
 def write_yaml():
@@ -133,9 +116,7 @@ def write_yaml():
     Overwrites the existing relations.yaml file with the new information provided, should only\
         be called once per run
     """
-    yaml_file = open(RELATION_FILENAME, "w")
-    yaml.safe_dump(NEWDATA, yaml_file)
-    yaml_file.close()
+    relations_io.write_yaml(NEWDATA, RELATION_FILENAME)
 
 
 def update_ancestor(parent, docker_image):
@@ -218,8 +199,8 @@ def get_children(image_version, image_name):
         if image_version in ORIDATA['images'][image_name]:
             return ORIDATA['images'][image_name][image_version]['children']
         else:
-            versions = np.array(list(ORIDATA['images'][image_name]))
-            prev_version = np.array(versions)[-1]
+            prev_version = versions.VersionIndex(
+                ORIDATA['images']).predecessor(image_name, image_version)
             update_type = get_update_type(image_version, prev_version)
             update_children(ORIDATA['images'][image_name]
                             [prev_version]['children'], update_type)
@@ -232,26 +213,14 @@ def get_parents():
     """
     Gets the parent information from the Dockerfile
     """
-    parents = []
-    with open(DOCKERFILE_PATH, "r") as dockerfile:
-        for line in dockerfile:
-            if 'FROM ' in line:
-                line = line.split()[1]
-                if line.lower() == 'scratch':
-                    return None
-                else:
-                    parents.append(line.split('/')[-1])
-    return parents
+    return dockerfile.parents(DOCKERFILE_PATH)
 
 
 def load_yaml():
     """
     Loads a yaml file and returns a python yaml object
     """
-    with open(RELATION_FILENAME) as yaml_file:
-        yaml_data = yaml.safe_load(yaml_file)
-    yaml_file.close()
-    return yaml_data
+    return relations_io.load_yaml(RELATION_FILENAME)
 
 
 def build_latest(image_name, image_version):
@@ -284,6 +253,33 @@ def list_cleaner(relations_list):
     return new_relations
 
 
+def update_graph(graph, image_name, image_version, parents, issues=None):
+    """
+    Adds an image to the relations graph, linking it to its parents and opening update issues for the children of its previous version
+    :param graph: RelationsGraph: the relations graph to update
+    :param image_name: str: name of the Docker image being added
+    :param image_version: str: version of the Docker image being added
+    :param parents: list: parent images of the Docker image in 'image_name:image_version' format
+    :param issues: IssueSync: Optional issue queue passed on to update_children
+    """
+    if graph.has_image(image_name, image_version):
+        children = list(graph.get_children(image_name, image_version))
+    else:
+        children = []
+        prev_version = graph.version_index.predecessor(
+            image_name, image_version)
+        if prev_version is not None:
+            update_type = get_update_type(image_version, prev_version)
+            update_children(
+                sorted(graph.get_children(image_name, prev_version)), update_type, issues)
+            print("Downstream rebuild plan for {}:{}:".format(
+                image_name, image_version))
+            rebuild_planner.print_plan(rebuild_planner.plan_rebuilds(
+                graph, image_name, prev_version, image_version, update_type))
+    graph.add_image(image_name, image_version, parents, children)
+    graph.set_latest(image_name, image_version)
+
+
 def main():
     """
     Main method
@@ -299,31 +295,18 @@ def main():
         DOCKERFILE_PATH = os.path.abspath(sys.argv[1])
         image_name = re.split('/|\\\\', DOCKERFILE_PATH)[-3]
         image_version = re.split('/|\\\\', DOCKERFILE_PATH)[-2]
-        docker_image = image_name + ':' + image_version
-        ORIDATA = load_yaml()
-        NEWDATA = load_yaml()
-        parents = get_parents()
-        children = get_children(image_version, image_name)
-    # Start by adding the image to the table
-        build_entry(image_name, image_version, parents, children)
-        build_latest(image_name, image_version)
-    # Update all parent images
-        for parent in parents:
-            update_ancestor(parent, docker_image)
-    # Clean up all parent and child images
-        for image_name in NEWDATA['images']:
-            for image_version in NEWDATA['images'][image_name]:
-                child_images = list_cleaner(
-                    NEWDATA['images'][image_name][image_version]['children'])
-                parent_images = list_cleaner(
-                    NEWDATA['images'][image_name][image_version]['parents'])
-                new_image = {
-                    'children': child_images,
-                    'parents': parent_images
-                }
-                NEWDATA['images'][image_name][image_version].update(new_image)
-    # Write out the new relations.yaml
-        write_yaml()
+        with tracing.entry_point("update_relations", image="{}:{}".format(image_name, image_version)):
+            with tracing.span("relations.load"):
+                ORIDATA = load_yaml()
+                graph = relations_graph.RelationsGraph(ORIDATA)
+        # Add the image and update its parents, only the changed entries are cleaned up
+            with tracing.span("relations.update", image="{}:{}".format(image_name, image_version)):
+                update_graph(graph, image_name, image_version,
+                             get_parents() or [])
+                NEWDATA = graph.to_data()
+        # Write out the new relations.yaml
+            with tracing.span("relations.write"):
+                write_yaml()
 
 
 if __name__ == "__main__":
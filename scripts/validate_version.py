@@ -2,15 +2,18 @@
 """
 Receives a relations file and a docker image:version combination, and verifies that this image does not already exist in the master branch.
 If it exists in master, as these images are meant to be locked down and final, it errors out and tells the user to try another image
-version.  Otherwise, it allows procedure as normal.
+version.  It also errors out if the Dockerfile cannot be parsed, such as one with no FROM, unset ARGs in FROM or unknown
+instructions.  Otherwise, it allows procedure as normal.
 After this, it should build the image, push to DockerHub, and continue as normal.
 """
 
 import os
 import sys
 import re
-import yaml
-import numpy as np
+import dockerfile
+import relations_io
+import versions
+import tracing
 
 
 def check_version_info(master_version, image_version):
@@ -23,19 +26,22 @@ def check_version_info(master_version, image_version):
     print(image_version)
     print(master_version)
     if pattern.match(image_version):
-        if image_version.split(sep=".")[0] < master_version.split(sep=".")[0]:
+        image_major, image_minor, image_patch = versions.version_parts(
+            image_version)
+        master_major, master_minor, master_patch = versions.version_parts(
+            master_version)
+        if image_major < master_major:
             print("Error: Proposed major version number {} is less than the current major version number on master {}.\nPlease\
-                      incriment the version for this image correctly.".format(image_version.split(sep=".")[0],
-                                                                              master_version.split(sep=".")[0]), file=sys.stderr)
+                      incriment the version for this image correctly.".format(image_major, master_major), file=sys.stderr)
             return False
-        elif master_version.split(sep=".")[0] == image_version.split(sep=".")[0]:
-            if image_version.split(sep=".")[1] < master_version.split(sep=".")[1]:
+        elif master_major == image_major:
+            if image_minor < master_minor:
                 print("Error: Proposed minor version revision number {}.{} is less than or equal the current master version: {}.{}\
-                         \nPlease incriment the version for this image correctly.".format(image_version.split(sep=".")[0],
-                                                                                          image_version.split(sep=".")[1], master_version.split(sep=".")[0], master_version.split(sep=".")[1]), file=sys.stderr)
+                         \nPlease incriment the version for this image correctly.".format(image_major, image_minor,
+                                                                                          master_major, master_minor), file=sys.stderr)
                 return False
-            elif image_version.split(sep=".")[1] == master_version.split(sep=".")[1]:
-                if image_version.split(sep=".")[2] <= master_version.split(sep=".")[2]:
+            elif image_minor == master_minor:
+                if image_patch <= master_patch:
                     print("Error: Proposed patch version number {} is less than or equal the current master version: {}\nPlease incriment the version for this image correctly.".format(
                         image_version, master_version), file=sys.stderr)
                     return False
@@ -45,12 +51,12 @@ def check_version_info(master_version, image_version):
                     return True
             else:
                 print("The new image minor version number {}.{} is greater than the existing minor version {}.{}, proceeding.".format(
-                    image_version.split(sep=".")[0], image_version.split(
-                        sep=".")[1], master_version.split(sep=".")[0],
-                    master_version.split(sep=".")[1]), file=sys.stderr)
+                    image_major, image_minor, master_major, master_minor), file=sys.stderr)
+                return True
         else:
-            print("New image has greater major version number {} than master {}, proceeding.".format(image_version.split(sep=".")[0],
-                                                                                                     master_version.split(sep=".")[0]), file=sys.stderr)
+            print("New image has greater major version number {} than master {}, proceeding.".format(image_major,
+                                                                                                     master_major), file=sys.stderr)
+            return True
     else:
         print("Error: the version number does not match our default pattern: '0.0.0'.\nPlease re-name the directory to match this \
                structure.", file=sys.stderr)
@@ -64,18 +70,18 @@ def check_exists(master_yaml, image_name, image_version):
     :param image_name: the name of the Docker image to search for
     :param image_version: the version of said Docker image to search for
     """
-    if image_name in master_yaml['images']:
+    version_index = versions.VersionIndex(master_yaml['images'])
+    if version_index.has(image_name):
         print("Found an image with the same name, checking for versions.",
               file=sys.stderr)
-        if image_version in master_yaml['images'][image_name]:
+        if version_index.has(image_name, image_version):
             print("Error: Found duplicated image and version already present in Master\n\
                      Cannot proceed, please change the image version to avoide overwritting a locked image.", file=sys.stderr)
             return False
         else:
             print("New version of {} found, verifying that this is an updated version number".format(
                 image_name), file=sys.stderr)
-            previous_version = np.array(
-                list(master_yaml['images'][image_name]))[-1]
+            previous_version = version_index.latest(image_name)
             print(previous_version)
             return check_version_info(previous_version, image_version)
     else:
@@ -83,15 +89,23 @@ def check_exists(master_yaml, image_name, image_version):
         return True
 
 
+def check_dockerfile(dockerfile_path):
+    """
+    Verifies that a Dockerfile parses without errors, printing each error found
+    :param dockerfile_path: path to the Dockerfile
+    """
+    errors = dockerfile.load(dockerfile_path).errors
+    for error in errors:
+        print("Error: {}: {}".format(dockerfile_path, error), file=sys.stderr)
+    return not errors
+
+
 def load_yaml(master_yaml):
     """
     Loads a yaml file and returns a python yaml object
     :param yaml_file: the yaml file to open and read
     """
-    with open(master_yaml) as yaml_file:
-        yaml_data = yaml.safe_load(yaml_file)
-    yaml_file.close()
-    return yaml_data
+    return relations_io.load_yaml(master_yaml)
 
 
 def main():
@@ -103,14 +117,15 @@ def main():
         print("Usage python3 scripts/validate_version.py <master relations.yaml> <Dockerfile path>")
         sys.exit(1)
     else:
-        master_yaml = load_yaml(os.path.abspath(sys.argv[1]))
-        print(os.path.abspath(sys.argv[2]))
         image_name = re.split('/', os.path.abspath(sys.argv[2]))[-3]
         image_version = re.split('/', os.path.abspath(sys.argv[2]))[-2]
-        if check_exists(master_yaml, image_name, image_version):
-            print("New image found, proceeding to build, push to DockerHub, and add it to the 'relations.yaml' file.", file=sys.stderr)
-        else:
-            sys.exit(1)
+        with tracing.entry_point("validate_version", image="{}:{}".format(image_name, image_version)):
+            master_yaml = load_yaml(os.path.abspath(sys.argv[1]))
+            print(os.path.abspath(sys.argv[2]))
+            if check_exists(master_yaml, image_name, image_version) and check_dockerfile(sys.argv[2]):
+                print("New image found, proceeding to build, push to DockerHub, and add it to the 'relations.yaml' file.", file=sys.stderr)
+            else:
+                sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Version parsing and lookup shared by validate_version.py, update_relations.py and rebuild_planner.py:
+    1) Versions are parsed once into tuples that compare numerically, so '10.0.0' sorts after '9.0.0'
+    2) VersionIndex keeps every image's versions sorted, giving bisect based latest and predecessor lookups
+"""
+
+import re
+import bisect
+import functools
+
+VERSION_SEPARATORS = re.compile(r"[._+-]")
+UPDATE_TYPES = ['major', 'minor', 'patch']
+
+
+@functools.lru_cache(maxsize=None)
+def parse_version(version):
+    """
+    Parses a version string into a comparable tuple, numeric components compare as numbers and sort before text components
+    :param version: str: the version to parse (e.g. '1.0.0' or '18.04')
+    """
+    parts = []
+    for part in VERSION_SEPARATORS.split(str(version)):
+        if part.isdigit():
+            parts.append((0, int(part), ''))
+        else:
+            parts.append((1, 0, part))
+    return tuple(parts)
+
+
+def version_parts(version, count=3):
+    """
+    Returns the first numeric components of a version, padded with zeros
+    :param version: str: the version to split
+    :param count: int: number of components to return
+    """
+    numbers = [part[1] for part in parse_version(version)[:count]]
+    return tuple(numbers + [0] * (count - len(numbers)))
+
+
+def update_type(prev_version, new_version):
+    """
+    Returns the type of update between two versions, as the first of their major, minor and patch numbers that differs
+    :param prev_version: str: the previous version
+    :param new_version: str: the new version
+    :return: str: 'major', 'minor' or 'patch', which is also returned when the numbers are equal
+    """
+    for name, prev_part, new_part in zip(UPDATE_TYPES, version_parts(prev_version), version_parts(new_version)):
+        if prev_part != new_part:
+            return name
+    return 'patch'
+
+
+class VersionIndex:
+    """
+    Sorted per-image index of the versions recorded in relations.yaml
+    """
+
+    def __init__(self, images=None):
+        """
+        :param images: dict: optional 'images' section of relations.yaml to index
+        """
+        self.versions = {}
+        for name in images or {}:
+            for version in images[name] or {}:
+                self.add(name, version)
+
+    def add(self, name, version):
+        """
+        Adds a version of an image to the index
+        :param name: str: name of the image
+        :param version: str: version of the image
+        """
+        entries = self.versions.setdefault(name, [])
+        entry = (parse_version(str(version)), str(version))
+        position = bisect.bisect_left(entries, entry)
+        if position == len(entries) or entries[position] != entry:
+            entries.insert(position, entry)
+
+    def has(self, name, version=None):
+        """
+        Checks whether an image, or a specific version of it, is in the index
+        :param name: str: name of the image
+        :param version: str: optional version of the image
+        """
+        if version is None:
+            return bool(self.versions.get(name))
+        entries = self.versions.get(name, [])
+        entry = (parse_version(str(version)), str(version))
+        position = bisect.bisect_left(entries, entry)
+        return position < len(entries) and entries[position] == entry
+
+    def latest(self, name):
+        """
+        Returns the highest version of an image, or None if the image is not in the index
+        :param name: str: name of the image
+        """
+        entries = self.versions.get(name)
+        return entries[-1][1] if entries else None
+
+    def predecessor(self, name, version):
+        """
+        Returns the highest version of an image that is lower than version, or None if there is none
+        :param name: str: name of the image
+        :param version: str: the version to look below
+        """
+        entries = self.versions.get(name, [])
+        position = bisect.bisect_left(
+            entries, (parse_version(str(version)), ''))
+        return entries[position - 1][1] if position else None
+
+    def sorted_versions(self, name):
+        """
+        Returns every version of an image from lowest to highest
+        :param name: str: name of the image
+        """
+        return [entry[1] for entry in self.versions.get(name, [])]
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath('scripts/'))
+import affected
+
+DOCKERFILES = {'base/1.0.0': "FROM ubuntu:18.04\nCOPY install.sh /tmp/\nCOPY config/ /etc/tool/\nRUN /tmp/install.sh\n",
+               'child/1.0.0': "FROM test_org/base:1.0.0\nCOPY [\"*.py\", \"/app/\"]\n",
+               'grandchild/2.0.0': "FROM child:1.0.0\n",
+               'other/1.0.0': "FROM ubuntu:18.04\nCOPY . /src\n"}
+RELATIONS = {'images': {'base': {'1.0.0': {'children': ['listed:1.0.0', 'unbuilt:1.0.0'], 'parents': ['ubuntu:18.04']}},
+                        'listed': {'1.0.0': {'children': [None], 'parents': ['base:1.0.0']}}}}
+
+
+@pytest.fixture
+def repository(tmp_path):
+    for context, content in list(DOCKERFILES.items()) + [('listed/1.0.0', "FROM scratch\n")]:
+        os.makedirs(str(tmp_path / context))
+        with open(str(tmp_path / context / "Dockerfile"), 'w') as dockerfile_file:
+            dockerfile_file.write(content)
+    return str(tmp_path)
+
+
+@pytest.mark.test_source_matches
+def test_source_matches():
+    assert affected.source_matches("install.sh", "install.sh") == True
+    assert affected.source_matches("config/tool.conf", "config") == True
+    assert affected.source_matches("lib/tool.py", "*.py") == False
+    assert affected.source_matches("tool.py", "*.py") == True
+    assert affected.source_matches("README.md", ".") == True
+    assert affected.source_matches("README.md", "install.sh") == False
+
+
+@pytest.mark.test_resolve_affected
+def test_resolve_affected(repository):
+    index = affected.AffectedIndex(repository, RELATIONS)
+    assert index.classify("./base/1.0.0/install.sh") == ('base:1.0.0', 'rebuild')
+    assert index.classify("base/1.0.0/config/tool.conf") == ('base:1.0.0', 'rebuild')
+    assert index.classify("base/1.0.0/unittest.yml") == ('base:1.0.0', 'retest')
+    assert index.classify("base/1.0.0/README.md") == (None, None)
+    assert index.classify("other/1.0.0/README.md") == ('other:1.0.0', 'rebuild')
+    assert index.classify("new/0.1.0/Dockerfile") == ('new:0.1.0', 'rebuild')
+    assert index.classify("scripts/functions.py") == (None, None)
+    # Descendants come from the FROM lines and the relations graph, leaving out images without a Dockerfile
+    rebuild, retest, reasons = index.resolve(["base/1.0.0/install.sh", "other/1.0.0/unittest.yml", "README.md"])
+    assert rebuild == ['base:1.0.0', 'child:1.0.0', 'grandchild:2.0.0', 'listed:1.0.0']
+    assert retest == ['base:1.0.0', 'child:1.0.0', 'grandchild:2.0.0', 'listed:1.0.0', 'other:1.0.0']
+    assert reasons['base:1.0.0'] == ["base/1.0.0/install.sh changed"]
+    assert reasons['grandchild:2.0.0'] == ["builds on base:1.0.0"]
+    rebuild, retest, reasons = affected.resolve(["child/1.0.0/main.py", "base/1.0.0/unittest.yml"], repository)
+    assert rebuild == ['child/1.0.0/Dockerfile', 'grandchild/2.0.0/Dockerfile']
+    assert retest == ['base/1.0.0/Dockerfile', 'child/1.0.0/Dockerfile', 'grandchild/2.0.0/Dockerfile']
+    assert affected.resolve("No changed paths found.", repository) == ([], [], {})
+    assert affected.changed_dockerfiles(["./child/1.0.0/Dockerfile", "base/1.0.0/install.sh", "scripts/Dockerfile"]) == [
+        'child/1.0.0/Dockerfile']
+    assert affected.changed_dockerfiles("No changed paths found.") == []
+    assert affected.changed_images(["base/1.0.0/install.sh", "child/1.0.0/unittest.yml", "other/1.0.0/Dockerfile"],
+                                   repository) == ['base/1.0.0/Dockerfile', 'other/1.0.0/Dockerfile']
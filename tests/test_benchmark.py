@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath('scripts/'))
+import benchmark
+import relations_io
+import relations_graph
+import build_planner
+
+
+@pytest.mark.test_generate_relations
+def test_generate_relations(tmp_path):
+    data = benchmark.generate_relations(10, fanout=2, depth=2, version_count=2)
+    assert sum(len(data['images'][tool]) for tool in data['images'] if tool != 'ubuntu') == 10
+    # Trees of three tools each: a root on ubuntu:18.04 and its two children
+    assert data['images']['tool00002']['1.1.0']['parents'] == ["tool00000:1.1.0"]
+    assert data['images']['tool00003']['1.0.0']['parents'] == ["ubuntu:18.04"]
+    assert data['images']['tool00000']['1.0.0']['children'] == ["tool00001:1.0.0", "tool00002:1.0.0"]
+    assert data['images']['tool00004']['1.0.0']['children'] == [None]
+    relations_path, dockerfile_paths = benchmark.write_catalog(str(tmp_path), data)
+    assert relations_io.load_yaml(relations_path, sidecar=False) == data
+    assert len(dockerfile_paths) == 10
+    assert build_planner.dockerfile_parents(str(tmp_path / "tool00001" / "1.1.0" / "Dockerfile")) == ["tool00000:1.1.0"]
+    graph = relations_graph.RelationsGraph(data)
+    assert sorted(graph.get_children('ubuntu', '18.04')) == ["tool00000:1.0.0", "tool00000:1.1.0",
+                                                             "tool00003:1.0.0", "tool00003:1.1.0"]
+
+
+@pytest.mark.test_benchmark_catalog
+def test_benchmark_catalog(monkeypatch):
+    monkeypatch.delenv('AUTODOCKER_CACHE_DIR', raising=False)
+    cwd = os.getcwd()
+    results = benchmark.benchmark_catalog(20, fanout=2, depth=3, version_count=2, repeat=2)
+    assert os.getcwd() == cwd
+    assert 'AUTODOCKER_CACHE_DIR' not in os.environ
+    operations = [result['operation'] for result in results]
+    assert "yaml.load" in operations and "relations.update" in operations and "build.plan" in operations
+    assert all(result['min'] <= result['median'] <= max(result['mean'], result['median']) for result in results)
+    slower = [dict(result, min=result['min'] * 2 + 0.001) for result in results]
+    rows = benchmark.compare(results, slower, threshold=1.5)
+    assert all(row['regression'] for row in rows if row['old'])
+    assert not any(row['regression'] for row in benchmark.compare(slower, results))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath('scripts/'))
+import build_cost
+import dockerfile
+
+CLEAN = """FROM ubuntu:18.04
+COPY requirements.txt /app/
+RUN apt-get update && apt-get install -y --no-install-recommends python3-pip && rm -rf /var/lib/apt/lists/* && \\
+    pip3 install --no-cache-dir -r /app/requirements.txt
+COPY . /app
+"""
+
+COSTLY = """FROM ubuntu:18.04 AS builder
+COPY . /app
+RUN apt-get update -y
+RUN apt-get install -y make && pip install -r /app/requirements.txt
+ADD https://example.com/tool.tar.gz /tmp/
+FROM builder
+RUN apt-get upgrade -y && apt-get dist-upgrade -y && apt-get upgrade -y
+ENV LANG=C.UTF-8
+RUN while parallel --citation; do echo "will cite"; done
+"""
+
+
+@pytest.mark.test_analyze
+def test_analyze():
+    assert build_cost.analyze(dockerfile.parse(CLEAN)) == []
+    findings = build_cost.analyze(dockerfile.parse(COSTLY))
+    assert [(found.rule, found.line) for found in findings] == [
+        ('apt_lists_kept', 4), ('apt_recommends', 4), ('apt_update_split', 4), ('consecutive_run', 4),
+        ('context_before_install', 4), ('pip_cache_kept', 4), ('remote_add', 5), ('repeated_upgrade', 7), ('unbounded_loop', 9)]
+    assert findings[2].message.startswith("apt-get install runs in a separate RUN from the apt-get update on line 3")
+    # The second and third upgrades are wasted
+    assert findings[7].cost == 2 * build_cost.RULES['repeated_upgrade'][0]
+    assert build_cost.total_cost(findings) == sum(found.cost for found in findings)
+
+
+@pytest.mark.test_cost_gate
+def test_cost_gate(tmp_path, monkeypatch, capfd):
+    dockerfile_path = str(tmp_path / "Dockerfile")
+    with open(dockerfile_path, 'w') as dockerfile_file:
+        dockerfile_file.write(COSTLY)
+    monkeypatch.delenv(build_cost.GATE_ENV, raising=False)
+    assert build_cost.get_gate() is None
+    assert build_cost.check([dockerfile_path], build_cost.get_gate()) == True
+    out, err = capfd.readouterr()
+    assert "{}: 9 findings".format(dockerfile_path) in out
+    monkeypatch.setenv(build_cost.GATE_ENV, "60")
+    assert build_cost.check([dockerfile_path], build_cost.get_gate()) == False
+    out, err = capfd.readouterr()
+    assert "over the gate of 60.0s" in out
+    assert build_cost.check([dockerfile_path], build_cost.get_gate("10000")) == True
+    monkeypatch.setenv(build_cost.GATE_ENV, "soon")
+    with pytest.raises(SystemExit):
+        build_cost.get_gate()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import threading
+import time
+import pytest
+sys.path.append(os.path.abspath("scripts/"))
+import build_planner
+
+test_relations = {'images': {'base': {'1.0.0': {'children': ['child:1.0.0'], 'parents': ['ubuntu:18.04']}},
+                             'child': {'1.0.0': {'children': [None], 'parents': ['base:1.0.0']}},
+                             'ubuntu': {'18.04': {'children': ['base:1.0.0'], 'parents': []}}},
+                  'latest': {'base': '1.0.0', 'child': '1.0.0'}, 'terminated': {}}
+
+
+@pytest.mark.test_image_from_path
+def test_image_from_path():
+    assert build_planner.image_from_path(
+        'base/1.0.0/Dockerfile') == 'base:1.0.0'
+
+
+@pytest.mark.test_dockerfile_parents
+def test_dockerfile_parents():
+    assert build_planner.dockerfile_parents(
+        'tests/1.0.0/Test_Dockerfile') == ['ubuntu:18.04']
+    assert build_planner.dockerfile_parents('missing/1.0.0/Dockerfile') == []
+
+
+@pytest.mark.test_dockerfile_base_images
+def test_dockerfile_base_images(tmp_path):
+    dockerfile_path = str(tmp_path / "Dockerfile")
+    with open(dockerfile_path, 'w') as dockerfile:
+        dockerfile.write("ARG BASE=ubuntu:18.04\nFROM --platform=linux/amd64 test_org/base:1.0.0 AS builder\n"
+                         "RUN make\nFROM builder AS tested\nFROM ${BASE}\nFROM scratch\nfrom ubuntu:18.04\n")
+    assert build_planner.dockerfile_base_images(dockerfile_path) == ['test_org/base:1.0.0', 'ubuntu:18.04']
+    assert build_planner.dockerfile_base_images('missing/1.0.0/Dockerfile') == []
+
+
+@pytest.mark.test_plan_builds
+def test_plan_builds():
+    plan = build_planner.plan_builds(
+        ['child/1.0.0/Dockerfile', 'other/1.0.0/Dockerfile', 'base/1.0.0/Dockerfile'], test_relations)
+    assert list(plan) == ['base:1.0.0', 'other:1.0.0', 'child:1.0.0']
+    assert plan['child:1.0.0']['depends'] == {'base:1.0.0'}
+    assert plan['base:1.0.0']['depends'] == set()
+
+
+@pytest.mark.test_topological_order
+def test_topological_order():
+    with pytest.raises(SystemExit):
+        build_planner.topological_order({'a:1': {'path': 'a/1/Dockerfile', 'depends': {'b:1'}},
+                                         'b:1': {'path': 'b/1/Dockerfile', 'depends': {'a:1'}}})
+
+
+@pytest.mark.test_run_plan
+def test_run_plan():
+    plan = {'base:1.0.0': {'path': 'base/1.0.0/Dockerfile', 'depends': set()},
+            'other:1.0.0': {'path': 'other/1.0.0/Dockerfile', 'depends': set()},
+            'child:1.0.0': {'path': 'child/1.0.0/Dockerfile', 'depends': {'base:1.0.0'}}}
+    started = []
+    active = []
+    overlap = []
+    lock = threading.Lock()
+
+    def task(path):
+        with lock:
+            started.append(path)
+            active.append(path)
+            overlap.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(path)
+        return True
+    results = build_planner.run_plan(plan, task, 2)
+    assert results == {'base:1.0.0': True,
+                       'other:1.0.0': True, 'child:1.0.0': True}
+    assert started.index('child/1.0.0/Dockerfile') > started.index(
+        'base/1.0.0/Dockerfile')
+    assert max(overlap) == 2
+
+
+@pytest.mark.test_run_plan_failure
+def test_run_plan_failure():
+    plan = {'base:1.0.0': {'path': 'base/1.0.0/Dockerfile', 'depends': set()},
+            'other:1.0.0': {'path': 'other/1.0.0/Dockerfile', 'depends': set()},
+            'child:1.0.0': {'path': 'child/1.0.0/Dockerfile', 'depends': {'base:1.0.0'}}}
+    results = build_planner.run_plan(
+        plan, lambda path: not path.startswith('base'), 2)
+    assert results == {'base:1.0.0': False,
+                       'other:1.0.0': True, 'child:1.0.0': None}
+
+
+@pytest.mark.test_critical_paths
+def test_critical_paths():
+    plan = {'base:1.0.0': {'path': 'base/1.0.0/Dockerfile', 'depends': set()},
+            'other:1.0.0': {'path': 'other/1.0.0/Dockerfile', 'depends': set()},
+            'child:1.0.0': {'path': 'child/1.0.0/Dockerfile', 'depends': {'base:1.0.0'}}}
+    priority = build_planner.critical_paths(plan, {'base:1.0.0': 10, 'other:1.0.0': 20, 'child:1.0.0': 15})
+    assert priority == {'base:1.0.0': 25, 'other:1.0.0': 20, 'child:1.0.0': 15}
+    started = []
+    build_planner.run_plan(plan, lambda path: started.append(path) or True, 1, priority)
+    assert started == ['base/1.0.0/Dockerfile', 'other/1.0.0/Dockerfile', 'child/1.0.0/Dockerfile']
+    started = []
+    build_planner.run_plan(plan, lambda path: started.append(path) or True, 1, {'other:1.0.0': 1})
+    assert started[0] == 'other/1.0.0/Dockerfile'
+    # child becomes ready after other, but starts first as its priority is higher
+    priority = build_planner.critical_paths(plan, {'base:1.0.0': 3, 'other:1.0.0': 20, 'child:1.0.0': 22})
+    started = []
+    build_planner.run_plan(plan, lambda path: started.append(path) or True, 1, priority)
+    assert started == ['base/1.0.0/Dockerfile', 'child/1.0.0/Dockerfile', 'other/1.0.0/Dockerfile']
@@ -3,6 +3,7 @@
 
 import sys
 import os
+import time
 import pytest
 import yaml
 from io import StringIO
@@ -57,3 +58,58 @@ def test_find_and_run_tests():
     test_out = ci_image.find_and_run_tests(os.environ['DOCKERHUB_ORG'], [
                                            'tests/1.0.0/Test_Dockerfile'])
     assert test_out == True
+
+
+@pytest.mark.test_run_batched_commands
+def test_run_batched_commands():
+    test_out = ci_image.run_batched_commands(
+        'bicf/base:1.0.0', ['pwd', 'parallel --version | head -n1'], workdir='/data')
+    assert test_out == ['/data\n', 'GNU parallel 20161222\n']
+
+
+@pytest.mark.test_get_test_specs
+def test_get_test_specs(tmp_path, monkeypatch):
+    monkeypatch.setenv('TEST_TIMEOUT', '30')
+    unittest_path = tmp_path / "unittest.yml"
+    unittest_path.write_text(yaml.safe_dump({'commands': [
+        {'cmd': "tool --version", 'expect_text': "tool 1.0\n", 'timeout': 5},
+        {'cmd': "tool --help", 'expect_text': "usage"}]}))
+    assert ci_image.get_test_specs(str(unittest_path)) == [
+        {'cmd': "tool --version", 'expect_text': "tool 1.0\n", 'timeout': 5},
+        {'cmd': "tool --help", 'expect_text': "usage", 'timeout': 30}]
+    assert ci_image.get_test_list(str(unittest_path)) == [
+        ("tool --version", "tool 1.0\n"), ("tool --help", "usage")]
+    unittest_path.write_text(yaml.safe_dump({'commands': [
+        {'cmd': "tool --version", 'expect_text': "tool", 'timeout': "soon"}]}))
+    with pytest.raises(SystemExit):
+        ci_image.get_test_specs(str(unittest_path))
+
+
+@pytest.mark.test_command_output
+def test_command_output():
+    output = ci_image.CommandOutput("GNU parallel [0-9]+\n", limit=64)
+    assert output.write(b"GNU par") == True
+    assert output.write(b"allel 20161222\nCopyright") == False
+    assert output.matched and not output.truncated
+    # A pattern anchored at the end can still change with more output, so it is read to the end
+    output = ci_image.CommandOutput("GNU parallel 20161222\n$", limit=64)
+    assert output.write(b"GNU parallel 20161222\n") == True
+    output = ci_image.CommandOutput(None, limit=8)
+    assert output.write(b"12345") == True
+    assert output.write(b"67890") == False
+    assert output.truncated and output.text == "12345678"
+
+
+@pytest.mark.test_stream_bash_cmd
+def test_stream_bash_cmd():
+    output = ci_image.CommandOutput("y\ny\n")
+    started = time.monotonic()
+    assert ci_image.collect_output(ci_image.stream_bash_cmd("yes", timeout=30), output) == False
+    assert output.matched and not output.timed_out
+    output = ci_image.CommandOutput()
+    assert ci_image.collect_output(ci_image.stream_bash_cmd("echo started; sleep 30", timeout=0.5), output) == False
+    assert output.timed_out and output.text == "started\n"
+    assert time.monotonic() - started < 10
+    output = ci_image.CommandOutput()
+    assert ci_image.collect_output(ci_image.stream_bash_cmd("echo done", timeout=5), output) == True
+    assert output.text == "done\n"
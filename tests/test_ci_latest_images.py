@@ -2,6 +2,7 @@
 
 
 import sys
+import json
 import os
 import pytest
 import yaml
@@ -24,3 +25,102 @@ def test_pull_image(capfd):
     ci_latest_images.pull_image('bicf/base:1.0.0')
     test_err = capfd.readouterr()[1]
     assert not "ERROR: Unable to build bicf/base:1.0.0" in test_err
+
+
+@pytest.mark.test_get_image_name
+def test_get_image_name(monkeypatch):
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    assert ci_latest_images.get_image_name(
+        'bicf', 'tool', '1.0.0+1') == 'bicf/tool:1.0.0_1'
+    monkeypatch.setenv('DOCKERHUB_URL', 'registry.example.com')
+    assert ci_latest_images.get_image_name(
+        'bicf', 'tool', '1.0.0') == 'registry.example.com/bicf/tool:1.0.0'
+
+
+@pytest.mark.test_run_latest_images
+def test_run_latest_images(monkeypatch, capfd):
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    monkeypatch.setattr(ci_latest_images, 'try_pull_image',
+                        lambda image_name: 'nopull' not in image_name)
+    monkeypatch.setattr(ci_latest_images, 'run_image_tests',
+                        lambda owner, image, tag, capture, force: image != 'bad')
+    monkeypatch.setattr(ci_latest_images.result_cache, 'remote_image_id',
+                        lambda image_name: None)
+    results = ci_latest_images.run_latest_images(
+        'bicf', {'good': '1.0.0', 'bad': '1.0.0', 'nopull': '1.0.0'}, workers=2, prefetch=1)
+    assert results == {'bicf/good:1.0.0': 'passed',
+                       'bicf/bad:1.0.0': 'failed', 'bicf/nopull:1.0.0': 'pull failed'}
+    ci_latest_images.print_summary(results)
+    assert "Tested 3 images. Passed: 1. Failed: 2.\n" in capfd.readouterr()[0]
+
+
+@pytest.mark.test_validate_test_specs
+def test_validate_test_specs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('AUTODOCKER_CACHE_DIR', str(tmp_path / "cache"))
+    for image, expect_text in [('good', "good 1.0\n"), ('bad', "bad (1.0")]:
+        os.makedirs(os.path.join(image, "1.0.0"))
+        with open(os.path.join(image, "1.0.0", "unittest.yml"), 'w') as unittest_file:
+            yaml.safe_dump({'commands': [{'cmd': "{} --version".format(image), 'expect_text': expect_text}]},
+                           unittest_file)
+    valid, invalid = ci_latest_images.validate_test_specs(
+        {'good': "1.0.0", 'bad': "1.0.0", 'missing': "1.0.0"})
+    assert valid == {'good': "1.0.0"}
+    assert invalid == {'bad': "1.0.0", 'missing': "1.0.0"}
+
+
+@pytest.mark.test_shard_latest_images
+def test_shard_latest_images(tmp_path, monkeypatch):
+    monkeypatch.setenv('AUTODOCKER_TIMINGS_DB', str(tmp_path / "timings.sqlite"))
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    relations = {'images': {'ubuntu': {'18.04': {'parents': []}},
+                            'base': {'1.0.0': {'parents': ['ubuntu:18.04']}},
+                            'child': {'1.0.0': {'parents': ['base:1.0.0']}},
+                            'grandchild': {'1.0.0': {'parents': ['child:1.0.0']}}}}
+    latest = {'base': '1.0.0', 'child': '1.0.0', 'grandchild': '1.0.0', 'slow': '1.0.0', 'sized': '1.0.0', 'plain': '1.0.0'}
+    assert ci_latest_images.base_group(relations, 'grandchild:1.0.0') == 'base:1.0.0'
+    assert ci_latest_images.base_group(relations, 'slow:1.0.0') == 'slow:1.0.0'
+    ci_latest_images.timings.record([('slow', '1.0.0', 'pull', 200.0), ('slow', '1.0.0', 'test', 100.0)])
+    monkeypatch.setattr(ci_latest_images.registry_api, 'image_size',
+                        lambda image_name: 5 * 10**9 if 'sized' in image_name else None)
+    costs = ci_latest_images.image_costs('bicf', latest)
+    assert costs['slow'] == 300.0
+    assert costs['sized'] == 100.0 + ci_latest_images.timings.DEFAULT_ESTIMATES['test']
+    assert costs['plain'] == 120
+    shards, loads = ci_latest_images.shard_latest_images(latest, relations, 2, costs)
+    # The base image chain stays together, and every image is on exactly one shard
+    assert shards == [{'base': '1.0.0', 'child': '1.0.0', 'grandchild': '1.0.0', 'plain': '1.0.0'},
+                      {'slow': '1.0.0', 'sized': '1.0.0'}]
+    assert loads == [480.0, 460.0]
+    assert ci_latest_images.shard_latest_images(latest, relations, 2, costs) == (shards, loads)
+    # A group costing more than an even share is split up
+    shards, loads = ci_latest_images.shard_latest_images(latest, relations, 4, costs)
+    assert sorted(image for shard in shards for image in shard) == sorted(latest)
+    assert max(loads) == 300.0
+    # The plan is made once and read by every shard runner, so they agree even if their costs would differ
+    relations['latest'] = latest
+    plan_path = str(tmp_path / "shards.json")
+    with open(plan_path, 'w') as plan_file:
+        json.dump(ci_latest_images.plan_shards('bicf', relations, 2), plan_file)
+    assert ci_latest_images.read_shard_plan(plan_path, 2) == ([{'base': '1.0.0', 'child': '1.0.0', 'grandchild': '1.0.0', 'plain': '1.0.0'},
+                                                                {'slow': '1.0.0', 'sized': '1.0.0'}], [480.0, 460.0])
+    with pytest.raises(SystemExit):
+        ci_latest_images.read_shard_plan(plan_path, 3)
+    # Without a plan only relations.yaml is used
+    shards, loads = ci_latest_images.shard_latest_images(latest, relations, 2, ci_latest_images.default_costs(latest))
+    assert loads == [360.0, 360.0]
+
+
+@pytest.mark.test_merge_results
+def test_merge_results(tmp_path, monkeypatch):
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    relations = {'latest': {'good': '1.0.0', 'bad': '1.0.0', 'lost': '1.0.0'}}
+    ci_latest_images.write_results(str(tmp_path / "shard0.json"), 'bicf', {'bicf/good:1.0.0': 'passed'}, {'good': '1.0.0'}, 0, 3)
+    ci_latest_images.write_results(str(tmp_path / "shard1.json"), 'bicf', {'bicf/bad:1.0.0': 'failed'}, {'bad': '1.0.0'}, 1, 3)
+    results, problems = ci_latest_images.merge_results([str(tmp_path / "shard0.json"), str(tmp_path / "shard1.json")],
+                                                       relations)
+    assert results == {'bicf/good:1.0.0': 'passed', 'bicf/bad:1.0.0': 'failed', 'bicf/lost:1.0.0': 'not run'}
+    assert problems == ["No results for shards 2 of 3"]
+    monkeypatch.setattr(sys, 'argv', ['ci_latest_images.py', 'merge', str(tmp_path / "shard0.json")])
+    with pytest.raises(SystemExit):
+        ci_latest_images.main()
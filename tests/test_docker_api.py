@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import base64
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import socketserver
+import http.server
+import pytest
+sys.path.append(os.path.abspath('scripts/'))
+import docker_api
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def reply(self, status, body=b"", content_type="application/json", chunks=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if chunks is None:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def reply_json(self, status, data):
+        self.reply(status, json.dumps(data).encode())
+
+    def handle_request(self, method):
+        path, _, query = self.path.partition('?')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((method, path, query, body, dict(self.headers)))
+        if path == "/_ping":
+            self.reply(200, b"OK", "text/plain")
+        elif path == "/images/json":
+            self.reply_json(200, [{'Id': "sha256:abc"}])
+        elif path == "/images/test_org%2Fbase%3A1.0.0/json":
+            self.reply_json(200, {'Id': "sha256:abc", 'Config': {'Entrypoint': None}})
+        elif path.endswith("/json") and path.startswith("/images/"):
+            self.reply_json(404, {'message': "No such image"})
+        elif path == "/images/create":
+            messages = [{'status': "Pulling from test_org/base"},
+                        {'status': "Downloading", 'progressDetail': {'current': 1}}]
+            if "missing" in query:
+                messages.append({'error': "manifest unknown"})
+            self.reply(200, chunks=[json.dumps(message).encode() + b"\r\n" for message in messages])
+        elif path == "/build":
+            with tarfile.open(fileobj=io.BytesIO(body)) as context_tar:
+                self.server.build_files = sorted(context_tar.getnames())
+            self.reply(200, chunks=[b'{"stream": "sha256:def\\n"}\r\n'])
+        elif path == "/containers/create":
+            self.server.container_config = json.loads(body.decode())
+            self.reply_json(201, {'Id': "container1"})
+        elif path == "/containers/container1/start":
+            self.reply(204)
+        elif path == "/containers/container1/logs":
+            frames = [struct.pack('>BxxxL', 1, 6) + b"hello\n",
+                      struct.pack('>BxxxL', 1, 6) + b"world\n"]
+            self.reply(200, content_type="application/vnd.docker.multiplexed-stream", chunks=frames)
+        elif path == "/containers/container1/wait":
+            self.reply_json(200, {'StatusCode': 3})
+        elif path == "/containers/container1" and method == "DELETE":
+            self.reply(204)
+        elif path == "/containers/container1/exec":
+            self.reply_json(201, {'Id': "exec1"})
+        elif path == "/exec/exec1/start":
+            # The daemon hijacks the connection and closes it once the command exits
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.end_headers()
+            self.wfile.write(struct.pack('>BxxxL', 2, 4) + b"err\n")
+            self.wfile.write(struct.pack('>BxxxL', 1, 3) + b"ok\n")
+            self.close_connection = True
+        elif path == "/exec/exec2/start":
+            # A command that prints once and then hangs
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.end_headers()
+            self.wfile.write(struct.pack('>BxxxL', 1, 8) + b"started\n")
+            self.wfile.flush()
+            time.sleep(2)
+            self.close_connection = True
+        elif path == "/exec/exec1/json":
+            self.reply_json(200, {'ExitCode': 0})
+        else:
+            self.reply_json(500, {'message': "unexpected request {} {}".format(method, path)})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    socket_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(socket_dir, "docker.sock")
+    server = FakeDockerServer(socket_path, FakeDockerHandler)
+    server.connections = 0
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv('DOCKER_HOST', "unix://" + socket_path)
+    monkeypatch.delenv('DOCKER_API', raising=False)
+    monkeypatch.setattr(docker_api, 'CLIENTS', {})
+    yield server
+    server.shutdown()
+    server.server_close()
+    os.remove(socket_path)
+    os.rmdir(socket_dir)
+
+
+@pytest.mark.test_get_client
+def test_get_client(fake_docker, monkeypatch):
+    client = docker_api.get_client()
+    assert client is not None
+    assert docker_api.get_client() is client
+    monkeypatch.setenv('DOCKER_API', 'false')
+    assert docker_api.get_client() is None
+    monkeypatch.setenv('DOCKER_API', 'true')
+    monkeypatch.setenv('DOCKER_HOST', 'tcp://localhost:2375')
+    assert docker_api.get_client() is None
+    monkeypatch.setenv('DOCKER_HOST', 'unix:///no/such/docker.sock')
+    assert docker_api.get_client() is None
+
+
+@pytest.mark.test_docker_client_images
+def test_docker_client_images(fake_docker):
+    client = docker_api.get_client()
+    assert client.images({'label': ["key=value"]}) == [{'Id': "sha256:abc"}]
+    assert "filters=" in fake_docker.requests[-1][2]
+    assert client.inspect_image("test_org/base:1.0.0")['Id'] == "sha256:abc"
+    assert client.inspect_image("test_org/base:9.9.9") is None
+    messages = list(client.pull("test_org/base:1.0.0"))
+    assert messages[0] == {'status': "Pulling from test_org/base"}
+    assert "fromImage=test_org%2Fbase&tag=1.0.0" in fake_docker.requests[-1][2]
+    with pytest.raises(docker_api.DockerError) as error:
+        list(client.pull("test_org/missing:1.0.0"))
+    assert error.value.message == "manifest unknown"
+    # Every request so far went over the one pooled keep-alive connection
+    assert fake_docker.connections == 1
+
+
+@pytest.mark.test_docker_client_build
+def test_docker_client_build(fake_docker, tmp_path):
+    os.makedirs(str(tmp_path / "files"))
+    (tmp_path / "Dockerfile").write_text("FROM ubuntu:18.04\n")
+    (tmp_path / "files" / "script.sh").write_text("echo hello\n")
+    client = docker_api.get_client()
+    output = list(client.build(str(tmp_path), "test_org/base:1.0.0",
+                               labels={'org.autodocker.content-hash': "abc"}, quiet=True))
+    assert output == [{'stream': "sha256:def\n"}]
+    assert fake_docker.build_files == [".", "./Dockerfile", "./files", "./files/script.sh"]
+    assert "t=test_org%2Fbase%3A1.0.0" in fake_docker.requests[-1][2]
+    assert "q=1" in fake_docker.requests[-1][2]
+    assert 'X-Registry-Config' not in fake_docker.requests[-1][4]
+    # .dockerignore is honoured as by the docker CLI, while the Dockerfile and .dockerignore themselves are always sent
+    os.makedirs(str(tmp_path / "cache" / "nested"))
+    (tmp_path / ".dockerignore").write_text("# build leftovers\n**/*.log\ncache\n!cache/keep.txt\n/Dockerfile\n")
+    (tmp_path / "files" / "debug.log").write_text("noise\n")
+    (tmp_path / "cache" / "keep.txt").write_text("kept\n")
+    (tmp_path / "cache" / "nested" / "data").write_text("dropped\n")
+    config = base64.urlsafe_b64encode(json.dumps({'registry.example.com': {'username': "ci"}}).encode()).decode()
+    list(client.build(str(tmp_path), "test_org/base:1.0.0", quiet=True, registry_config=config))
+    assert fake_docker.build_files == [".", "./.dockerignore", "./Dockerfile", "./cache/keep.txt", "./files",
+                                       "./files/script.sh"]
+    assert fake_docker.requests[-1][4]['X-Registry-Config'] == config
+
+
+@pytest.mark.test_dockerignore
+def test_dockerignore():
+    patterns = [(docker_api.ignore_pattern(pattern), not exception) for pattern, exception in [
+        ("docs", False), ("**/*.tmp", False), ("src/*/build", False), ("src/[!a]*", False), ("docs/README.md", True)]]
+    assert docker_api.is_ignored("docs/guide/index.md", patterns) == True
+    assert docker_api.is_ignored("docs/README.md", patterns) == False
+    assert docker_api.is_ignored("a.tmp", patterns) == True
+    assert docker_api.is_ignored("deep/down/a.tmp", patterns) == True
+    assert docker_api.is_ignored("src/app/build/out.o", patterns) == True
+    assert docker_api.is_ignored("src/app/deep/build", patterns) == False
+    assert docker_api.is_ignored("src/bin", patterns) == True
+    assert docker_api.is_ignored("src/app", patterns) == False
+
+
+@pytest.mark.test_docker_client_containers
+def test_docker_client_containers(fake_docker):
+    client = docker_api.get_client()
+    assert client.run("test_org/base:1.0.0", ["echo", "hello world"], workdir="/data") == (3, "hello\nworld\n")
+    assert fake_docker.container_config['Cmd'] == ["echo", "hello world"]
+    assert fake_docker.container_config['WorkingDir'] == "/data"
+    assert [request[:2] for request in fake_docker.requests[-5:]] == [
+        ("POST", "/containers/create"), ("POST", "/containers/container1/start"),
+        ("GET", "/containers/container1/logs"), ("POST", "/containers/container1/wait"),
+        ("DELETE", "/containers/container1")]
+    assert client.exec_run("container1", ["echo", "ok"]) == (0, "ok\n")
+    assert client.exec_run("container1", ["echo", "ok"]) == (0, "ok\n")
+    output = []
+    started = time.monotonic()
+    with pytest.raises(docker_api.DockerTimeout):
+        for data in client.exec_output("exec2", timeout=0.3):
+            output.append(data)
+    assert output == [b"started\n"]
+    assert time.monotonic() - started < 1.5
+
+
+@pytest.mark.test_registry_auth
+def test_registry_auth(monkeypatch, tmp_path):
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    monkeypatch.setenv('DOCKERHUB_UN', 'user')
+    monkeypatch.setenv('DOCKERHUB_PW', 'secret')
+    auth = json.loads(base64.urlsafe_b64decode(docker_api.registry_auth()))
+    assert auth == {'username': 'user', 'password': 'secret',
+                    'serveraddress': "https://index.docker.io/v1/"}
+    monkeypatch.delenv('DOCKERHUB_UN')
+    monkeypatch.setenv('DOCKER_CONFIG', str(tmp_path))
+    assert docker_api.registry_auth() is None
+    (tmp_path / "config.json").write_text(json.dumps({'auths': {'registry.example.com:5000': {
+        'auth': base64.b64encode(b"ci:token").decode()}}}))
+    monkeypatch.setenv('DOCKERHUB_URL', 'registry.example.com:5000')
+    auth = json.loads(base64.urlsafe_b64decode(docker_api.registry_auth()))
+    assert auth['username'] == 'ci' and auth['serveraddress'] == 'registry.example.com:5000'
+    (tmp_path / "config.json").write_text(json.dumps({'auths': {
+        'registry.example.com:5000': {'auth': base64.b64encode(b"ci:token").decode()},
+        'ghcr.io': {'auth': base64.b64encode(b"bot:pat").decode()}}}))
+    config = json.loads(base64.urlsafe_b64decode(docker_api.registry_config()))
+    assert config == {'registry.example.com:5000': {'username': 'ci', 'password': 'token'},
+                      'ghcr.io': {'username': 'bot', 'password': 'pat'}}
+    assert docker_api.uses_credential_helpers() == False
+    (tmp_path / "config.json").write_text(json.dumps({'credsStore': "desktop"}))
+    assert docker_api.registry_config() is None
+    assert docker_api.uses_credential_helpers() == True
+    assert docker_api.split_tag("registry.example.com:5000/org/base:1.0.0") == (
+        "registry.example.com:5000/org/base", "1.0.0")
+    assert docker_api.split_tag("registry.example.com:5000/org/base") == (
+        "registry.example.com:5000/org/base", "latest")
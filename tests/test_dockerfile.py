@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath('scripts/'))
+import dockerfile
+
+MULTI_STAGE = """# escape=\\
+ARG REGISTRY=registry.example.com:5000
+ARG VERSION
+FROM --platform=linux/amd64 ${REGISTRY}/test_org/base:1.0.0 AS Builder
+# A comment between instructions
+RUN apt-get update && \\
+    # a comment inside a continuation
+    apt-get install -y make
+ARG TOOLS=tools:2.0.0
+COPY --from=${TOOLS} /bin/tool /bin/tool
+FROM builder AS tested
+RUN --mount=type=bind,from=helper:1.0.0,target=/helper make test
+COPY <<EOF /etc/config
+FROM ignored:1.0.0
+EOF
+FROM ubuntu:${VERSION:-18.04}
+COPY --from=0 /out /out
+COPY --from=tested /out /out
+FROM scratch
+"""
+
+
+@pytest.mark.test_split_reference
+def test_split_reference():
+    assert dockerfile.split_reference("ubuntu") == (None, "ubuntu", None, None)
+    assert dockerfile.split_reference("test_org/base:1.0.0") == (None, "test_org/base", "1.0.0", None)
+    assert dockerfile.split_reference("registry.example.com:5000/org/base:1.0.0") == (
+        "registry.example.com:5000", "org/base", "1.0.0", None)
+    assert dockerfile.split_reference("localhost/base@sha256:abc") == ("localhost", "base", None, "sha256:abc")
+    assert dockerfile.parent_name("registry.example.com:5000/org/base:1.0.0") == "base:1.0.0"
+    assert dockerfile.parent_name("ubuntu") == "ubuntu:latest"
+    assert dockerfile.parent_name("org/base@sha256:abc") == "base@sha256:abc"
+
+
+@pytest.mark.test_parse_dockerfile
+def test_parse_dockerfile():
+    parsed = dockerfile.parse(MULTI_STAGE)
+    assert [instruction.keyword for instruction in parsed.instructions] == [
+        'ARG', 'ARG', 'FROM', 'RUN', 'ARG', 'COPY', 'FROM', 'RUN', 'COPY', 'FROM', 'COPY', 'COPY', 'FROM']
+    assert parsed.instructions[3].args == "apt-get update &&     apt-get install -y make"
+    assert parsed.instructions[3].line == 6
+    assert [(stage.name, stage.image, stage.base_stage) for stage in parsed.stages] == [
+        ('builder', 'registry.example.com:5000/test_org/base:1.0.0', None), ('tested', 'builder', 0),
+        (None, 'ubuntu:18.04', None), (None, 'scratch', None)]
+    assert parsed.stages[0].platform == "linux/amd64"
+    assert parsed.base_images() == ['registry.example.com:5000/test_org/base:1.0.0', 'tools:2.0.0', 'helper:1.0.0',
+                                    'ubuntu:18.04']
+    assert parsed.parents() == ['base:1.0.0', 'tools:2.0.0', 'helper:1.0.0', 'ubuntu:18.04']
+    assert parsed.errors == ()
+    # Identical content is parsed once, while build arguments give a separate result
+    assert dockerfile.parse(MULTI_STAGE.encode()) is parsed
+    assert dockerfile.parse(MULTI_STAGE, {'VERSION': '20.04'}).parents()[-1] == 'ubuntu:20.04'
+
+
+@pytest.mark.test_dockerfile_errors
+def test_dockerfile_errors():
+    parsed = dockerfile.parse("RUN make\nFROM ${BASE}\nCOPY --from=3 /a /a\nFROB x\n")
+    assert parsed.errors == ("line 1: RUN comes before the first FROM",
+                             "line 2: FROM ${BASE} uses build arguments without a value: BASE",
+                             "line 3: COPY --from=3 does not name an earlier stage",
+                             "line 4: unknown instruction FROB")
+    assert dockerfile.parse("# Only a comment\n").errors == ("no FROM instruction",)
+    # A continuation that only joins whitespace is reported instead of stopping the parse
+    parsed = dockerfile.parse("FROM ubuntu:18.04\nRUN make\n  \\\n   \n")
+    assert parsed.errors == ("line 3: continuation with no instruction",)
+    assert [instruction.keyword for instruction in parsed.instructions] == ['FROM', 'RUN']
+
+
+@pytest.mark.test_dockerfile_paths
+def test_dockerfile_paths():
+    assert dockerfile.is_image_dockerfile("base/1.0.0/Dockerfile") == True
+    assert dockerfile.is_image_dockerfile("tests/1.0.0/Test_Dockerfile") == False
+    assert dockerfile.is_image_dockerfile("docs/dockerfile-guide.md") == False
+    assert dockerfile.is_image_dockerfile("base/1.0.0/extra/Dockerfile") == False
+    assert dockerfile.parents("tests/1.0.0/Test_Dockerfile") == ['ubuntu:18.04']
+    assert dockerfile.parents("missing/1.0.0/Dockerfile") == []
@@ -3,10 +3,12 @@
 
 import sys
 import os
+import time
 import pytest
 from io import StringIO
 sys.path.append(os.path.abspath('scripts/'))
 import functions
+import build_planner
 
 test_output_path = os.path.dirname(os.path.abspath(__file__)) + '/../'
 no_image = True
@@ -143,7 +145,10 @@ def test_check_dockerfile_count(capfd):
     assert temp_var == test_vars[4]
     temp_var = functions.check_dockerfile_count([test_vars[4], test_vars[5]])
     test_out, test_err = capfd.readouterr()
-    assert "ERROR: System is currently only setup to handle one Dockerfile changed or added at a time.\n        Currently, you have 2 Dockerfile changes posted\n" in test_err
+    assert "2 Dockerfiles found, building in order: " in test_err
+    assert sorted(temp_var.split(" ")) == sorted([test_vars[4], test_vars[5]])
+    temp_var = functions.check_dockerfile_count(["README.md"])
+    assert temp_var == '0'
 
 
 @pytest.mark.test_check_test_image
@@ -162,3 +167,244 @@ def test_pytest_cleanup(capfd):
     test_out, test_err = capfd.readouterr()
     assert test_out == "Successfully untagged and removed the image {}:{}\nSuccessfully removed both the temporary testing image directory {}\n".format(
         tool_name, tool_version, tool_name)
+
+
+@pytest.mark.test_run_pipeline
+def test_run_pipeline(tmp_path, monkeypatch):
+    output_path = str(tmp_path / "github_output")
+    monkeypatch.setenv('GITHUB_OUTPUT', output_path)
+    context = functions.PipelineContext()
+    context.values['changed_paths'] = [
+        'README.md', 'test_tool/1.0.0/Dockerfile']
+    context.values['compare_range'] = 'origin/test_branch HEAD'
+    assert functions.run_pipeline(
+        ['check_dockerfile_count', 'check_test', 'push_images'], context) == True
+    assert context.outputs == {
+        'docker_file': 'test_tool/1.0.0/Dockerfile', 'build': 'true', 'changed_docker_file': 'test_tool/1.0.0/Dockerfile',
+        'is_test': True}
+    with open(output_path) as output_file:
+        assert output_file.read() == ("docker_file=test_tool/1.0.0/Dockerfile\nbuild=true\n"
+                                      "changed_docker_file=test_tool/1.0.0/Dockerfile\nis_test=True\n")
+    assert functions.run_pipeline(['not_a_stage'], context) == False
+
+
+@pytest.fixture
+def released_repository(tmp_path, monkeypatch):
+    master_relations = os.path.abspath('tests/relations.yaml')
+    for context, content in [('base/1.0.0', "FROM ubuntu:18.04\nCOPY install.sh /tmp/\nRUN sh /tmp/install.sh\n"),
+                             ('child/1.0.0', "FROM test_org/base:1.0.0\n"),
+                             ('new_tool/1.0.0', "FROM test_org/base:1.0.0\n")]:
+        os.makedirs(str(tmp_path / context))
+        (tmp_path / context / "Dockerfile").write_text(content)
+    (tmp_path / "base" / "1.0.0" / "install.sh").write_text("apt-get install -y make\n")
+    monkeypatch.chdir(str(tmp_path))
+    return master_relations
+
+
+@pytest.mark.test_pipeline_validate_version
+def test_pipeline_validate_version(released_repository, capfd):
+    # A file copied into the released base:1.0.0 changing would rebuild a locked image
+    context = functions.PipelineContext(released_repository)
+    context.values['changed_paths'] = ['base/1.0.0/install.sh']
+    assert context.dockerfile_paths() == ['base/1.0.0/Dockerfile', 'child/1.0.0/Dockerfile', 'new_tool/1.0.0/Dockerfile']
+    assert functions.pipeline_validate_version(context) == False
+    test_out, test_err = capfd.readouterr()
+    assert "Files copied into base:1.0.0 changed, but this version is already released" in test_err
+    context = functions.PipelineContext(released_repository)
+    context.values['changed_paths'] = ['base/1.0.0/Dockerfile']
+    assert functions.pipeline_validate_version(context) == False
+    test_out, test_err = capfd.readouterr()
+    assert "duplicated image and version" in test_err
+    # A new image is validated on its own, without the released images it builds on
+    context = functions.PipelineContext(released_repository)
+    context.values['changed_paths'] = ['new_tool/1.0.0/Dockerfile']
+    assert functions.pipeline_validate_version(context) == True
+
+
+@pytest.mark.test_pipeline_push_images
+def test_pipeline_push_images(released_repository, monkeypatch):
+    pushed = []
+    monkeypatch.setattr(functions, 'push_single_image', lambda owner, path, relations: pushed.append(path) or True)
+    context = functions.PipelineContext(released_repository)
+    context.values['owner'] = 'test_org'
+    # Released images rebuilt through a copied file or a parent are built and tested, but never pushed over their tags
+    context.values['changed_paths'] = ['base/1.0.0/install.sh']
+    assert functions.pipeline_push_images(context) == True
+    assert pushed == []
+    context = functions.PipelineContext(released_repository)
+    context.values['owner'] = 'test_org'
+    context.values['changed_paths'] = ['new_tool/1.0.0/Dockerfile']
+    assert functions.pipeline_push_images(context) == True
+    assert pushed == ['new_tool/1.0.0/Dockerfile']
+    del pushed[:]
+    assert list(functions.push_images('test_org', ['base/1.0.0/install.sh'])) == []
+    assert pushed == []
+
+
+@pytest.mark.test_build_context_hash
+def test_build_context_hash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for version in ['1.0.0', '1.0.1']:
+        os.makedirs("hash_tool/{}/files".format(version))
+        with open("hash_tool/{}/Dockerfile".format(version), "w") as dockerfile:
+            dockerfile.write("FROM ubuntu:18.04\nCOPY files /files\n")
+        with open("hash_tool/{}/files/script.sh".format(version), "w") as script:
+            script.write("echo hello\n")
+    first_hash = functions.build_context_hash('hash_tool', '1.0.0')
+    assert first_hash == functions.build_context_hash('hash_tool', '1.0.1')
+    with open("hash_tool/1.0.1/files/script.sh", "a") as script:
+        script.write("echo again\n")
+    assert first_hash != functions.build_context_hash('hash_tool', '1.0.1')
+    assert "--label {}={} ".format(functions.CONTENT_HASH_LABEL, first_hash) in functions.build_docker_cmd(
+        "build", 'test_org', 'hash_tool', '1.0.0', {functions.CONTENT_HASH_LABEL: first_hash})
+
+
+@pytest.mark.test_reuse_existing_image
+def test_reuse_existing_image(monkeypatch, capfd):
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    monkeypatch.delenv('FORCE_REBUILD', raising=False)
+    commands = []
+    local_ids = {'abc': 'sha256:1234'}
+    remote_labels = {'test_org/hash_tool:1.0.0': 'abc',
+                     'test_org/hash_tool:1.0.1': 'def'}
+
+    class Completed:
+        def __init__(self, returncode, stdout=''):
+            self.returncode = returncode
+            self.stdout = stdout
+
+    def fake_run(cmd, **kwargs):
+        commands.append(cmd)
+        if cmd[:2] == ['docker', 'images']:
+            return Completed(0, local_ids.get(cmd[-1].split('=')[-1], ''))
+        if cmd[:3] == ['docker', 'buildx', 'imagetools']:
+            if cmd[4] not in remote_labels:
+                return Completed(1)
+            return Completed(0, '{{"{}": "{}"}}'.format(functions.CONTENT_HASH_LABEL, remote_labels[cmd[4]]))
+        if cmd[:2] == ['docker', 'image']:
+            return Completed(0, remote_labels.get(cmd[-1], ''))
+        return Completed(0)
+
+    monkeypatch.setattr(functions.subprocess, 'run', fake_run)
+    assert functions.reuse_existing_image(
+        'test_org', 'hash_tool', '1.0.0', 'abc') == True
+    assert commands[-1] == ['docker', 'tag',
+                            'sha256:1234', 'test_org/hash_tool:1.0.0']
+    test_out, test_err = capfd.readouterr()
+    assert "instead of rebuilding" in test_err
+    del commands[:]
+    assert functions.reuse_existing_image(
+        'test_org', 'hash_tool', '1.0.1', 'def') == True
+    assert ['docker', 'pull', 'test_org/hash_tool:1.0.1'] in commands
+    del commands[:]
+    assert functions.reuse_existing_image(
+        'test_org', 'hash_tool', '1.0.1', 'ghi') == False
+    assert ['docker', 'pull', 'test_org/hash_tool:1.0.1'] not in commands
+    monkeypatch.setenv('FORCE_REBUILD', 'true')
+    assert functions.reuse_existing_image(
+        'test_org', 'hash_tool', '1.0.0', 'abc') == False
+
+
+@pytest.mark.test_image_content_hash
+def test_image_content_hash(monkeypatch):
+    images = {'test_org/labelled:1.0.0': {'Config': {'Labels': {functions.CONTENT_HASH_LABEL: 'abc'}}},
+              'test_org/unlabelled:1.0.0': {'Config': {'Labels': None}},
+              'test_org/no_config:1.0.0': {'Config': None}}
+
+    class Client:
+        def inspect_image(self, image_name):
+            return images.get(image_name)
+
+    monkeypatch.setattr(functions.docker_api, 'get_client', lambda: Client())
+    assert functions.image_content_hash('test_org/labelled:1.0.0') == 'abc'
+    assert functions.image_content_hash('test_org/unlabelled:1.0.0') is None
+    assert functions.image_content_hash('test_org/no_config:1.0.0') is None
+    assert functions.image_content_hash('test_org/missing:1.0.0') is None
+
+
+@pytest.mark.test_build_cache_args
+def test_build_cache_args(tmp_path, monkeypatch):
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    monkeypatch.delenv('BUILD_CACHE_REF', raising=False)
+    monkeypatch.setenv('BUILD_CACHE_DIR', str(tmp_path))
+    monkeypatch.delenv('BUILD_CACHE', raising=False)
+    assert functions.build_docker_cmd("build", 'test_org', 'base', '1.0.1').startswith(
+        'docker build -q -f "base/1.0.1/Dockerfile"')
+    monkeypatch.setenv('BUILD_CACHE', 'inline')
+    assert functions.build_docker_cmd("build", 'test_org', 'base', '1.0.1') == 'docker buildx build --progress plain --load ' \
+        '--cache-from type=registry,ref=test_org/base:latest --cache-to type=inline ' \
+        '-f "base/1.0.1/Dockerfile" -t "test_org/base:1.0.1" "base/1.0.1/"'
+    monkeypatch.setenv('BUILD_CACHE', 'registry')
+    monkeypatch.setenv('BUILD_CACHE_REF', 'cache.example.com/{owner}/cache:{tool}')
+    assert "--cache-to type=registry,ref=cache.example.com/test_org/cache:base,mode=max " in functions.build_docker_cmd(
+        "build", 'test_org', 'base', '1.0.1')
+    monkeypatch.setenv('BUILD_CACHE', 'local')
+    cache_dir = os.path.join(str(tmp_path), 'base')
+    assert "--cache-from type=local,src={} --cache-to type=local,dest={}-1.0.1.new,mode=max ".format(
+        cache_dir, cache_dir) in functions.build_docker_cmd("build", 'test_org', 'base', '1.0.1')
+    os.makedirs(cache_dir)
+    os.makedirs(cache_dir + "-1.0.1.new")
+    with open(os.path.join(cache_dir + "-1.0.1.new", "index.json"), "w") as index_file:
+        index_file.write("{}")
+    functions.rotate_build_cache('base', '1.0.1')
+    assert os.listdir(cache_dir) == ["index.json"]
+    assert not os.path.exists(cache_dir + "-1.0.1.new")
+    monkeypatch.setenv('BUILD_CACHE', 'bad_mode')
+    with pytest.raises(SystemExit):
+        functions.get_build_cache_mode()
+
+
+@pytest.mark.test_push_tags
+def test_push_tags(monkeypatch, capfd):
+    monkeypatch.delenv('DOCKERHUB_URL', raising=False)
+    relations = {'latest': {'push_tool': '1.0.1'}}
+    assert functions.image_tags('push_tool', '1.0.1', relations) == ['1.0.1', 'latest']
+    assert functions.image_tags('push_tool', '1.0.0', relations) == ['1.0.0']
+    assert functions.image_tags('push_tool', '1.0.0') == ['1.0.0']
+    tagged = []
+    pushed = []
+    monkeypatch.setattr(functions, 'ensure_local_image', lambda owner, tool, version: None)
+    monkeypatch.setattr(functions, 'tag_image', lambda image, image_name: tagged.append(image_name) or True)
+    monkeypatch.setattr(functions, 'local_image_info', lambda image_name: {
+        'Id': 'sha256:config1', 'RepoDigests': []})
+    monkeypatch.setattr(functions.registry_api, 'has_image',
+                        lambda image_name, image_id, repo_digests: image_name.endswith(':1.0.1'))
+    monkeypatch.setattr(functions, 'push_with_api', lambda owner, tool, tag: (True, pushed.append(tag) or True))
+    assert functions.push_single_image('test_org', 'push_tool/1.0.1/Dockerfile', relations) == True
+    assert tagged == ['test_org/push_tool:latest']
+    assert pushed == ['latest']
+    test_out, test_err = capfd.readouterr()
+    assert "test_org/push_tool:1.0.1 already has the same digest in the registry, skipping push." in test_err
+    assert "Successfully pushed new branch based on test_org/push_tool:1.0.1" in test_err
+
+
+@pytest.mark.test_prefetch_parents
+def test_prefetch_parents(tmp_path, monkeypatch, capfd):
+    monkeypatch.chdir(tmp_path)
+    for tool, base in [('child_tool', "test_org/base_tool:1.0.0"), ('base_tool', "ubuntu:18.04"),
+                       ('other_tool', "ubuntu:20.04")]:
+        os.makedirs(os.path.join(tool, "1.0.0"))
+        with open(os.path.join(tool, "1.0.0", "Dockerfile"), 'w') as dockerfile:
+            dockerfile.write("FROM {}\n".format(base))
+    pulled = []
+
+    def slow_pull(image_name):
+        time.sleep(0.2)
+        pulled.append(image_name)
+        return image_name != "ubuntu:20.04"
+    monkeypatch.setattr(functions, 'pull_reference', slow_pull)
+    monkeypatch.setattr(functions, 'reference_exists_locally', lambda image_name: False)
+    context = functions.PipelineContext()
+    context.values['dockerfile_paths'] = ['child_tool/1.0.0/Dockerfile',
+                                          'base_tool/1.0.0/Dockerfile', 'other_tool/1.0.0/Dockerfile']
+    context.values['plan'] = build_planner.plan_builds(context.values['dockerfile_paths'])
+    # base_tool is built in this run, so only the images it and other_tool start from are pulled
+    assert functions.prefetch_images(context.values['dockerfile_paths'], context.values['plan']) == [
+        "ubuntu:18.04", "ubuntu:20.04"]
+    assert functions.run_pipeline(['prefetch_parents'], context) == True
+    time.sleep(0.5)
+    assert sorted(pulled) == ["ubuntu:18.04", "ubuntu:20.04"]
+    assert context.values['prefetch'].join() > 0
+    test_out, test_err = capfd.readouterr()
+    assert "Unable to prefetch ubuntu:20.04" in test_err
+    assert "Prefetched 1 of 2 parent images" in test_err
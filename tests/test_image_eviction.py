@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath("scripts/"))
+import image_eviction
+
+test_relations = {'images': {'base': {'1.0.0': {'children': ['child:1.0.0'], 'parents': ['ubuntu:18.04']}},
+                             'child': {'1.0.0': {'children': [None], 'parents': ['base:1.0.0']}},
+                             'other': {'1.0.0': {'children': [None], 'parents': ['ubuntu:18.04']}},
+                             'ubuntu': {'18.04': {'children': ['base:1.0.0', 'other:1.0.0'], 'parents': []}}},
+                  'latest': {'base': '1.0.0', 'child': '1.0.0', 'other': '1.0.0'}, 'terminated': {}}
+
+
+class FakeEvictionManager(image_eviction.ImageEvictionManager):
+    def __init__(self, sizes, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sizes = sizes
+        self.removed = []
+
+    def disk_usage(self):
+        return sum(self.sizes[image] for image in self.images)
+
+    def remove(self, image_name):
+        self.removed.append(image_name)
+
+
+@pytest.mark.test_parse_size
+def test_parse_size():
+    assert image_eviction.parse_size('1.5GB') == 1500000000
+    assert image_eviction.parse_size('512MiB') == 536870912
+    assert image_eviction.parse_size('0B') == 0
+    assert image_eviction.parse_size(42) == 42
+    with pytest.raises(SystemExit):
+        image_eviction.parse_size('lots')
+
+
+@pytest.mark.test_ancestors
+def test_ancestors():
+    assert image_eviction.ancestors(test_relations, 'child:1.0.0') == {
+        'base:1.0.0', 'ubuntu:18.04'}
+    assert image_eviction.ancestors(test_relations, 'missing:1.0.0') == set()
+
+
+@pytest.mark.test_evict
+def test_evict():
+    upcoming = ['bicf/other:1.0.0', 'bicf/base:1.0.0', 'bicf/child:1.0.0']
+    manager = FakeEvictionManager({'bicf/other:1.0.0': 4, 'bicf/base:1.0.0': 4, 'bicf/child:1.0.0': 4},
+                                  10, test_relations, upcoming)
+    manager.touch('bicf/other:1.0.0')
+    manager.touch('bicf/base:1.0.0')
+    manager.release('bicf/other:1.0.0')
+    assert manager.removed == []
+    manager.release('bicf/base:1.0.0')
+    manager.touch('bicf/child:1.0.0')
+    assert manager.evict() == ['bicf/other:1.0.0']
+    assert 'bicf/base:1.0.0' in manager.images
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+sys.path.append(os.path.abspath("scripts/"))
+import issue_sync
+
+
+class FakeGithubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.server.rate_limited:
+            self.server.rate_limited -= 1
+            self.send_json(403, {'message': 'rate limited'}, {
+                           'Retry-After': '0'})
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self.send_json(304, None)
+        else:
+            self.send_json(200, [{'title': title} for title in self.server.titles], {
+                           'ETag': '"v1"'})
+
+    def do_POST(self):
+        self.server.requests.append(('POST', self.path))
+        length = int(self.headers.get('Content-Length'))
+        issue = json.loads(self.rfile.read(length).decode('utf-8'))
+        self.server.titles.append(issue['title'])
+        self.send_json(201, issue)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_github():
+    server = HTTPServer(('127.0.0.1', 0), FakeGithubHandler)
+    server.titles = ['Update child:1.0.0 to child:1.0.1']
+    server.requests = []
+    server.rate_limited = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.test_rest_backend
+def test_rest_backend(fake_github, tmp_path):
+    api_url = "http://127.0.0.1:{}".format(fake_github.server_port)
+    etag_path = str(tmp_path / "etags.json")
+    backend = issue_sync.GithubRestBackend(
+        'token', 'org/repo', api_url, etag_path)
+    assert backend.list_open_issue_titles() == [
+        'Update child:1.0.0 to child:1.0.1']
+    assert backend.create_issue('Update other:1.0.0 to other:1.0.1', 'body')
+    backend = issue_sync.GithubRestBackend(
+        'token', 'org/repo', api_url, etag_path)
+    fake_github.rate_limited = 1
+    assert backend.list_open_issue_titles() == [
+        'Update child:1.0.0 to child:1.0.1']
+    assert fake_github.requests == [('GET', '/repos/org/repo/issues?state=open&per_page=100&page=1'),
+                                    ('POST', '/repos/org/repo/issues'),
+                                    ('GET', '/repos/org/repo/issues?state=open&per_page=100&page=1'),
+                                    ('GET', '/repos/org/repo/issues?state=open&per_page=100&page=1')]
+
+
+@pytest.mark.test_issue_sync
+def test_issue_sync():
+    backend = issue_sync.InMemoryBackend(['Update child:1.0.0 to child:1.0.1'])
+    issues = issue_sync.IssueSync(backend)
+    assert issues.queue('Update child:1.0.0 to child:1.0.1', 'body') == False
+    assert issues.queue('Update other:1.0.0 to other:1.0.1', 'body') == True
+    assert issues.queue('Update other:1.0.0 to other:1.0.1', 'body') == False
+    assert backend.created == []
+    assert issues.flush() == 1
+    assert backend.created == [('Update other:1.0.0 to other:1.0.1', 'body')]
+    assert backend.list_calls == 1
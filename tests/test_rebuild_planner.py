@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath("scripts/"))
+import rebuild_planner
+import relations_graph
+
+test_relations = {'images': {'base': {'1.0.0': {'children': ['child:1.0.0', 'other:2.1.3'], 'parents': ['ubuntu:18.04']}},
+                             'child': {'1.0.0': {'children': ['grandchild:1.2.0', 'stopped:1.0.0'], 'parents': ['base:1.0.0']}},
+                             'other': {'2.1.3': {'children': ['grandchild:1.2.0'], 'parents': ['base:1.0.0']}},
+                             'grandchild': {'1.2.0': {'children': [None], 'parents': ['child:1.0.0', 'other:2.1.3']}},
+                             'stopped': {'1.0.0': {'children': ['orphan:1.0.0'], 'parents': ['child:1.0.0']}},
+                             'orphan': {'1.0.0': {'children': [None], 'parents': ['stopped:1.0.0']}}},
+                  'latest': {'base': '1.0.0'}, 'terminated': ['stopped']}
+
+
+@pytest.mark.test_bump_version
+def test_bump_version():
+    assert rebuild_planner.bump_version('1.2.3', 'major') == '2.0.0'
+    assert rebuild_planner.bump_version('1.2.3', 'minor') == '1.3.0'
+    assert rebuild_planner.bump_version('1.2.3', 'patch') == '1.2.4'
+
+
+@pytest.mark.test_infer_update_type
+def test_infer_update_type():
+    assert rebuild_planner.infer_update_type('1.0.0', '2.0.0') == 'major'
+    assert rebuild_planner.infer_update_type('1.0.0', '1.1.0') == 'minor'
+    assert rebuild_planner.infer_update_type('1.0.0', '1.0.1') == 'patch'
+    assert rebuild_planner.infer_update_type('1.9.0', '1.10.0') == 'minor'
+    with pytest.raises(SystemExit):
+        rebuild_planner.infer_update_type('1.1.0', '1.0.5')
+
+
+@pytest.mark.test_plan_rebuilds
+def test_plan_rebuilds():
+    graph = relations_graph.RelationsGraph(test_relations)
+    waves = rebuild_planner.plan_rebuilds(
+        graph, 'base', '1.0.0', '1.0.1', 'patch')
+    assert waves == [[{'image': 'child', 'version': '1.0.0', 'new_version': '1.0.1', 'parents': ['base:1.0.1']},
+                      {'image': 'other', 'version': '2.1.3', 'new_version': '2.1.4', 'parents': ['base:1.0.1']}],
+                     [{'image': 'grandchild', 'version': '1.2.0', 'new_version': '1.2.1', 'parents': ['child:1.0.1', 'other:2.1.4']}]]
+
+
+@pytest.mark.test_apply_plan
+def test_apply_plan(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('child/1.0.0')
+    with open('child/1.0.0/Dockerfile', 'w') as dockerfile:
+        dockerfile.write("FROM bicf/base:1.0.0\nRUN echo base:1.0.0\n")
+    waves = [[{'image': 'child', 'version': '1.0.0',
+               'new_version': '1.0.1', 'parents': ['base:1.0.1']}]]
+    assert rebuild_planner.apply_plan(waves, 'base', '1.0.0', '1.0.1') == [
+        os.path.join('child', '1.0.1', 'Dockerfile')]
+    with open('child/1.0.1/Dockerfile') as dockerfile:
+        assert dockerfile.read() == "FROM bicf/base:1.0.1\nRUN echo base:1.0.0\n"
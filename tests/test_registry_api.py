@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import base64
+import threading
+import http.server
+import pytest
+sys.path.append(os.path.abspath('scripts/'))
+import registry_api
+
+MANIFESTS = {'org/base:1.0.0': ("sha256:manifest1", "sha256:config1"),
+             'org/base:latest': ("sha256:manifest1", "sha256:config1")}
+
+
+class FakeRegistryHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def handle_request(self):
+        self.server.requests.append((self.command, self.path))
+        if self.path.startswith("/token"):
+            expected = "Basic " + base64.b64encode(b"user:secret").decode()
+            if self.headers.get('Authorization') != expected:
+                self.reply(401)
+            else:
+                self.reply(200, json.dumps({'token': "token1"}).encode())
+            return
+        if self.headers.get('Authorization') != "Bearer token1":
+            self.reply(401, headers={'WWW-Authenticate': 'Bearer realm="http://{}/token",service="test"'.format(
+                self.headers['Host'])})
+            return
+        repository, _, tag = self.path[len("/v2/"):].partition("/manifests/")
+        if "{}:{}".format(repository, tag) not in MANIFESTS:
+            self.reply(404)
+            return
+        digest, config = MANIFESTS["{}:{}".format(repository, tag)]
+        self.reply(200, json.dumps({'config': {'digest': config}, 'layers': [{'size': 100}, {'size': 23}]}).encode(),
+                   {'Docker-Content-Digest': digest})
+
+    def do_HEAD(self):
+        self.handle_request()
+
+    def do_GET(self):
+        self.handle_request()
+
+
+@pytest.fixture
+def fake_registry(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeRegistryHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv('DOCKERHUB_UN', 'user')
+    monkeypatch.setenv('DOCKERHUB_PW', 'secret')
+    monkeypatch.setattr(registry_api, 'CLIENTS', {})
+    yield server, "127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.test_parse_reference
+def test_parse_reference():
+    assert registry_api.parse_reference("org/base:1.0.0") == (
+        registry_api.DOCKER_HUB, "org/base", "1.0.0")
+    assert registry_api.parse_reference("ubuntu") == (
+        registry_api.DOCKER_HUB, "library/ubuntu", "latest")
+    assert registry_api.parse_reference("docker.io/org/base:1.0.0") == (
+        registry_api.DOCKER_HUB, "org/base", "1.0.0")
+    assert registry_api.parse_reference("registry.example.com:5000/org/base:1.0.0") == (
+        "registry.example.com:5000", "org/base", "1.0.0")
+    assert registry_api.parse_reference("localhost/base") == (
+        "localhost", "base", "latest")
+
+
+@pytest.mark.test_registry_has_image
+def test_registry_has_image(fake_registry):
+    server, registry = fake_registry
+    image_name = "{}/org/base:1.0.0".format(registry)
+    assert registry_api.has_image(image_name, "sha256:other", [
+        "{}/org/base@sha256:manifest1".format(registry)]) == True
+    # The token is fetched once, and the manifest body is only requested when the repo digests do not match
+    assert [request[0] for request in server.requests] == ["HEAD", "GET", "HEAD"]
+    assert registry_api.has_image(image_name, "sha256:config1", []) == True
+    assert server.requests[-2:] == [("HEAD", "/v2/org/base/manifests/1.0.0"),
+                                    ("GET", "/v2/org/base/manifests/1.0.0")]
+    assert registry_api.has_image(image_name, "sha256:config2", []) == False
+    assert registry_api.has_image("{}/org/base:2.0.0".format(registry), "sha256:config1", []) == False
+    assert server.connections == 2
+    client = registry_api.get_client(registry)
+    assert client.manifest_digest("org/base", "latest") == "sha256:manifest1"
+    assert client.manifest("org/base", "9.9.9") is None
+
+
+@pytest.mark.test_image_size
+def test_image_size(fake_registry):
+    server, registry = fake_registry
+    assert registry_api.image_size("{}/org/base:1.0.0".format(registry)) == 123
+    assert registry_api.image_size("{}/org/base:2.0.0".format(registry)) is None
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+import yaml
+sys.path.append(os.path.abspath("scripts/"))
+import relations_graph
+
+
+def load_graph(path='tests/relations.yaml'):
+    with open(path) as yaml_file:
+        return relations_graph.RelationsGraph(yaml.safe_load(yaml_file))
+
+
+@pytest.mark.test_clean_entries
+def test_clean_entries():
+    assert relations_graph.clean_entries(['samtools1.11:1.0.1', ['fastqc0.11.9:1.0.1'], [['null']], [None], []]) == {
+        'samtools1.11:1.0.1', 'fastqc0.11.9:1.0.1'}
+    assert relations_graph.clean_entries(None) == set()
+
+
+@pytest.mark.test_graph_lookups
+def test_graph_lookups():
+    graph = load_graph()
+    assert graph.has_image('base')
+    assert graph.has_image('base', '1.0.0')
+    assert not graph.has_image('base', '1.0.1')
+    assert graph.versions('ubuntu') == ['18.04']
+    assert graph.get_children('ubuntu', '18.04') == {'base:1.0.0'}
+    assert graph.get_parents('base', '1.0.0') == {'ubuntu:18.04'}
+    assert graph.get_children('base', '1.0.0') == set()
+    assert graph.is_terminated('test_image2')
+    assert not graph.is_terminated('test_image')
+
+
+@pytest.mark.test_graph_round_trip
+def test_graph_round_trip():
+    with open('relations.yaml') as yaml_file:
+        original = yaml_file.read()
+    graph = relations_graph.RelationsGraph(yaml.safe_load(original))
+    assert graph.dump() == original
+
+
+@pytest.mark.test_graph_add_image
+def test_graph_add_image():
+    graph = load_graph()
+    graph.add_image('base', '1.0.1', ['ubuntu:18.04'], [])
+    graph.add_image('child', '1.0.0', ['base:1.0.1', 'alpine:3.12'], [None])
+    graph.set_latest('base', '1.0.1')
+    data = graph.to_data()
+    assert data['images']['base']['1.0.1'] == {
+        'children': ['child:1.0.0'], 'parents': ['ubuntu:18.04']}
+    assert data['images']['ubuntu']['18.04'] == {
+        'children': ['base:1.0.0', 'base:1.0.1'], 'parents': []}
+    assert data['images']['alpine']['3.12'] == {
+        'children': ['child:1.0.0'], 'parents': []}
+    assert data['images']['child']['1.0.0'] == {
+        'children': [None], 'parents': ['alpine:3.12', 'base:1.0.1']}
+    assert data['images']['base']['1.0.0'] == {
+        'children': [None], 'parents': ['ubuntu:18.04']}
+    assert data['latest']['base'] == '1.0.1'
+    assert graph.touched == set()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath("scripts/"))
+import relations_io
+
+
+@pytest.mark.test_load_yaml
+def test_load_yaml(tmp_path, monkeypatch):
+    monkeypatch.setenv('AUTODOCKER_CACHE_DIR', str(tmp_path / "cache"))
+    relations_io.PARSED.clear()
+    first = relations_io.load_yaml('tests/relations.yaml')
+    assert first == {'images': {'base': {'1.0.0': {'children': [None], 'parents': ['ubuntu:18.04']}}, 'ubuntu': {
+        '18.04': {'children': ['base:1.0.0'], 'parents': []}}}, 'latest': {'base': '1.0.0'}, 'terminated': ['test_image2']}
+    first['latest']['base'] = '1.0.1'
+    second = relations_io.load_yaml('tests/relations.yaml')
+    assert second['latest']['base'] == '1.0.0'
+    assert len(os.listdir(str(tmp_path / "cache" / "relations"))) == 1
+    relations_io.PARSED.clear()
+    assert relations_io.load_yaml('tests/relations.yaml') == second
+    # A damaged sidecar from a restored cache is parsed again instead of failing
+    sidecar_path = str(tmp_path / "cache" / "relations" / os.listdir(str(tmp_path / "cache" / "relations"))[0])
+    assert sidecar_path.endswith(".json")
+    with open(sidecar_path, 'w') as sidecar_file:
+        sidecar_file.write('{"images": ')
+    relations_io.PARSED.clear()
+    assert relations_io.load_yaml('tests/relations.yaml') == second
+
+
+@pytest.mark.test_dump_yaml
+def test_dump_yaml(tmp_path):
+    with open('relations.yaml') as yaml_file:
+        original = yaml_file.read()
+    relations_io.write_yaml(relations_io.load_yaml(
+        'relations.yaml', sidecar=False), str(tmp_path / "relations.yaml"))
+    with open(str(tmp_path / "relations.yaml")) as yaml_file:
+        assert yaml_file.read() == original
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath("scripts/"))
+import result_cache
+
+
+@pytest.mark.test_file_hash
+def test_file_hash(tmp_path):
+    test_file = tmp_path / "unittest.yml"
+    test_file.write_text("commands: []\n")
+    assert result_cache.file_hash(str(test_file)) == \
+        '287258b629a2b80224a65b8df92b834b28c9d3ae981f43ab2d9c72f6adeac010'
+
+
+@pytest.mark.test_result_cache
+def test_result_cache(tmp_path):
+    test_file = tmp_path / "unittest.yml"
+    test_file.write_text("commands: []\n")
+    cache = result_cache.ResultCache(str(tmp_path / "cache"))
+    assert cache.has_passed('sha256:abc', str(test_file)) == False
+    cache.record_pass('sha256:abc', str(test_file), 'bicf/base:1.0.0')
+    assert cache.has_passed('sha256:abc', str(test_file)) == True
+    assert cache.has_passed('sha256:def', str(test_file)) == False
+    assert cache.has_passed(None, str(test_file)) == False
+    test_file.write_text("commands: [{cmd: ls, expect_text: ''}]\n")
+    assert cache.has_passed('sha256:abc', str(test_file)) == False
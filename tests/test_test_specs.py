@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+import yaml
+sys.path.append(os.path.abspath("scripts/"))
+import test_specs
+
+
+@pytest.mark.test_load_specs
+def test_load_specs(tmp_path, monkeypatch):
+    monkeypatch.setenv('AUTODOCKER_CACHE_DIR', str(tmp_path / "cache"))
+    monkeypatch.setattr(test_specs, 'PARSED', {})
+    specs = test_specs.load_specs('tests/1.0.0/unittest.yml')
+    assert specs == [{'cmd': 'parallel --version | head -n1', 'expect_text': 'GNU parallel 20161222\n', 'timeout': None},
+                     {'cmd': 'pandoc --version | head -n2', 'timeout': None,
+                      'expect_text': 'pandoc 1.19.2.4\nCompiled with pandoc-types 1.17.0.5, texmath 0.9.4.4, skylighting 0.3.3.1\n'}]
+    assert len(os.listdir(str(tmp_path / "cache" / "unittest"))) == 1
+    assert test_specs.compile_pattern(specs[0]['expect_text']) is test_specs.compile_pattern('GNU parallel 20161222\n')
+    # A later process reads the sidecar instead of parsing the file again
+    monkeypatch.setattr(test_specs, 'PARSED', {})
+
+    def no_parse(content):
+        raise AssertionError("unittest.yml parsed again")
+    monkeypatch.setattr(yaml, 'safe_load', no_parse)
+    assert test_specs.load_specs('tests/1.0.0/unittest.yml') == specs
+
+
+@pytest.mark.test_load_all
+def test_load_all(tmp_path, monkeypatch):
+    monkeypatch.setenv('AUTODOCKER_CACHE_DIR', str(tmp_path / "cache"))
+    monkeypatch.setattr(test_specs, 'PARSED', {})
+    invalid_path = str(tmp_path / "invalid.yml")
+    with open(invalid_path, 'w') as invalid_file:
+        yaml.safe_dump({'commands': [{'cmd': "tool --version", 'expect_text': "tool (1.0"},
+                                     {'expect_text': "usage", 'timeout': -1}]}, invalid_file)
+    missing_path = str(tmp_path / "missing.yml")
+    specs, errors = test_specs.load_all(['tests/1.0.0/unittest.yml', invalid_path, missing_path])
+    assert list(specs) == ['tests/1.0.0/unittest.yml']
+    assert len(errors[invalid_path]) == 3
+    assert "not a valid regex" in errors[invalid_path][0]
+    assert "has no 'cmd'" in errors[invalid_path][1]
+    assert "not a positive number" in errors[invalid_path][2]
+    assert "unable to read" in errors[missing_path][0]
+    # Only valid files are cached
+    assert len(os.listdir(str(tmp_path / "cache" / "unittest"))) == 1
+    with pytest.raises(SystemExit):
+        test_specs.load_specs(invalid_path)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath('scripts/'))
+import timings
+import tracing
+
+PLAN = {'base:1.0.0': {'path': 'base/1.0.0/Dockerfile', 'depends': set()},
+        'small:1.0.0': {'path': 'small/1.0.0/Dockerfile', 'depends': set()},
+        'child:1.0.0': {'path': 'child/1.0.0/Dockerfile', 'depends': {'base:1.0.0'}}}
+
+
+def span(name, duration, status="ok", **attributes):
+    return {'name': name, 'span_id': os.urandom(8).hex(), 'duration': duration, 'status': status, 'attributes': attributes}
+
+
+@pytest.mark.test_span_timing
+def test_span_timing():
+    assert timings.span_timing(span("build", 12.5, image="base:1.0.0", result="built")) == ('base', '1.0.0', 'build', 12.5)
+    assert timings.span_timing(span("build", 0.5, image="base:1.0.0", result="reused")) is None
+    assert timings.span_timing(span("test", 3.0, image="registry.example.com:5000/org/tool:1.0.0_1",
+                                    unittest="tool/1.0.0+1/unittest.yml", result="passed")) == ('tool', '1.0.0+1', 'test', 3.0)
+    assert timings.span_timing(span("pull", 7.0, image="org/tool:2.0.0")) == ('tool', '2.0.0', 'pull', 7.0)
+    assert timings.span_timing(span("pull", 7.0, status="error", image="org/tool:2.0.0")) is None
+    assert timings.span_timing(span("prefetch.pull", 2.0, image="ubuntu", result="present")) is None
+
+
+@pytest.mark.test_record_timings
+def test_record_timings(tmp_path, monkeypatch):
+    monkeypatch.setenv(timings.TIMINGS_ENV, str(tmp_path / "timings.sqlite"))
+    monkeypatch.setattr(tracing, 'SPANS', [span("build", seconds, image="base:1.0.0", result="built")
+                                           for seconds in range(1, 14)] + [span("pull", 4.0, image="org/base:0.9.0")])
+    timings.save()
+    # Spans already saved are not recorded again
+    timings.save()
+    estimator = timings.Estimator()
+    assert len(estimator.runs[('base', '1.0.0', 'build')]) == timings.HISTORY
+    assert estimator.estimate('base', '1.0.0', 'build') == 8.5
+    # Other tags of the image are used before the default
+    assert estimator.estimate('base', '2.0.0', 'pull') == 4.0
+    assert estimator.estimate('other', '1.0.0', 'build', 300) == 300
+    assert estimator.image_estimate('base', '0.9.0', ['pull', 'test']) == 4.0 + timings.DEFAULT_ESTIMATES['test']
+    assert estimator.image_estimate('other', '1.0.0', ['pull', 'test']) is None
+    assert list(timings.longest_first({'other': '1.0.0', 'base': '1.0.0'}, ['build'], estimator)) == ['base', 'other']
+
+
+@pytest.mark.test_simulate
+def test_simulate():
+    durations = {'base:1.0.0': 10, 'small:1.0.0': 20, 'child:1.0.0': 15}
+    # base starts first, as its chain (25s) is longer than small's (20s), and then small's chain is longer than child's
+    assert timings.simulate(PLAN, durations, 1) == (45, {'base:1.0.0': 10, 'small:1.0.0': 30, 'child:1.0.0': 45})
+    assert timings.simulate(PLAN, durations, 2)[0] == 25
+
+
+@pytest.mark.test_plan_estimate
+def test_plan_estimate(tmp_path, monkeypatch, capfd):
+    monkeypatch.setenv(timings.TIMINGS_ENV, str(tmp_path / "timings.sqlite"))
+    timings.record([('base', '1.0.0', 'build', 100.0), ('base', '1.0.0', 'test', 20.0)])
+    timings.print_plan(["base/1.0.0/Dockerfile"], None, 2, True)
+    out, err = capfd.readouterr()
+    assert "base:1.0.0: ~100s, critical path ~100s, done at ~100s" in out
+    assert "Predicted wall time: ~100s building + ~20s testing = ~120s" in out
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import pytest
+from io import StringIO
+sys.path.append(os.path.abspath('scripts/'))
+import tracing
+
+
+@pytest.mark.test_span
+def test_span(tmp_path, monkeypatch):
+    trace_path = str(tmp_path / "trace.jsonl")
+    monkeypatch.setenv(tracing.TRACE_ENV, trace_path)
+    monkeypatch.delenv(tracing.TRACE_ENV + "_PARENT", raising=False)
+    monkeypatch.setattr(tracing, 'SPANS', [])
+    with pytest.raises(SystemExit):
+        with tracing.entry_point("functions", command="pipeline") as root:
+            with tracing.span("build", image="base:1.0.0") as build_span:
+                build_span.set('exit_code', 0)
+            with pytest.raises(ValueError):
+                with tracing.span("push", image="base:1.0.0", tag="latest"):
+                    raise ValueError("denied")
+            assert os.environ[tracing.TRACE_ENV + "_PARENT"] == root.span_id
+            sys.exit(2)
+    assert tracing.TRACE_ENV + "_PARENT" not in os.environ
+    spans = tracing.load_trace(trace_path)
+    assert [entry['name'] for entry in spans] == ["build", "push", "functions"]
+    assert spans[0]['attributes'] == {'image': "base:1.0.0", 'exit_code': 0}
+    assert spans[0]['parent_id'] == spans[2]['span_id']
+    assert spans[1]['status'] == "error"
+    assert spans[1]['attributes']['error'] == "ValueError: denied"
+    assert spans[2]['status'] == "error"
+    assert spans[2]['attributes']['exit_code'] == 2
+
+
+@pytest.mark.test_summarize
+def test_summarize():
+    spans = [{'name': "build", 'status': "ok", 'duration': 3.0, 'attributes': {'image': "base:1.0.0"}},
+             {'name': "build", 'status': "error", 'duration': 1.0, 'attributes': {'image': "tool:1.0.0"}},
+             {'name': "push", 'status': "ok", 'duration': 5.0, 'attributes': {'image': "base:1.0.0"}}]
+    rows = tracing.summarize(spans)
+    assert [(row['name'], row['count'], row['errors'], row['total'], row['max']) for row in rows] == [
+        ("push", 1, 0, 5.0, 5.0), ("build", 2, 1, 4.0, 3.0)]
+    assert rows[1]['mean'] == 2.0
+    rows = tracing.summarize(spans, "image")
+    assert [(row['name'], row['group']) for row in rows] == [
+        ("push", "base:1.0.0"), ("build", "base:1.0.0"), ("build", "tool:1.0.0")]
+    output = StringIO()
+    tracing.print_summary(spans, "image", output)
+    lines = output.getvalue().splitlines()
+    assert lines[0] == "Timing summary:"
+    assert lines[1].split() == ["span", "image", "count", "errors", "total", "s", "mean", "s", "max", "s"]
+    assert lines[2].split() == ["push", "base:1.0.0", "1", "0", "5.00", "5.00", "5.00"]
@@ -112,3 +112,35 @@ def test_list_cleaner():
     assert temp_list == ['deeptools3.5.0:1.0.1', 'deriva1.4:1.0.1', 'fastqc0.11.9:1.0.1', 'java15:1.0.1', 'multiqc1.10:1.0.0', 'rseqc4.0.0:1.0.1', 'samtools1.11:1.0.1']
     temp_list = update_relations.list_cleaner([[[['null']]]])
     assert temp_list == ['null']
+
+
+@pytest.mark.test_update_graph
+def test_update_graph():
+    with open('tests/relations.yaml') as yaml_file:
+        update_relations.ORIDATA = yaml.safe_load(yaml_file)
+    yaml_file.close()
+    graph = update_relations.relations_graph.RelationsGraph(
+        update_relations.ORIDATA)
+    update_relations.update_graph(
+        graph, 'newtool', '1.0.0', ['base:1.0.0'])
+    data = graph.to_data()
+    assert data['images']['newtool']['1.0.0'] == {
+        'children': [None], 'parents': ['base:1.0.0']}
+    assert data['images']['base']['1.0.0']['children'] == ['newtool:1.0.0']
+    assert data['images']['ubuntu']['18.04']['children'] == ['base:1.0.0']
+    assert data['latest']['newtool'] == '1.0.0'
+
+
+@pytest.mark.test_update_children
+def test_update_children():
+    with open('tests/relations.yaml') as yaml_file:
+        update_relations.ORIDATA = yaml.safe_load(yaml_file)
+    yaml_file.close()
+    issues = update_relations.issue_sync.IssueSync(
+        update_relations.issue_sync.InMemoryBackend(['Update open:1.0.0 to open:1.1.0']))
+    child_list = ['child:1.0.0', None, 'open:1.0.0', 'test_image2:1.0.0']
+    update_relations.update_children(child_list, 'minor', issues)
+    assert child_list == ['child:1.1.0', None,
+                          'open:1.1.0', 'test_image2:1.0.0']
+    assert [title for title, body in issues.queued] == [
+        'Update child:1.0.0 to child:1.1.0']
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath("scripts/"))
+import validate_version
+
+
+@pytest.mark.test_check_version_info
+def test_check_version_info():
+    assert validate_version.check_version_info('9.0.0', '10.0.0') == True
+    assert validate_version.check_version_info('1.9.0', '1.10.0') == True
+    assert validate_version.check_version_info('1.0.9', '1.0.10') == True
+    assert validate_version.check_version_info('1.0.1', '1.0.1') == False
+    assert validate_version.check_version_info('10.0.0', '9.0.0') == False
+    assert validate_version.check_version_info('1.0.0', 'latest') == False
+
+
+@pytest.mark.test_check_exists
+def test_check_exists():
+    master_yaml = validate_version.load_yaml('tests/relations.yaml')
+    master_yaml['images']['base']['10.0.0'] = master_yaml['images']['base']['1.0.0']
+    master_yaml['images']['base']['9.0.0'] = master_yaml['images']['base']['1.0.0']
+    assert validate_version.check_exists(master_yaml, 'base', '1.0.0') == False
+    assert validate_version.check_exists(master_yaml, 'base', '9.5.0') == False
+    assert validate_version.check_exists(master_yaml, 'base', '10.0.1') == True
+    assert validate_version.check_exists(master_yaml, 'new', '1.0.0') == True
+
+
+@pytest.mark.test_validate_dockerfile
+def test_validate_dockerfile(tmp_path, monkeypatch, capfd):
+    os.makedirs(str(tmp_path / "new_tool" / "1.0.0"))
+    dockerfile_path = str(tmp_path / "new_tool" / "1.0.0" / "Dockerfile")
+    with open(dockerfile_path, 'w') as dockerfile_file:
+        dockerfile_file.write("FROM ubuntu:18.04\nRUN make\n")
+    monkeypatch.setattr(sys, 'argv', ['validate_version.py', 'tests/relations.yaml', dockerfile_path])
+    validate_version.main()
+    # A new version is still rejected when its Dockerfile does not parse
+    with open(dockerfile_path, 'w') as dockerfile_file:
+        dockerfile_file.write("RUN make\nFROB x\n")
+    with pytest.raises(SystemExit):
+        validate_version.main()
+    test_out, test_err = capfd.readouterr()
+    assert "Error: {}: line 1: RUN comes before the first FROM".format(dockerfile_path) in test_err
+    assert validate_version.check_dockerfile(dockerfile_path) == False
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath("scripts/"))
+import versions
+
+
+@pytest.mark.test_parse_version
+def test_parse_version():
+    assert versions.parse_version('10.0.0') > versions.parse_version('9.0.0')
+    assert versions.parse_version('1.10.0') > versions.parse_version('1.9.9')
+    assert versions.parse_version('18.04') < versions.parse_version('20.04')
+    assert versions.version_parts('2.3') == (2, 3, 0)
+
+
+@pytest.mark.test_update_type
+def test_update_type():
+    assert versions.update_type('1.0.0', '2.0.0') == 'major'
+    assert versions.update_type('1.9.0', '1.10.0') == 'minor'
+    assert versions.update_type('1.0.0', '1.0.1') == 'patch'
+    assert versions.update_type('1.0.0', '1.0.0') == 'patch'
+    assert versions.update_type('2.0.0', '1.5.0') == 'major'
+
+
+@pytest.mark.test_version_index
+def test_version_index():
+    index = versions.VersionIndex({'tool': {'9.0.0': {}, '10.0.0': {}, '1.2.0': {}},
+                                   'ubuntu': {'18.04': {}}})
+    assert index.sorted_versions('tool') == ['1.2.0', '9.0.0', '10.0.0']
+    assert index.latest('tool') == '10.0.0'
+    assert index.latest('missing') == None
+    assert index.predecessor('tool', '9.5.0') == '9.0.0'
+    assert index.predecessor('tool', '9.0.0') == '1.2.0'
+    assert index.predecessor('tool', '1.0.0') == None
+    assert index.has('tool')
+    assert index.has('tool', '9.0.0')
+    assert not index.has('tool', '9.0.1')
+    index.add('tool', '11.0.0')
+    index.add('tool', '11.0.0')
+    assert index.sorted_versions('tool')[-2:] == ['10.0.0', '11.0.0']